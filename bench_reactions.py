@@ -0,0 +1,270 @@
+"""Reakció rang benchmark és visszajátszó – Discord kapcsolat nélkül.
+
+Hamis guild / rang / tag objektumokat épít (akár több ezer ranggal és taggal), szintetikus
+reakció rang konfigurációt generál (vagy egy meglévő reaction_roles.json-t tölt be), majd
+RawReactionActionEvent payloadokat játszik vissza sorozatokban (burst) az
+on_raw_reaction_add / on_raw_reaction_remove handlereken át. A rang módosítások a bot
+valódi RoleUpdateQueue-ján mennek ki; a member.edit egy hamis, késleltethető API hívás.
+
+Riport: események / mp, eseményenkénti handler késés (p50/p95/p99), kimenő rang API hívások
+száma (member.edit), összevont / kioltott módosítások, a sor kiürülésének ideje.
+
+Példák:
+    python bench_reactions.py --events 20000 --roles 2000 --members 5000
+    python bench_reactions.py --events 20000 --burst 2000 --gap 2 --edit-latency 150 --record burst.jsonl
+    python bench_reactions.py --replay burst.jsonl --reaction-roles reaction_roles.json
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+UNICODE_EMOJIS = ["👍", "👎", "🔥", "🎮", "🎵", "🎨", "📚", "⚽", "🏀", "🎲", "🍕", "🐱", "🐶", "🌙", "⭐", "❤️", "💙", "💚", "💛", "💜"]
+
+# ------------------------
+# Hamis Discord objektumok
+# Csak azt tudják, amit a reakció handlerek és a RoleUpdateQueue használ.
+# ------------------------
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+
+class FakeRole:
+    def __init__(self, role_id, name):
+        self.id = role_id
+        self.name = name
+
+class FakeMember:
+    def __init__(self, guild, member_id):
+        self.guild = guild
+        self.id = member_id
+        self.roles = [guild.default_role]
+
+    def __str__(self):
+        return f"member{self.id}"
+
+    async def edit(self, *, roles, reason=None):
+        api = self.guild.api
+        api["calls"] += 1
+        api["inflight"] += 1
+        api["max_inflight"] = max(api["max_inflight"], api["inflight"])
+        try:
+            if api["latency"]:
+                await asyncio.sleep(api["latency"])
+            self.roles = [self.guild.default_role] + [r for r in roles if r.id != self.guild.id]
+            api["role_changes"] += len(roles)
+            return self
+        finally:
+            api["inflight"] -= 1
+
+class FakeGuild:
+    def __init__(self, guild_id, role_names, api):
+        self.id = guild_id
+        self.api = api
+        self.default_role = FakeRole(guild_id, "@everyone")  # Discordon az @everyone ID-ja a guild ID
+        self.roles = [self.default_role] + [FakeRole(guild_id * 10 + i + 1, name) for i, name in enumerate(role_names)]
+        self._roles = {r.id: r for r in self.roles}
+        self._members = {}
+
+    def get_role(self, role_id):
+        return self._roles.get(role_id)
+
+    def get_member(self, member_id):
+        # a visszajátszott felvételben bármely user ID előfordulhat -> igény szerint jön létre
+        member = self._members.get(member_id)
+        if member is None:
+            member = self._members[member_id] = FakeMember(self, member_id)
+        return member
+
+# ------------------------
+# Konfiguráció és események
+# ------------------------
+def synthetic_reaction_roles(args, rng):
+    """guild_id -> message_id -> emoji -> rang név; unicode és egyedi emojik vegyesen."""
+    config = {}
+    for g in range(args.guilds):
+        guild_id = 900000000000000000 + g
+        messages = {}
+        for m in range(args.messages):
+            emojis = {}
+            for e in range(args.emojis_per_message):
+                if e < len(UNICODE_EMOJIS) and rng.random() < 0.5:
+                    emoji = UNICODE_EMOJIS[e]
+                else:
+                    emoji = f"<:bench{e}:{800000000000000000 + m * 1000 + e}>"
+                emojis[emoji] = f"rang{rng.randrange(args.roles)}"
+            messages[910000000000000000 + g * 10000 + m] = emojis
+        config[guild_id] = messages
+    return config
+
+def generate_events(args, reaction_roles, rng):
+    """Szintetikus eseménysor: a felhasználók ki-be kapcsolgatják a reakciókat, miss_ratio arányban
+    reakció-rang nélküli üzenetre / emojira."""
+    targets = [(gid, mid, emoji) for gid, msgs in reaction_roles.items() for mid, emojis in msgs.items() for emoji in emojis]
+    guild_ids = list(reaction_roles)
+    state = set()  # (guild, message, emoji, user) -> rajta van-e a reakció
+    events = []
+    for _ in range(args.events):
+        user_id = 700000000000000000 + rng.randrange(args.members)
+        if rng.random() < args.miss_ratio or not targets:
+            gid = rng.choice(guild_ids)
+            events.append({"type": "add", "guild_id": gid, "channel_id": 1, "message_id": 1 + rng.randrange(10 ** 6),
+                           "user_id": user_id, "emoji": rng.choice(UNICODE_EMOJIS)})
+            continue
+        gid, mid, emoji = rng.choice(targets)
+        key = (gid, mid, emoji, user_id)
+        kind = "remove" if key in state and rng.random() < args.remove_ratio * 2 else "add"
+        (state.discard if kind == "remove" else state.add)(key)
+        events.append({"type": kind, "guild_id": gid, "channel_id": 1, "message_id": mid, "user_id": user_id, "emoji": emoji})
+    return events
+
+def build_payload(discord, event):
+    data = {
+        "message_id": event["message_id"], "channel_id": event["channel_id"], "user_id": event["user_id"],
+        "guild_id": event["guild_id"], "type": 0,
+    }
+    event_type = "REACTION_ADD" if event["type"] == "add" else "REACTION_REMOVE"
+    return discord.RawReactionActionEvent(data, discord.PartialEmoji.from_str(event["emoji"]), event_type)
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    index = max(0, min(len(values) - 1, -(-len(values) * pct // 100) - 1))
+    return values[int(index)]
+
+async def run(args, bot, bursts):
+    role_queue = bot.role_queue
+    role_queue.start()
+    latencies = []
+    handlers = {"REACTION_ADD": bot.on_raw_reaction_add, "REACTION_REMOVE": bot.on_raw_reaction_remove}
+    log = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    perf = time.perf_counter
+    with log:
+        start = perf()
+        handler_time = 0.0
+        for i, burst in enumerate(bursts):
+            for payload in burst:
+                t0 = perf()
+                await handlers[payload.event_type](payload)
+                dt = perf() - t0
+                handler_time += dt
+                latencies.append(dt)
+            if args.gap and i < len(bursts) - 1:
+                await asyncio.sleep(args.gap)
+        dispatched = perf()
+        # a sor kiürítése: várunk, amíg minden függő módosítás kimegy
+        while True:
+            status = role_queue.status()
+            if status["depth"] == 0 and status["inflight"] == 0:
+                break
+            await asyncio.sleep(0.05)
+        drained = perf()
+    return {
+        "latencies": sorted(latencies),
+        "handler_time": handler_time,
+        "dispatch": dispatched - start,
+        "drain": drained - dispatched,
+        "queue": role_queue.status(),
+    }
+
+def report(args, events, result, api):
+    lat = result["latencies"]
+    n = len(lat)
+    matched = result["queue"]["submitted"]
+    print()
+    print(f"=== Reakció benchmark: {n} esemény, {args.guilds} szerver, {args.roles} rang, "
+          f"{args.members} tag, ablak {args.window} mp, edit késés {args.edit_latency} ms ===")
+    print(f"handler áteresztés: {n / result['handler_time']:.0f} esemény/mp (csak handler idő), "
+          f"{n / result['dispatch']:.0f} esemény/mp (falióra, burst szünetekkel)")
+    print(f"handler késés p50/p95/p99/max: "
+          + " / ".join(f"{percentile(lat, p) * 1e6:.1f}" for p in (50, 95, 99)) + f" / {lat[-1] * 1e6:.1f} µs")
+    print(f"reakció-rang találat: {matched} ({matched / n:.0%}), kioltott (add+remove ugyanarra): {result['queue']['cancelled']}")
+    print(f"kimenő rang API hívások (member.edit): {api['calls']} | eseményenként: {api['calls'] / max(1, matched):.3f} | "
+          f"nincs változás (noop): {result['queue']['noop']} | hibák: {result['queue']['errors']}")
+    print(f"max egyidejű API hívás: {api['max_inflight']} | sor kiürülés: {result['drain']:.2f} mp | "
+          f"max várakozás a sorban: {result['queue']['max_lag']} mp")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="on_raw_reaction_add / remove benchmark hamis guild / rang / tag objektumokkal")
+    parser.add_argument("--guilds", type=int, default=1)
+    parser.add_argument("--roles", type=int, default=2000, help="rangok száma szerverenként")
+    parser.add_argument("--members", type=int, default=5000, help="különböző reagáló tagok")
+    parser.add_argument("--messages", type=int, default=20, help="reakció-rang üzenetek szerverenként")
+    parser.add_argument("--emojis-per-message", type=int, default=20)
+    parser.add_argument("--events", type=int, default=20000, help="generált események száma")
+    parser.add_argument("--remove-ratio", type=float, default=0.3, help="eltávolítások körülbelüli aránya")
+    parser.add_argument("--miss-ratio", type=float, default=0.2, help="nem reakció-rang üzenetre érkező reakciók aránya")
+    parser.add_argument("--burst", type=int, default=5000, help="események burstönként")
+    parser.add_argument("--gap", type=float, default=0.5, help="szünet két burst között (mp)")
+    parser.add_argument("--edit-latency", type=float, default=100.0, help="hamis member.edit válaszidő (ms)")
+    parser.add_argument("--window", type=float, default=None, help="ROLE_QUEUE_WINDOW felülírása (mp)")
+    parser.add_argument("--concurrency", type=int, default=None, help="ROLE_QUEUE_CONCURRENCY felülírása")
+    parser.add_argument("--reaction-roles", default=None, help="meglévő reaction_roles.json a szintetikus helyett")
+    parser.add_argument("--record", default=None, help="a generált eseménysor mentése JSONL-be")
+    parser.add_argument("--replay", default=None, help="felvett eseménysor (JSONL) visszajátszása")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--verbose", action="store_true", help="a bot saját logjai is látszanak")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    rng = random.Random(args.seed)
+    if args.reaction_roles:
+        with open(args.reaction_roles, "r", encoding="utf-8") as f:
+            config = {int(gid): {int(mid): em for mid, em in msgs.items()} for gid, msgs in json.load(f).items()}
+    else:
+        config = synthetic_reaction_roles(args, rng)
+    if args.replay:
+        with open(args.replay, "r", encoding="utf-8") as f:
+            events = [json.loads(line) for line in f if line.strip()]
+    else:
+        events = generate_events(args, config, rng)
+    if args.record:
+        with open(args.record, "w", encoding="utf-8") as f:
+            for event in events:
+                f.write(json.dumps(event, ensure_ascii=False) + "\n")
+
+    # a bot.py modul szinten fájlokat tölt be -> ideiglenes munkakönyvtárból importáljuk
+    # hibás kilépéskor is törlődik (a TemporaryDirectory finalizere takarít)
+    tmpdir = tempfile.TemporaryDirectory(prefix="darky_bench_")
+    workdir = tmpdir.name
+    guild_ids = set(config) | {e["guild_id"] for e in events}
+    with open(os.path.join(workdir, "Reaction.ID.txt"), "w", encoding="utf-8") as f:
+        f.write("\n".join(str(gid) for gid in sorted(guild_ids)))
+    if args.window is not None:
+        os.environ["ROLE_QUEUE_WINDOW"] = str(args.window)
+    if args.concurrency is not None:
+        os.environ["ROLE_QUEUE_CONCURRENCY"] = str(args.concurrency)
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    with contextlib.redirect_stdout(io.StringIO()):
+        import bot
+        import discord
+    args.window = bot.ROLE_QUEUE_WINDOW
+
+    api = {"calls": 0, "role_changes": 0, "inflight": 0, "max_inflight": 0, "latency": args.edit_latency / 1000.0}
+    role_names = {name for msgs in config.values() for emojis in msgs.values() for name in emojis.values()}
+    role_names = sorted(role_names | {f"rang{i}" for i in range(args.roles)})
+    guilds = {gid: FakeGuild(gid, role_names, api) for gid in guild_ids}
+    bot.bot.get_guild = guilds.get
+    bot.bot._connection.user = FakeUser(1)
+    bot.reaction_roles.clear()
+    bot.reaction_roles.update(config)
+    bot.rebuild_reaction_role_index()
+
+    payloads = [build_payload(discord, e) for e in events]
+    bursts = [payloads[i:i + args.burst] for i in range(0, len(payloads), args.burst)] if args.burst else [payloads]
+    result = asyncio.run(run(args, bot, bursts))
+    report(args, events, result, api)
+    os.chdir(REPO_DIR)
+    tmpdir.cleanup()
+
+if __name__ == "__main__":
+    main()
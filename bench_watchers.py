@@ -0,0 +1,326 @@
+"""Watcher terheléses benchmark – hálózat nélkül.
+
+Helyi aiohttp szervert indít, ami a Twitch Helix /streams, a YouTube Data API (channels, search)
+és a Kick /api/v2/channels végpontokat utánozza, a Discord csatornákat pedig egy memóriabeli
+"sink" helyettesíti. Szintetikus feliratkozás fájlokat generál egy ideiglenes könyvtárba,
+a bot.py-t a *_API_BASE beállításokkal a hamis szerverre irányítja, majd a
+twitch_watch_cycle / youtube_watch_cycle / kick_watch_cycle köröket futtatja és méri.
+
+Riport: kör idő, kérések / kör, értesítések, értesítési késés (észlelés / kézbesítés), memória.
+
+Példák:
+    python bench_watchers.py --subs 1000
+    python bench_watchers.py --subs 10000 --guilds 500 --latency 80 --error-rate 0.02 --cycles 5
+    python bench_watchers.py --platforms twitch --subs 10000 --scheduler --interval 10
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from aiohttp import web
+
+try:
+    import resource
+except ImportError:  # Windows alatt nincs
+    resource = None
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+PLATFORMS = ("twitch", "youtube", "kick")
+
+# ------------------------
+# Hamis provider szerver
+# Minden streamernek van egy élő állapota; a flipper task FLIP_INTERVAL-onként
+# minden streamert flip valószínűséggel átbillent (offline <-> élő), az élővé válás
+# ideje lesz a started_at / created_at. A kéréseket végpontonként számoljuk.
+# ------------------------
+class FakeProviders:
+    def __init__(self, streamers, latency, error_rate, flip, flip_interval, seed=None):
+        self.rng = random.Random(seed)
+        self.latency = latency / 1000.0
+        self.error_rate = error_rate
+        self.flip = flip
+        self.flip_interval = flip_interval
+        # (platform, username) -> {"live": bool, "started": unix, "session": int}
+        self.streams = {key: {"live": False, "started": 0.0, "session": 0} for key in streamers}
+        self.requests = {platform: 0 for platform in PLATFORMS}
+        self.errors = {platform: 0 for platform in PLATFORMS}
+        self.flips = 0
+
+    async def flipper(self):
+        while True:
+            await asyncio.sleep(self.flip_interval)
+            now = time.time()
+            for st in self.streams.values():
+                if self.rng.random() < self.flip:
+                    st["live"] = not st["live"]
+                    if st["live"]:
+                        st["started"] = now
+                        st["session"] += 1
+                    self.flips += 1
+
+    async def _simulate(self, platform):
+        """Késleltetés (0.5x–1.5x jitterrel) és véletlen 500-as hiba; True = hiba."""
+        self.requests[platform] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency * (0.5 + self.rng.random()))
+        if self.rng.random() < self.error_rate:
+            self.errors[platform] += 1
+            return True
+        return False
+
+    @staticmethod
+    def _iso(ts, sep="T"):
+        return datetime.fromtimestamp(ts, timezone.utc).isoformat(sep=sep)
+
+    async def helix_streams(self, request):
+        if await self._simulate("twitch"):
+            return web.json_response({"error": "Internal Server Error"}, status=500)
+        data = []
+        for login in request.query.getall("user_login", []):
+            st = self.streams.get(("twitch", login))
+            if st and st["live"]:
+                data.append({
+                    "user_login": login, "user_name": login, "game_name": "Bench",
+                    "title": f"bench #{st['session']}", "started_at": self._iso(st["started"]),
+                })
+        return web.json_response({"data": data})
+
+    async def youtube_channels(self, request):
+        if await self._simulate("youtube"):
+            return web.json_response({"error": {"code": 500}}, status=500)
+        username = request.query.get("forUsername", "").lower()
+        items = [{"id": f"UC{username}"}] if ("youtube", username) in self.streams else []
+        return web.json_response({"items": items})
+
+    async def youtube_search(self, request):
+        if await self._simulate("youtube"):
+            return web.json_response({"error": {"code": 500}}, status=500)
+        username = request.query.get("channelId", "")[2:]
+        st = self.streams.get(("youtube", username))
+        items = []
+        if st and st["live"] and request.query.get("eventType") == "live":
+            items.append({
+                "id": {"videoId": f"{username}-{st['session']}"},
+                "snippet": {"title": f"bench #{st['session']}"},
+            })
+        return web.json_response({"items": items})
+
+    async def kick_channel(self, request):
+        if await self._simulate("kick"):
+            return web.json_response({"message": "Server Error"}, status=500)
+        username = request.match_info["username"].lower()
+        st = self.streams.get(("kick", username))
+        if st is None:
+            return web.json_response({"message": "Not found"}, status=404)
+        livestream = None
+        if st["live"]:
+            livestream = {"session_title": f"bench #{st['session']}", "created_at": self._iso(st["started"], " ")}
+        return web.json_response({"slug": username, "livestream": livestream})
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get("/helix/streams", self.helix_streams)
+        app.router.add_get("/youtube/v3/channels", self.youtube_channels)
+        app.router.add_get("/youtube/v3/search", self.youtube_search)
+        app.router.add_get("/kick/api/v2/channels/{username}", self.kick_channel)
+        return app
+
+# ------------------------
+# Discord sink: a bot.get_channel helyett; az üzenetet csak megszámolja
+# ------------------------
+class SinkChannel:
+    def __init__(self, sink, channel_id):
+        self.sink = sink
+        self.id = channel_id
+
+    async def send(self, content=None, **kwargs):
+        if self.sink.latency:
+            await asyncio.sleep(self.sink.latency)
+        self.sink.messages += 1
+
+class DiscordSink:
+    def __init__(self, latency):
+        self.latency = latency / 1000.0
+        self.messages = 0
+        self._channels = {}
+
+    def get_channel(self, channel_id):
+        channel = self._channels.get(channel_id)
+        if channel is None:
+            channel = self._channels[channel_id] = SinkChannel(self, channel_id)
+        return channel
+
+# ------------------------
+# Szintetikus feliratkozások
+# subs feliratkozás guilds szerver között; a streamerek száma streamers (ennyi egyedi név),
+# így ugyanazt a streamert több szerver is figyelheti (a deduplikált index ezt használja ki).
+# ------------------------
+def generate_subscriptions(platform, subs, guilds, streamers, rng):
+    names = [f"{platform[:2]}bench{i:05d}" for i in range(streamers)]
+    rows, used = [], set()
+    for i in range(subs):
+        guild_id = 100000000000000000 + i % guilds
+        username = names[i % streamers] if i < streamers else rng.choice(names)
+        if (guild_id, username) in used:
+            continue
+        used.add((guild_id, username))
+        rows.append({"username": username, "channel_id": 200000000000000000 + guild_id % 1000, "guild_id": guild_id})
+    return rows
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def max_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def fmt_rollup(rollup):
+    if not rollup:
+        return "–"
+    return f"{rollup['p50']} / {rollup['p95']} / {rollup['p99']}"
+
+async def run(args, bot, providers, sink):
+    runner = web.AppRunner(providers.app())
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.port).start()
+    bot.json_store.start()
+    if not args.real_rate_limits:
+        for name in list(bot.rate_limiters):
+            bot.rate_limiters[name] = bot.RateLimiter(name, 1e9, 1e9)
+    if args.concurrency:
+        bot.WATCHER_CONCURRENCY = args.concurrency
+    flipper = asyncio.create_task(providers.flipper())
+    cycles = {"twitch": bot.twitch_watch_cycle, "youtube": bot.youtube_watch_cycle, "kick": bot.kick_watch_cycle}
+    results = {platform: [] for platform in args.platforms}
+    log = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    try:
+        for n in range(1, args.cycles + 1):
+            for platform in args.platforms:
+                if not args.scheduler:
+                    # friss ütemező: mindenki esedékes (teljes kör, legrosszabb eset)
+                    bot.poll_scheduler = bot.PollScheduler()
+                requests_before = providers.requests[platform]
+                messages_before = sink.messages
+                start = time.perf_counter()
+                with log:
+                    await cycles[platform]()
+                elapsed = time.perf_counter() - start
+                row = {
+                    "cycle": n, "seconds": elapsed,
+                    "requests": providers.requests[platform] - requests_before,
+                    "notifications": sink.messages - messages_before,
+                    "carryover": len(bot.watcher_carryover[platform]),
+                }
+                results[platform].append(row)
+                print(f"[{platform}] kör {n}: {elapsed:.3f} mp, {row['requests']} kérés, "
+                      f"{row['notifications']} üzenet, {row['carryover']} átvitt")
+            if n < args.cycles:
+                await asyncio.sleep(args.interval)
+    finally:
+        flipper.cancel()
+        await runner.cleanup()
+        await bot.json_store.close()
+        session = bot.http_session
+        if session is not None and not session.closed:
+            await session.close()
+    return results
+
+def report(args, bot, providers, sink, results):
+    print()
+    print(f"=== Összesítés: {args.subs} feliratkozás / platform, {args.guilds} szerver, "
+          f"{args.cycles} kör, késés {args.latency} ms, hibaarány {args.error_rate}, flip {args.flip} ===")
+    for platform, rows in results.items():
+        if not rows:
+            continue
+        times = sorted(r["seconds"] for r in rows)
+        summary = bot.latency_tracker.summary(platform)
+        print(f"{platform}:")
+        print(f"  streamerek: {len(bot.watched_streamers(platform))} | "
+              f"kör idő átlag {sum(times) / len(times):.3f} mp, max {times[-1]:.3f} mp")
+        print(f"  kérések / kör: {sum(r['requests'] for r in rows) / len(rows):.1f} | "
+              f"hibás válasz összesen: {providers.errors[platform]}")
+        print(f"  értesítések: {sum(r['notifications'] for r in rows)}")
+        if summary:
+            print(f"  észlelési késés p50/p95/p99: {fmt_rollup(summary['detection'])} mp")
+            print(f"  kézbesítési késés p50/p95/p99: {fmt_rollup(summary['delivery'])} mp")
+    print(f"Discord sink üzenetek: {sink.messages} | flipek: {providers.flips} | max RSS: {max_rss_mb()} MB")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Watcher benchmark hamis Twitch / YouTube / Kick / Discord szerverekkel")
+    parser.add_argument("--subs", type=int, default=1000, help="feliratkozások száma platformonként")
+    parser.add_argument("--guilds", type=int, default=50, help="szerverek száma")
+    parser.add_argument("--streamers", type=int, default=None, help="egyedi streamerek száma (alap: subs / 2)")
+    parser.add_argument("--platforms", default="twitch,youtube,kick", help="vesszővel elválasztva")
+    parser.add_argument("--cycles", type=int, default=3, help="mért körök száma")
+    parser.add_argument("--interval", type=float, default=2.0, help="szünet két kör között (mp)")
+    parser.add_argument("--latency", type=float, default=50.0, help="hamis API válaszidő (ms, 0.5x–1.5x jitter)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="500-as válaszok aránya (0–1)")
+    parser.add_argument("--flip", type=float, default=0.002, help="élő <-> offline váltás valószínűsége flipenként")
+    parser.add_argument("--flip-interval", type=float, default=1.0, help="flipek közti idő (mp)")
+    parser.add_argument("--discord-latency", type=float, default=30.0, help="channel.send válaszidő (ms)")
+    parser.add_argument("--concurrency", type=int, default=None, help="WATCHER_CONCURRENCY felülírása")
+    parser.add_argument("--scheduler", action="store_true",
+                        help="valódi adaptív ütemező (csak az esedékesek); alap: minden körben mindenki")
+    parser.add_argument("--real-rate-limits", action="store_true", help="a bot rate limitjei maradnak érvényben")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--verbose", action="store_true", help="a bot saját logjai is látszanak")
+    args = parser.parse_args(argv)
+    args.platforms = [p.strip() for p in args.platforms.split(",") if p.strip() in PLATFORMS]
+    args.streamers = args.streamers or max(1, args.subs // 2)
+    args.port = free_port()
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    rng = random.Random(args.seed)
+    # hibás kilépéskor is törlődik (a TemporaryDirectory finalizere takarít)
+    tmpdir = tempfile.TemporaryDirectory(prefix="darky_bench_")
+    workdir = tmpdir.name
+    files = {"twitch": "twitch_streams.json", "youtube": "youtube_streams.json", "kick": "kick_streams.json"}
+    streamers = []
+    for platform, filename in files.items():
+        rows = generate_subscriptions(platform, args.subs, args.guilds, args.streamers, rng) if platform in args.platforms else []
+        with open(os.path.join(workdir, filename), "w", encoding="utf-8") as f:
+            json.dump(rows, f)
+        streamers.extend({(platform, r["username"]) for r in rows})
+
+    # a bot.py modul szinten tölti be a fájlokat és olvassa a környezetet -> import előtt állítjuk be
+    base = f"http://127.0.0.1:{args.port}"
+    os.environ.update({
+        "TWITCH_API_BASE": f"{base}/helix",
+        "YOUTUBE_API_BASE": f"{base}/youtube/v3",
+        "KICK_API_BASE": f"{base}/kick/api/v2",
+        "TWITCH_CLIENT_ID": "bench",
+        "TWITCH_ACCESS_TOKEN": "bench",
+        "YOUTUBE_API_KEY": "bench",
+        "YOUTUBE_MODE": "api",
+        "TWITCH_MODE": "poll",
+    })
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    with contextlib.redirect_stdout(io.StringIO()):
+        import bot
+
+    providers = FakeProviders(streamers, args.latency, args.error_rate, args.flip, args.flip_interval, args.seed)
+    sink = DiscordSink(args.discord_latency)
+    bot.bot.get_channel = sink.get_channel
+    results = asyncio.run(run(args, bot, providers, sink))
+    report(args, bot, providers, sink, results)
+    os.chdir(REPO_DIR)
+    tmpdir.cleanup()
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,20 @@ from aiohttp import web
 import asyncio
 import aiohttp
 import traceback
-from datetime import datetime
+import io
+import base64
+import gzip
+import contextlib
+import functools
+import signal
+import re
+import hmac
+import hashlib
+from xml.etree import ElementTree as ET
+import time
+import heapq
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
 
 # ------------------------
 # ENV / Konfiguráció
@@ -16,7 +29,23 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 TWITCH_CLIENT_ID = os.getenv("TWITCH_CLIENT_ID")
 TWITCH_ACCESS_TOKEN = os.getenv("TWITCH_ACCESS_TOKEN")  # OAuth token vagy app token (ami nálad van)
+TWITCH_API_BASE = os.getenv("TWITCH_API_BASE", "https://api.twitch.tv/helix")
+# Twitch figyelés módja: "poll" = Helix polling, "eventsub" = EventSub WebSocket (polling csak tartaléknak)
+# Figyelem: WebSocket EventSub-hoz user access token kell (app token nem működik).
+TWITCH_MODE = os.getenv("TWITCH_MODE", "poll").lower()
+TWITCH_EVENTSUB_WS_URL = os.getenv("TWITCH_EVENTSUB_WS_URL", "wss://eventsub.wss.twitch.tv/ws")
 YOUTUBE_API_KEY = os.getenv("YOUTUBE_API_KEY")  # YouTube Data API kulcs
+YOUTUBE_API_BASE = os.getenv("YOUTUBE_API_BASE", "https://www.googleapis.com/youtube/v3")
+# YouTube figyelés módja: "api" = search?eventType=live polling, "feed" = Atom feed (+ WebSub push, ha van callback URL)
+YOUTUBE_MODE = os.getenv("YOUTUBE_MODE", "api").lower()
+YOUTUBE_FEED_URL = os.getenv("YOUTUBE_FEED_URL", "https://www.youtube.com/feeds/videos.xml")
+WEBSUB_HUB_URL = os.getenv("WEBSUB_HUB_URL", "https://pubsubhubbub.appspot.com/subscribe")
+WEBSUB_CALLBACK_URL = os.getenv("WEBSUB_CALLBACK_URL")  # pl. https://<render-app>.onrender.com/websub/youtube
+WEBSUB_SECRET = os.getenv("WEBSUB_SECRET")  # HMAC titok a push értesítésekhez (nélküle a push ki van kapcsolva)
+# aláírás nélkül bárki hamis Atom pusht küldhetne a végpontra -> push csak titokkal
+WEBSUB_ENABLED = bool(WEBSUB_CALLBACK_URL and WEBSUB_SECRET)
+if WEBSUB_CALLBACK_URL and not WEBSUB_SECRET:
+    print("⚠️ WEBSUB_CALLBACK_URL be van állítva, de WEBSUB_SECRET nincs: a WebSub push ki van kapcsolva (csak feed pollozás).")
 
 # Fájlnevek
 ALLOWED_GUILDS_FILE = "Reaction.ID.txt"
@@ -26,10 +55,577 @@ TWITCH_FILE = "twitch_streams.json"  # <- ide írod a párosításokat
 TWITCH_INTERNAL_FILE = "twitch_streams_state.json"  # opcionális belső állapotmentés (nem kötelező)
 YOUTUBE_FILE = "youtube_streams.json"
 YOUTUBE_INTERNAL_FILE = "youtube_streams_state.json"
+YOUTUBE_CHANNEL_CACHE_FILE = "youtube_channel_cache.json"  # username -> YouTube channelId feloldási cache
+YOUTUBE_FEED_STATE_FILE = "rss_youtube_streams.json"  # Atom feed / WebSub állapot (ETag, látott videók, feliratkozások)
+AI_CACHE_FILE = os.getenv("AI_CACHE_FILE")  # opcionális: AI válasz cache lemezre mentése (pl. ai_cache.json)
+AI_CACHE_OPTOUT_FILE = "ai_cache_optout.json"  # szerverek, ahol az AI válasz cache ki van kapcsolva
+COMMANDS_ALLOW_FILE = "commands_allow.txt"    # 0: csak admin + beépített jogosultságok, 1: + commands_rank.txt
+COMMANDS_RANK_FILE = "commands_rank.txt"      # rang nevek / user ID-k (lásd load_permission_config)
+ALL_SERVER_ALLOW_FILE = "all_server_allow.txt"  # 0: csak a szerver szekciók, 1: a közös rangok minden szerveren
 
 # Áttetszőség beállítás (0-100) a státusz oldalon
 TRANSPARENCY = 100
 
+# ------------------------
+# Közös HTTP session (keep-alive, kapcsolat pool, DNS cache)
+# A setup_hook hozza létre, a bot leállításakor záródik; minden kimenő kérés ezt használja,
+# így a pollok és AI hívások meleg (már felépített TLS) kapcsolatokat kapnak.
+# ------------------------
+HTTP_TIMEOUT = aiohttp.ClientTimeout(total=15, connect=5)  # API pollok (Twitch, YouTube, Kick)
+AI_TIMEOUT = aiohttp.ClientTimeout(total=60, connect=5)    # Gemini / OpenAI hívások
+AI_STREAM_TIMEOUT = aiohttp.ClientTimeout(total=180, connect=5, sock_read=60)  # streamelt AI válasz (darabok között max. 60 mp)
+AI_IMAGE_TIMEOUT = aiohttp.ClientTimeout(total=240, connect=5)  # képgenerálás (gpt-image-1 gyakran 60 mp felett)
+HTTP_POOL_LIMIT = 100          # összes egyidejű kapcsolat
+HTTP_POOL_LIMIT_PER_HOST = 10  # kapcsolat / host
+HTTP_DNS_CACHE_TTL = 300       # másodperc
+HTTP_KEEPALIVE_TIMEOUT = 60    # üresjárati kapcsolat életben tartása (másodperc)
+
+http_session = None
+
+def create_http_session():
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_POOL_LIMIT,
+        limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+        ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=HTTP_TIMEOUT)
+
+def get_http_session():
+    """A közös session; ha még nincs (pl. setup_hook előtti hívás) vagy lezárult, újat nyit."""
+    global http_session
+    if http_session is None or http_session.closed:
+        http_session = create_http_session()
+    return http_session
+
+# ------------------------
+# Metrikák (Prometheus szöveges formátum, /metrics)
+# Counter / gauge / histogram, címkékkel; a render() scrape-kor állítja elő a szöveget.
+# A sorhosszakat és hasonló pillanatnyi értékeket a collectorok (scrape-kor futó függvények) töltik.
+# ------------------------
+METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+METRIC_HELP = {
+    "darky_watcher_cycle_seconds": "Egy watcher kör futásideje",
+    "darky_watcher_overruns_total": "Watcher körök, amelyek tovább tartottak a tick periódusnál",
+    "darky_watcher_carryover_total": "Határidő miatt a következő körre átvitt lekérdezések",
+    "darky_provider_request_seconds": "Provider kérés késleltetése (válasz fejlécig)",
+    "darky_provider_ratelimit_wait_seconds": "Várakozás a provider rate limit keretre",
+    "darky_provider_responses_total": "Provider válaszok státuszkód szerint",
+    "darky_provider_retries_total": "429 miatti újrapróbálások",
+    "darky_provider_errors_total": "Hálózati hibával végződő provider kérések",
+    "darky_call_seconds": "Instrumentált függvényhívások futásideje",
+    "darky_call_errors_total": "Kivétellel végződő instrumentált függvényhívások",
+    "darky_notifications_total": "Élő értesítések platform és eredmény szerint",
+    "darky_reaction_events_total": "Feldolgozott reakció események",
+    "darky_ai_queue_wait_seconds": "AI feladatok várakozási ideje a sorban",
+    "darky_ai_queue_depth": "Várakozó AI feladatok",
+    "darky_ai_queue_running": "Futó AI feladatok",
+    "darky_ai_jobs_total": "AI feladatok kimenetel szerint",
+    "darky_ai_cache_total": "AI cache találatok / tévesztések / összevont kérések",
+    "darky_image_jobs_active": "Futó háttér képgenerálások",
+    "darky_role_queue_depth": "Függő rang módosítások (tagonként)",
+    "darky_role_queue_lag_seconds": "A legrégebbi függő rang módosítás kora",
+    "darky_role_queue_total": "Rang sor események",
+    "darky_ratelimit_remaining": "Provider rate limit keret maradéka",
+    "darky_ratelimit_waiting": "Rate limit keretre váró kérések",
+    "darky_watched_streamers": "Figyelt (deduplikált) streamerek",
+    "darky_json_store_pending": "Mentésre váró JSON fájlok",
+    "darky_event_loop_lag_seconds": "Event loop késés (alvás csúszása)",
+    "darky_notification_detection_seconds": "Adás kezdete -> észlelés (started_at -> watcher)",
+    "darky_notification_delivery_seconds": "Észlelés -> Discord üzenet elküldve",
+}
+
+def _metric_labels(labels):
+    return tuple(sorted((k, str(v)) for k, v in (labels or {}).items()))
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    def esc(v):
+        return v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in items) + "}"
+
+def _format_value(v):
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+class Metrics:
+    def __init__(self, buckets=METRIC_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._types = {}       # név -> "counter" | "gauge" | "histogram"
+        self._values = {}      # név -> {címke tuple: érték}
+        self._hist = {}        # név -> {címke tuple: [bucket darabszámok, összeg, darab]}
+        self._collectors = []
+
+    def inc(self, name, labels=None, value=1):
+        self._types.setdefault(name, "counter")
+        series = self._values.setdefault(name, {})
+        key = _metric_labels(labels)
+        series[key] = series.get(key, 0) + value
+
+    def set(self, name, value, labels=None, kind="gauge"):
+        self._types.setdefault(name, kind)
+        self._values.setdefault(name, {})[_metric_labels(labels)] = value
+
+    def observe(self, name, value, labels=None):
+        self._types.setdefault(name, "histogram")
+        series = self._hist.setdefault(name, {})
+        key = _metric_labels(labels)
+        h = series.get(key)
+        if h is None:
+            h = series[key] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                h[0][i] += 1
+        h[1] += value
+        h[2] += 1
+
+    def collector(self, func):
+        """Scrape-kor futó függvény (pl. sorhosszak gauge-ba írása); dekorátorként is használható."""
+        self._collectors.append(func)
+        return func
+
+    def render(self):
+        for func in self._collectors:
+            try:
+                func()
+            except Exception as e:
+                print(f"⚠️ Metrika collector hiba ({getattr(func, '__name__', func)}): {e}")
+        lines = []
+        for name in sorted(self._types):
+            kind = self._types[name]
+            if name in METRIC_HELP:
+                lines.append(f"# HELP {name} {METRIC_HELP[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "histogram":
+                for labels, (counts, total, count) in sorted(self._hist.get(name, {}).items()):
+                    for bound, n in zip(self.buckets, counts):
+                        lines.append(f"{name}_bucket{_format_labels(labels, [('le', _format_value(float(bound)))])} {n}")
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {count}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(float(total))}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {count}")
+            else:
+                for labels, value in sorted(self._values.get(name, {}).items()):
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+def instrumented(name):
+    """Async függvény futásidejét (darky_call_seconds) és kivételeit (darky_call_errors_total) méri."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                metrics.inc("darky_call_errors_total", {"fn": name})
+                raise
+            finally:
+                metrics.observe("darky_call_seconds", time.perf_counter() - start, {"fn": name})
+        return wrapper
+    return decorator
+
+async def timed_cycle(platform, period, cycle):
+    """Egy watcher kör mérése; ha tovább tart a tick periódusnál, túlfutásnak számít."""
+    start = time.perf_counter()
+    try:
+        await cycle()
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.observe("darky_watcher_cycle_seconds", elapsed, {"platform": platform})
+        if elapsed > period:
+            metrics.inc("darky_watcher_overruns_total", {"platform": platform})
+
+EVENT_LOOP_LAG_INTERVAL = 1.0
+
+async def event_loop_lag_monitor():
+    """Másodpercenként elalszik; amennyivel később ébred, annyit késik az event loop."""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(EVENT_LOOP_LAG_INTERVAL)
+        lag = max(0.0, loop.time() - start - EVENT_LOOP_LAG_INTERVAL)
+        metrics.observe("darky_event_loop_lag_seconds", lag)
+
+# ------------------------
+# Értesítési késleltetés (go-live -> Discord üzenet)
+# Bejelentésenként két érték: észlelési késés (az adás started_at / created_at ideje -> a watcher
+# észleli) és kézbesítési késés (észlelés -> channel.send visszatért). Platformonként és
+# (platform, guild) szerint korlátos gyűrűpufferben tartjuk, p50/p95/p99 összesítővel.
+# ------------------------
+LATENCY_SAMPLES = int(os.getenv("LATENCY_SAMPLES", "500"))  # minták / puffer
+
+def parse_timestamp(value):
+    """ISO 8601 / "YYYY-MM-DD HH:MM:SS" (UTC) -> unix idő; értelmezhetetlen értékre None."""
+    if not value:
+        return None
+    try:
+        dt = datetime.fromisoformat(str(value).strip().replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentilis egy rendezett listából."""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, -(-len(sorted_values) * pct // 100) - 1))
+    return sorted_values[int(index)]
+
+class LatencyTracker:
+    def __init__(self, size):
+        self.size = size
+        self._platform = {}   # platform -> deque[(idő, észlelés vagy None, kézbesítés)]
+        self._guild = {}      # (platform, guild_id) -> deque[...]
+
+    def record(self, platform, guild_id, started_at, detected, delivered):
+        started = parse_timestamp(started_at)
+        detection = max(0.0, detected - started) if started is not None else None
+        delivery = max(0.0, delivered - detected)
+        sample = (delivered, detection, delivery)
+        for buffers, key in ((self._platform, platform), (self._guild, (platform, guild_id))):
+            buf = buffers.get(key)
+            if buf is None:
+                buf = buffers[key] = deque(maxlen=self.size)
+            buf.append(sample)
+        labels = {"platform": platform}
+        if detection is not None:
+            metrics.observe("darky_notification_detection_seconds", detection, labels)
+        metrics.observe("darky_notification_delivery_seconds", delivery, labels)
+
+    @staticmethod
+    def _rollup(values):
+        values = sorted(values)
+        if not values:
+            return None
+        return {f"p{p}": round(percentile(values, p), 2) for p in (50, 95, 99)} | {"max": round(values[-1], 2)}
+
+    def summary(self, platform, guild_id=None):
+        buf = self._platform.get(platform) if guild_id is None else self._guild.get((platform, guild_id))
+        if not buf:
+            return None
+        return {
+            "count": len(buf),
+            "last": datetime.fromtimestamp(buf[-1][0], timezone.utc).isoformat(),
+            "detection": self._rollup(s[1] for s in buf if s[1] is not None),
+            "delivery": self._rollup(s[2] for s in buf),
+        }
+
+    def status(self, platform=None, guild_id=None):
+        result = {}
+        for name in sorted(self._platform):
+            if platform and name != platform:
+                continue
+            if guild_id is not None:
+                entry = {"guilds": {str(guild_id): self.summary(name, guild_id)}}
+            else:
+                entry = {
+                    "all": self.summary(name),
+                    "guilds": {str(gid): self.summary(name, gid) for (p, gid) in self._guild if p == name},
+                }
+            result[name] = entry
+        return result
+
+latency_tracker = LatencyTracker(LATENCY_SAMPLES)
+
+# ------------------------
+# Provider rate limit (token bucket) – a watcherek és a parancsok közös kerete
+# - a kérések sorban állnak (FIFO), nem mennek ki vakon
+# - a Twitch Ratelimit-Limit / -Remaining / -Reset és a Retry-After fejlécek alapján igazodik
+# - a felhasználói parancsok (background=False) nem nyúlhatnak a keret RATE_LIMIT_RESERVE részéhez,
+#   így egy parancs-áradat nem éheztetheti ki a háttér watchereket
+# ------------------------
+RATE_LIMIT_RESERVE = 0.2   # a keret ennyi része a háttérfeladatoké
+RATE_LIMIT_RETRIES = 2     # 429 esetén ennyiszer próbáljuk újra (a limiter kivárja a Retry-After-t)
+RATE_LIMITS = {            # provider -> (token / másodperc, bucket méret)
+    "twitch": (800 / 60, 800),   # Helix: 800 pont / perc (a fejlécek felülírják)
+    "kick": (2, 20),
+    "youtube": (5, 50),
+    "openai": (1, 10),
+    "gemini": (15 / 60, 15),     # ingyenes szint: 15 kérés / perc
+}
+
+class RateLimiter:
+    def __init__(self, name, rate, capacity):
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0       # monotonic idő; Retry-After / kimerült keret esetén
+        self.server_remaining = None   # utolsó ismert szerver oldali maradék
+        self.waiting = 0
+        self._locks = {True: asyncio.Lock(), False: asyncio.Lock()}  # háttér / parancs sor
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    @property
+    def remaining(self):
+        self._refill()
+        return int(self.tokens)
+
+    async def acquire(self, background=True):
+        floor = 0 if background else self.capacity * RATE_LIMIT_RESERVE
+        self.waiting += 1
+        try:
+            async with self._locks[background]:
+                while True:
+                    self._refill()
+                    wait = self.blocked_until - time.monotonic()
+                    if wait <= 0:
+                        if self.tokens >= 1 + floor:
+                            self.tokens -= 1
+                            return
+                        wait = (1 + floor - self.tokens) / self.rate
+                    await asyncio.sleep(wait)
+        finally:
+            self.waiting -= 1
+
+    def update(self, status, headers):
+        """Válasz fejlécek alapján a keret igazítása."""
+        limit = headers.get("Ratelimit-Limit")
+        remaining = headers.get("Ratelimit-Remaining") or headers.get("x-ratelimit-remaining-requests")
+        reset = headers.get("Ratelimit-Reset")
+        retry_after = headers.get("Retry-After")
+        self._refill()
+        try:
+            if limit and int(limit) > 0 and int(limit) != self.capacity:
+                # a Twitch percenként tölti vissza a teljes keretet
+                self.capacity = int(limit)
+                self.rate = int(limit) / 60
+            if remaining is not None:
+                self.server_remaining = int(remaining)
+                self.tokens = min(self.tokens, float(self.server_remaining))
+        except ValueError:
+            pass
+        wait = 0.0
+        if retry_after:
+            try:
+                wait = float(retry_after)
+            except ValueError:
+                wait = 1.0
+        elif reset and (status == 429 or self.server_remaining == 0):
+            try:
+                wait = max(0.0, float(reset) - time.time())
+            except ValueError:
+                wait = 1.0
+        elif status == 429:
+            wait = 1.0
+        if wait > 0:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + wait)
+            self.tokens = 0.0
+
+    def status(self):
+        return {
+            "remaining": self.remaining,
+            "capacity": self.capacity,
+            "rate_per_sec": round(self.rate, 3),
+            "server_remaining": self.server_remaining,
+            "blocked_for": round(max(0.0, self.blocked_until - time.monotonic()), 1),
+            "waiting": self.waiting,
+        }
+
+rate_limiters = {name: RateLimiter(name, rate, cap) for name, (rate, cap) in RATE_LIMITS.items()}
+
+@contextlib.asynccontextmanager
+async def provider_request(provider, method, url, *, background=True, **kwargs):
+    """Rate limitelt kérés a közös sessionön; 429-nél a Retry-After kivárása után újrapróbál."""
+    limiter = rate_limiters[provider]
+    session = get_http_session()
+    labels = {"provider": provider}
+    attempt = 0
+    while True:
+        start = time.perf_counter()
+        await limiter.acquire(background)
+        sent = time.perf_counter()
+        metrics.observe("darky_provider_ratelimit_wait_seconds", sent - start, labels)
+        try:
+            resp = await session.request(method, url, **kwargs)
+        except Exception:
+            metrics.inc("darky_provider_errors_total", labels)
+            raise
+        metrics.observe("darky_provider_request_seconds", time.perf_counter() - sent, labels)
+        metrics.inc("darky_provider_responses_total", {"provider": provider, "status": resp.status})
+        limiter.update(resp.status, resp.headers)
+        if resp.status == 429 and attempt < RATE_LIMIT_RETRIES:
+            attempt += 1
+            metrics.inc("darky_provider_retries_total", labels)
+            resp.release()
+            print(f"[{provider}] 429 Too Many Requests – újrapróbálás ({attempt}/{RATE_LIMIT_RETRIES})")
+            continue
+        break
+    try:
+        yield resp
+    finally:
+        resp.release()
+
+# ------------------------
+# Write-behind JSON mentés
+# A mentő függvények csak "piszkosnak" jelölik a fájlt; egyetlen író task rövid várakozás
+# (JSON_STORE_DEBOUNCE) után egyszer szerializál, és a thread poolban atomikusan ír
+# (a fő fájl és a webes *_state.json tükör ugyanabból a tartalomból készül).
+# Így egy sorozatos szerkesztés egy írás, és az event loop sosem vár a lemezre.
+# ------------------------
+JSON_STORE_DEBOUNCE = float(os.getenv("JSON_STORE_DEBOUNCE", "1.0"))
+
+# utolsó ismert fájl aláírás (inode, mtime, méret) – a saját írásainkat a config figyelő így ismeri fel
+file_signatures = {}
+
+def file_signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+def atomic_write_bytes(path, data: bytes):
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    file_signatures[path] = file_signature(path)
+
+def _write_json_files(paths, data: bytes):
+    for path in paths:
+        atomic_write_bytes(path, data)
+
+class JsonStore:
+    def __init__(self, debounce):
+        self.debounce = debounce
+        self._pending = {}   # fő fájl -> (objektum, tükör fájlok) – még nem kiírt állapot
+        self._writing = {}   # éppen íródó köteg (a load_* innen is olvas, amíg a fájl nem friss)
+        self._wakeup = asyncio.Event()
+        self._closing = asyncio.Event()
+        self._task = None
+        self.writes = 0
+
+    @staticmethod
+    def _dumps(obj):
+        return json.dumps(obj, ensure_ascii=False, indent=4).encode("utf-8")
+
+    def pending(self, path):
+        """A legutóbb mentett, de még nem kiírt objektum (vagy None)."""
+        item = self._pending.get(path) or self._writing.get(path)
+        return None if item is None else item[0]
+
+    def save(self, path, obj, mirrors=()):
+        if self._task is None:
+            # az író task előtt (import, leállás után) szinkron írunk
+            try:
+                _write_json_files((path,) + tuple(mirrors), self._dumps(obj))
+                self.writes += 1
+            except Exception as e:
+                print(f"⚠️ Nem sikerült menteni {path}: {e}")
+            return
+        self._pending[path] = (obj, tuple(mirrors))
+        self._wakeup.set()
+
+    def start(self):
+        if self._task is None:
+            self._closing.clear()
+            self._task = asyncio.create_task(self._writer())
+
+    async def _flush_pending(self):
+        loop = asyncio.get_running_loop()
+        self._writing, self._pending = self._pending, {}
+        for path, (obj, mirrors) in self._writing.items():
+            try:
+                data = self._dumps(obj)  # a loopon szerializálunk: közben senki nem módosíthatja
+                await loop.run_in_executor(None, _write_json_files, (path,) + mirrors, data)
+                self.writes += 1
+            except Exception as e:
+                print(f"⚠️ Nem sikerült menteni {path}: {e}")
+                self._pending.setdefault(path, (obj, mirrors))
+        self._writing = {}
+
+    async def _writer(self):
+        while not self._closing.is_set():
+            await self._wakeup.wait()
+            # a sorozatos módosítások egy írásba olvadnak (leálláskor nem várunk)
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._closing.wait(), self.debounce)
+            self._wakeup.clear()
+            await self._flush_pending()
+
+    async def close(self):
+        """Függő írások kiírása és az író task leállítása."""
+        if self._task is None:
+            return
+        self._closing.set()
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        for path, (obj, mirrors) in list(self._pending.items()):
+            self.save(path, obj, mirrors)
+        self._pending = {}
+
+json_store = JsonStore(JSON_STORE_DEBOUNCE)
+
+# ------------------------
+# Állapot pillanatképek a web végpontokhoz (/reaction_roles.json, /*_streams_state.json)
+# A memóriabeli állapotból épülnek, változásonként egyszer szerializálva: a változtató kód
+# (feliratkozás, élő flag, reakció rang) invalidate()-et hív, a következő kérés újraépít.
+# Szűrés (guild_id) és lapozás (offset / limit) változatonként szintén egyszer szerializálódik.
+# ------------------------
+STATE_GZIP_MIN = 1024      # ennél nagyobb választ tömörítünk, ha a kliens elfogadja
+STATE_VARIANTS_MAX = 64    # végpontonként ennyi (szűrés, lapozás) változatot tartunk meg
+
+class StateSnapshots:
+    def __init__(self):
+        self._builders = {}   # név -> builder(guild_id) -> lista vagy dict
+        self._variants = {}   # név -> OrderedDict[(guild_id, offset, limit)] -> változat
+
+    def register(self, name, builder):
+        self._builders[name] = builder
+
+    def invalidate(self, name=None):
+        if name is None:
+            self._variants.clear()
+        else:
+            self._variants.pop(name, None)
+
+    def get(self, name, guild_id=None, offset=0, limit=None):
+        """{"body": bytes, "etag": str, "total": int, "gzip": bytes | None (lusta)}"""
+        variants = self._variants.setdefault(name, OrderedDict())
+        key = (guild_id, offset, limit)
+        variant = variants.get(key)
+        if variant is not None:
+            variants.move_to_end(key)
+            return variant
+        data = self._builders[name](guild_id)
+        total = len(data)
+        end = offset + limit if limit is not None else None
+        if isinstance(data, dict):
+            data = dict(list(data.items())[offset:end]) if offset or end is not None else data
+        else:
+            data = data[offset:end]
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        variant = {"body": body, "etag": f'"{hashlib.sha256(body).hexdigest()[:32]}"', "total": total, "gzip": None}
+        variants[key] = variant
+        while len(variants) > STATE_VARIANTS_MAX:
+            variants.popitem(last=False)
+        return variant
+
+    @staticmethod
+    def gzipped(variant):
+        if variant["gzip"] is None:
+            variant["gzip"] = gzip.compress(variant["body"], compresslevel=6)
+        return variant["gzip"]
+
+state_snapshots = StateSnapshots()
+
 # ------------------------
 # Intents és Bot osztály
 # ------------------------
@@ -41,12 +637,42 @@ intents.members = True
 
 class MyBot(commands.Bot):
     async def setup_hook(self):
+        # Közös HTTP session: minden kimenő kérés (watcherek, AI, parancsok) ezt használja
+        global http_session
+        http_session = create_http_session()
+        json_store.start()
+        role_queue.start()
+        ai_jobs.start()
+        # élő flagek / bejelentett adások / ütemező statisztika visszatöltése a watcherek előtt
+        restore_runtime_state()
+        self.loop.create_task(runtime_state_saver())
+        self.loop.create_task(config_watcher())
+        self.loop.create_task(event_loop_lag_monitor())
+        try:
+            self.loop.add_signal_handler(signal.SIGTERM, lambda: asyncio.create_task(self.close()))
+        except (NotImplementedError, RuntimeError):
+            pass  # pl. Windows alatt nincs signal handler
         # Indítsd itt aszinkron a watcher-t, így Render alatt nem lesz loop attribútum hiba
         self.loop.create_task(twitch_watcher())
+        if TWITCH_MODE == "eventsub":
+            self.loop.create_task(twitch_eventsub_client())
         self.loop.create_task(youtube_watcher())
         self.loop.create_task(kick_watcher())
         # Ha akarsz még egyéb initet (pl. cogs), ide jöhet
 
+    async def close(self):
+        # leállás (SIGTERM / Render redeploy) előtt utolsó pillanatkép
+        try:
+            save_runtime_state()
+        except Exception as e:
+            print(f"⚠️ Nem sikerült menteni {RUNTIME_STATE_FILE}: {e}")
+        await role_queue.close()  # a futó rang módosítások még élő kapcsolattal fejeződjenek be
+        await super().close()
+        await json_store.close()
+        # a gateway után a HTTP pool-t is lezárjuk
+        if http_session is not None and not http_session.closed:
+            await http_session.close()
+
 bot = MyBot(command_prefix='!', intents=intents)
 
 # ------------------------
@@ -74,25 +700,122 @@ def admin_or_role(role_name):
             return False
     return commands.check(predicate)
 
-# ÚJ: több rang + felhasználó ID-k támogatása minden parancshoz
-# Példa ID-ket és 2 rangot adunk előre; szabadon bővíthető.
+# Jogosultság motor
+# A parancsonkénti beépített rangok / user ID-k (admin_or_roles_or_users) mellé a
+# commands_rank.txt is adhat jogot, ha a commands_allow.txt = 1. A commands_rank.txt formátuma:
+#   # megjegyzés
+#   Rang neve                         -> minden parancsra jogot ad
+#   dbtwitchadd: Rang1, Rang2, 1234   -> csak az adott parancsra (a szám user ID)
+#   [419462004240285696]              -> innentől csak erre a szerverre vonatkozik
+# all_server_allow.txt = 1: a szekció előtti (közös) sorok minden szerveren érvényesek,
+# 0: csak a szerver szekciók számítanak.
+# Szerverenként és parancsonként egyszer fordítjuk le rang ID / user ID frozensetekre,
+# az eredményt (guild, tag, parancs) szerint cache-eljük; tag / rang változás törli.
+# ------------------------
+def _read_flag_file(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            token = line.split("#", 1)[0].strip()
+            if token:
+                return token == "1"
+    return default
+
+def load_permission_config():
+    rules = {}  # guild_id (None = közös) -> parancs ("*" = mind) -> (rang nevek, user ID-k)
+    scope = None
+    if os.path.exists(COMMANDS_RANK_FILE):
+        with open(COMMANDS_RANK_FILE, "r", encoding="utf-8") as f:
+            for raw in f:
+                line = raw.split("#", 1)[0].strip()
+                if not line:
+                    continue
+                m = re.fullmatch(r"\[(\d+)\]", line)
+                if m:
+                    scope = int(m.group(1))
+                    continue
+                command, sep, rest = line.partition(":")
+                if sep and re.fullmatch(r"\w+", command.strip()):
+                    command, items = command.strip().lower(), rest
+                else:
+                    command, items = "*", line
+                names, users = rules.setdefault(scope, {}).setdefault(command, (set(), set()))
+                for item in items.split(",") if sep else [items]:
+                    item = item.strip()
+                    if item.isdigit():
+                        users.add(int(item))
+                    elif item:
+                        names.add(item)
+    return {
+        "ranks_enabled": _read_flag_file(COMMANDS_ALLOW_FILE, False),
+        "all_servers": _read_flag_file(ALL_SERVER_ALLOW_FILE, True),
+        "rules": rules,
+    }
+
+class PermissionEngine:
+    def __init__(self):
+        self.config = load_permission_config()
+        self._compiled = {}  # guild_id -> parancs -> (rang ID-k, user ID-k)
+        self._cache = {}     # (guild_id, member_id) -> parancs -> bool
+
+    def reload(self, config=None):
+        self.config = config if config is not None else load_permission_config()
+        self._compiled.clear()
+        self._cache.clear()
+
+    def invalidate_guild(self, guild_id):
+        self._compiled.pop(guild_id, None)
+        for key in [k for k in self._cache if k[0] == guild_id]:
+            del self._cache[key]
+
+    def invalidate_member(self, guild_id, member_id):
+        self._cache.pop((guild_id, member_id), None)
+
+    def _compile(self, guild, command, default_roles, default_users):
+        names, users = set(default_roles), set(default_users)
+        if self.config["ranks_enabled"]:
+            scopes = [None, guild.id] if self.config["all_servers"] else [guild.id]
+            for scope in scopes:
+                rules = self.config["rules"].get(scope, {})
+                for key in ("*", command):
+                    if key in rules:
+                        names |= rules[key][0]
+                        users |= rules[key][1]
+        role_ids = frozenset(r.id for r in guild.roles if r.name in names)
+        return role_ids, frozenset(users)
+
+    def check(self, ctx, default_roles, default_users):
+        guild, author = ctx.guild, ctx.author
+        command = ctx.command.qualified_name if ctx.command else ""
+        per_member = self._cache.setdefault((guild.id, author.id), {})
+        if command in per_member:
+            return per_member[command]
+        compiled = self._compiled.setdefault(guild.id, {})
+        acl = compiled.get(command)
+        if acl is None:
+            acl = compiled[command] = self._compile(guild, command, default_roles, default_users)
+        role_ids, user_ids = acl
+        allowed = (
+            author.guild_permissions.administrator  # Admin mindig átmegy
+            or author.id in user_ids
+            or not role_ids.isdisjoint(r.id for r in author.roles)
+        )
+        per_member[command] = allowed
+        return allowed
+
+permission_engine = PermissionEngine()
+
+# több rang + felhasználó ID-k támogatása minden parancshoz (ezek a parancs beépített jogai)
 def admin_or_roles_or_users(roles: list[str] = None, user_ids: list[int] = None):
-    roles = roles or []
-    user_ids = user_ids or []
+    roles = frozenset(roles or [])
+    user_ids = frozenset(user_ids or [])
 
     async def predicate(ctx):
         try:
-            # Admin mindig átmegy
-            if ctx.author.guild_permissions.administrator:
-                return True
-            # Explicit engedélyezett felhasználó ID-k
-            if ctx.author.id in user_ids:
-                return True
-            # Bármelyik megadott rang elég
-            author_roles = [r.name for r in ctx.author.roles]
-            if any(r in author_roles for r in roles):
-                return True
-            return False
+            if ctx.guild is None:
+                return False
+            return permission_engine.check(ctx, roles, user_ids)
         except Exception:
             return False
 
@@ -101,32 +824,177 @@ def admin_or_roles_or_users(roles: list[str] = None, user_ids: list[int] = None)
 # ------------------------
 # Reaction roles betöltése / mentése
 # ------------------------
-if os.path.exists(REACTION_ROLES_FILE):
+def parse_reaction_roles(data):
+    # konvertáljuk szám típusra a kulcsokat (későbbi használathoz)
+    return {
+        int(gid): {int(mid): em for mid, em in msgs.items()}
+        for gid, msgs in data.items()
+    }
+
+def load_reaction_roles():
+    if not os.path.exists(REACTION_ROLES_FILE):
+        return {}
     with open(REACTION_ROLES_FILE, "r", encoding="utf-8") as f:
         try:
-            reaction_roles = json.load(f)
-            # konvertáljuk szám típusra a kulcsokat (későbbi használathoz)
-            reaction_roles = {
-                int(gid): {int(mid): em for mid, em in msgs.items()}
-                for gid, msgs in reaction_roles.items()
-            }
+            return parse_reaction_roles(json.load(f))
         except json.JSONDecodeError:
-            reaction_roles = {}
-else:
-    reaction_roles = {}
+            return {}
+
+reaction_roles = load_reaction_roles()
 
 def save_reaction_roles():
-    with open(REACTION_ROLES_FILE, "w", encoding="utf-8") as f:
-        json.dump({
-            str(gid): {str(mid): em for mid, em in msgs.items()}
-            for gid, msgs in reaction_roles.items()
-        }, f, ensure_ascii=False, indent=4)
+    # a JSON a szám kulcsokat magától stringgé alakítja
+    json_store.save(REACTION_ROLES_FILE, reaction_roles)
+
+# Előfordított index a reakció eseményekhez:
+# guild_id -> { (message_id, emoji kulcs): role_id }, ahol az emoji kulcs egyedi emojinál az ID,
+# unicode emojinál maga a karakter. A rang név -> ID feloldás itt történik egyszer,
+# nem minden reakciónál; rang létrehozás / átnevezés / törlés után a guild indexe újraépül.
+# A reaction_role_messages előszűrő: más üzenetekre érkező reakciókat azonnal eldobjuk.
+reaction_role_index = {}
+reaction_role_messages = set()
+
+def reaction_emoji_key(emoji):
+    if not isinstance(emoji, discord.PartialEmoji):
+        emoji = discord.PartialEmoji.from_str(str(emoji))
+    return emoji.id if emoji.id else emoji.name
+
+def rebuild_reaction_role_index(guild_id=None):
+    """Index újraépítése egy guildre (vagy guild_id=None esetén mindre)."""
+    guild_ids = list(reaction_roles) if guild_id is None else [guild_id]
+    for gid in guild_ids:
+        reaction_role_index.pop(gid, None)
+        guild = bot.get_guild(gid)
+        if guild is None:
+            continue  # még nincs cache (indulás) – az on_ready újraépíti
+        role_ids = {}
+        for role in guild.roles:
+            role_ids.setdefault(role.name, role.id)  # azonos névnél az első (mint a discord.utils.get)
+        entries = {}
+        for mid, emoji_map in reaction_roles.get(gid, {}).items():
+            for emoji, role_name in emoji_map.items():
+                role_id = role_ids.get(role_name)
+                if role_id is not None:
+                    entries[(mid, reaction_emoji_key(emoji))] = role_id
+        if entries:
+            reaction_role_index[gid] = entries
+    reaction_role_messages.clear()
+    reaction_role_messages.update(mid for msgs in reaction_roles.values() for mid in msgs)
+    state_snapshots.invalidate("reaction_roles")
+
+rebuild_reaction_role_index()
+
+# ------------------------
+# Streamer -> feliratkozások index (platformonként deduplikált figyelés)
+# (platform, username) -> [ (guild_id, channel_id), ... ]
+# Így ha ugyanazt a streamert több szerver is figyeli, a watcher csak egyszer kérdezi le,
+# és az eredményt minden feliratkozott csatornára szétosztja.
+# A build_*_state_from_file és az add/remove parancsok tartják karban.
+# Induláskor a fájlból épül; utána a memóriabeli *_streams állapot a mérvadó:
+# a parancsok innen dolgoznak, a fájl pedig ebből szerializálódik (nincs újraolvasás).
+# ------------------------
+streamer_index = {}
+
+def rebuild_streamer_index(platform, state):
+    for key in [k for k in streamer_index if k[0] == platform]:
+        del streamer_index[key]
+    for guild_id, users in state.items():
+        for username, info in users.items():
+            streamer_index.setdefault((platform, username), []).append((guild_id, info.get("channel_id")))
+
+def streamer_index_add(platform, username, guild_id, channel_id):
+    subs = streamer_index.setdefault((platform, username), [])
+    subs[:] = [s for s in subs if s[0] != guild_id]
+    subs.append((guild_id, channel_id))
+
+def streamer_index_remove(platform, username, guild_id):
+    subs = streamer_index.get((platform, username))
+    if subs is None:
+        return
+    subs[:] = [s for s in subs if s[0] != guild_id]
+    if not subs:
+        del streamer_index[(platform, username)]
+
+def watched_streamers(platform):
+    """Egyedi figyelt usernevek egy platformon."""
+    return [username for (p, username) in streamer_index if p == platform]
+
+def set_subscription(platform, state, guild_id, username, entry):
+    """Feliratkozás hozzáadása / frissítése; True, ha már létezett (csatorna frissítés)."""
+    users = state.setdefault(guild_id, {})
+    existed = username in users
+    if existed and "row" in users[username] and "row" not in entry:
+        entry["row"] = users[username]["row"]  # a fájlbeli extra mezők csatorna frissítésnél is maradnak
+    users[username] = entry
+    streamer_index_add(platform, username, guild_id, entry["channel_id"])
+    state_snapshots.invalidate(platform)
+    return existed
+
+def remove_subscription(platform, state, guild_id, username):
+    """Feliratkozás törlése; False, ha nem volt ilyen."""
+    users = state.get(guild_id)
+    if not users or username not in users:
+        return False
+    del users[username]
+    if not users:
+        del state[guild_id]
+    streamer_index_remove(platform, username, guild_id)
+    state_snapshots.invalidate(platform)
+    return True
+
+def set_live_flag(platform, info, live):
+    """Élő flag állítása egy feliratkozáson (a web pillanatkép is frissül)."""
+    info["live"] = live
+    state_snapshots.invalidate(platform)
+
+# platform -> a feliratkozás fájl azon sorai, amelyeket nem tudtunk értelmezni (pl. kézzel szerkesztett,
+# hibás channel_id). A runtime állapotba nem kerülnek, de mentéskor változatlanul visszaíródnak.
+unparsed_subscription_rows = {"twitch": [], "youtube": [], "kick": []}
+
+def keep_unparsed_rows(platform, rows):
+    unparsed_subscription_rows[platform] = rows
+    if rows:
+        print(f"⚠️ {platform}: {len(rows)} értelmezhetetlen feliratkozás sor (nem figyeljük, de a fájlban megmarad): "
+              + ", ".join(json.dumps(r, ensure_ascii=False)[:80] for r in rows[:5]))
+
+def subscriptions_to_list(platform, state):
+    """Runtime állapot -> fájl formátum: [ { "username", "channel_id", "guild_id", ... }, ... ]
+    A betöltött sor többi mezője és az értelmezhetetlen sorok is megmaradnak."""
+    rows = [
+        {**info.get("row", {}), "username": username, "channel_id": info["channel_id"], "guild_id": guild_id}
+        for guild_id, users in state.items() for username, info in users.items()
+    ]
+    return rows + unparsed_subscription_rows[platform]
+
+LIST_PAGE_LIMIT = 1900  # Discord üzenet max. 2000 karakter (a lábléc is belefér)
+
+async def send_paginated(ctx, header, lines, page, command):
+    """Lista küldése oldalakra bontva; a lábléc mutatja, hogyan kérhető a következő oldal."""
+    pages, current = [], []
+    size = len(header)
+    for line in lines:
+        if current and size + len(line) + 1 > LIST_PAGE_LIMIT:
+            pages.append(current)
+            current, size = [], len(header)
+        current.append(line)
+        size += len(line) + 1
+    pages.append(current)
+    page = min(max(page, 1), len(pages))
+    msg = header + "\n".join(pages[page - 1])
+    if len(pages) > 1:
+        msg += f"\n📄 {page}/{len(pages)}. oldal"
+        if page < len(pages):
+            msg += f" – következő: `!{command} {page + 1}`"
+    await ctx.send(msg)
 
 # ------------------------
 # Twitch streamerek betöltése / mentése (egyszerű párosítás)
 # Formátum: [ { "username": "streamer1", "channel_id": 123..., "guild_id": 111... }, ... ]
 # ------------------------
 def load_twitch_streamers():
+    pending = json_store.pending(TWITCH_FILE)
+    if pending is not None:
+        return pending
     if not os.path.exists(TWITCH_FILE):
         return []
     with open(TWITCH_FILE, "r", encoding="utf-8") as f:
@@ -142,21 +1010,14 @@ def load_twitch_streamers():
             return []
 
 def save_twitch_streamers(list_obj):
-    # Eredeti JSON mentése
-    with open(TWITCH_FILE, "w", encoding="utf-8") as f:
-        json.dump(list_obj, f, ensure_ascii=False, indent=4)
-    # Ideiglenes állapot mentése webre (ez a fájl lesz elérhető a /twitch_streams_state.json útvonalon)
-    try:
-        with open(TWITCH_INTERNAL_FILE, "w", encoding="utf-8") as f:
-            json.dump(list_obj, f, ensure_ascii=False, indent=4)
-    except Exception as e:
-        print(f"⚠️ Nem sikerült menteni {TWITCH_INTERNAL_FILE}: {e}")
+    # Eredeti JSON + ideiglenes állapot a webre (/twitch_streams_state.json) ugyanabból a tartalomból
+    json_store.save(TWITCH_FILE, list_obj, mirrors=(TWITCH_INTERNAL_FILE,))
 
 # belső runtime állapot: guild_id (int or None) -> username.lower() -> {"channel_id": int, "live": bool}
 # ezt minden indításkor újratöltjük a TWITCH_FILE alapján
-def build_twitch_state_from_file():
-    arr = load_twitch_streamers()
+def twitch_state_from_list(arr):
     state = {}
+    skipped = []  # értelmezhetetlen sorok (a fájlban megmaradnak)
     for item in arr:
         try:
             uname = item.get("username", "").lower()
@@ -176,12 +1037,19 @@ def build_twitch_state_from_file():
                         gid_val = None
                 except Exception:
                     gid_val = None
-            if uname:
-                if gid_val not in state:
-                    state[gid_val] = {}
-                state[gid_val][uname] = {"channel_id": cid, "live": False}
+            if not uname:
+                raise ValueError("hiányzó username")
+            if gid_val not in state:
+                state[gid_val] = {}
+            state[gid_val][uname] = {"channel_id": cid, "live": False, "row": item}
         except Exception:
-            continue
+            skipped.append(item)
+    keep_unparsed_rows("twitch", skipped)
+    return state
+
+def build_twitch_state_from_file():
+    state = twitch_state_from_list(load_twitch_streamers())
+    rebuild_streamer_index("twitch", state)
     return state
 
 # runtime állapot inicializálása
@@ -195,164 +1063,694 @@ except Exception:
     pass
 
 # ------------------------
-# Twitch helper: lekérdezi, hogy él-e a streamer (helix streams endpoint)
+# Twitch helper: csomagolt (batch) lekérdezés – egy Helix kérés max. 100 loginnal
 # ------------------------
-async def is_twitch_live(username):
-    """Visszaad: (live: bool, stream_data: dict|None)"""
-    if not TWITCH_CLIENT_ID or not TWITCH_ACCESS_TOKEN:
-        return False, None
-    url = f"https://api.twitch.tv/helix/streams?user_login={username}"
+TWITCH_HELIX_BATCH = 100  # a Helix /streams végpont ennyi user_login paramétert fogad egy kérésben
+TWITCH_LOGIN_RE = re.compile(r"^[a-z0-9_]{1,25}$")
+
+def twitch_login_chunks(usernames):
+    """Érvényes loginok 100-as csomagokban (érvénytelen login az egész csomagot 400-zal buktatná).
+    A sorrend megmarad (az előző körből átvitt loginok így az első csomagokba kerülnek)."""
+    logins = list(dict.fromkeys(u.lower() for u in usernames if TWITCH_LOGIN_RE.match(u.lower())))
+    return [tuple(logins[i:i + TWITCH_HELIX_BATCH]) for i in range(0, len(logins), TWITCH_HELIX_BATCH)]
+
+@instrumented("fetch_twitch_streams_chunk")
+async def fetch_twitch_streams_chunk(chunk):
+    """Egy Helix /streams kérés max. 100 loginra. Visszaad: dict login -> stream_data, hiba esetén None."""
     headers = {
         "Client-ID": TWITCH_CLIENT_ID,
         "Authorization": f"Bearer {TWITCH_ACCESS_TOKEN}"
     }
+    # "first" nélkül a Helix csak 20 találatot adna vissza
+    params = [("user_login", u) for u in chunk] + [("first", str(len(chunk)))]
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, timeout=15) as resp:
-                if resp.status != 200:
-                    # opcionális: logoljuk a hibát
-                    text = await resp.text()
-                    print(f"[Twitch API] Nem 200 a válasz: {resp.status} - {text}")
-                    return False, None
-                data = await resp.json()
-                if "data" in data and len(data["data"]) > 0:
-                    return True, data["data"][0]
-                return False, None
+        async with provider_request("twitch", "GET", f"{TWITCH_API_BASE}/streams", headers=headers, params=params, timeout=HTTP_TIMEOUT) as resp:
+            if resp.status != 200:
+                text = await resp.text()
+                print(f"[Twitch API] Nem 200 a válasz (batch): {resp.status} - {text}")
+                return None
+            data = await resp.json()
     except Exception as e:
-        print(f"[Twitch API hiba] {e}")
-        return False, None
+        print(f"[Twitch API hiba (batch)] {e}")
+        return None
+    live = {}
+    for stream in data.get("data") or []:
+        login = (stream.get("user_login") or "").lower()
+        if login:
+            live[login] = stream
+    return live
+
+async def get_twitch_live_streams(usernames):
+    """Visszaad: (live: dict login -> stream_data, checked: set[login])
+    A checked halmazban csak azok a loginok vannak, amelyek csomagja sikeresen lekérdezve,
+    így egy hibás kérés miatt senkit nem állítunk offline-ra.
+    """
+    live, checked = {}, set()
+    if not TWITCH_CLIENT_ID or not TWITCH_ACCESS_TOKEN:
+        return live, checked
+    for chunk in twitch_login_chunks(usernames):
+        result = await fetch_twitch_streams_chunk(chunk)
+        if result is None:
+            continue
+        live.update(result)
+        checked.update(chunk)
+    return live, checked
 
 # Ha szükséged van arra, hogy felhasználónévből user_id-t kérjen: (nem feltétlen kell jelen implementációhoz)
 async def get_twitch_user_id(username):
     if not TWITCH_CLIENT_ID or not TWITCH_ACCESS_TOKEN:
         return None
-    url = f"https://api.twitch.tv/helix/users?login={username}"
+    url = f"{TWITCH_API_BASE}/users?login={username}"
     headers = {
         "Client-ID": TWITCH_CLIENT_ID,
         "Authorization": f"Bearer {TWITCH_ACCESS_TOKEN}"
     }
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, timeout=15) as resp:
-                if resp.status != 200:
-                    return None
-                data = await resp.json()
-                if "data" in data and len(data["data"]) > 0:
-                    return data["data"][0].get("id")
+        async with provider_request("twitch", "GET", url, headers=headers, timeout=HTTP_TIMEOUT) as resp:
+            if resp.status != 200:
                 return None
+            data = await resp.json()
+            if "data" in data and len(data["data"]) > 0:
+                return data["data"][0].get("id")
+            return None
     except Exception:
         return None
 
+# ------------------------
+# Watcher segéd: párhuzamos, határidős lekérdezés
+# Egy körön belül max. WATCHER_CONCURRENCY kérés fut egyszerre, az eredményeket a befejezés
+# sorrendjében dolgozzuk fel. Ami a kör határidejéig (WATCHER_CYCLE_DEADLINE) nem végez, azt
+# megszakítjuk, és a következő kör elejére soroljuk, így egy lassú végpont nem tartja fel a többit.
+# ------------------------
+WATCHER_CONCURRENCY = int(os.getenv("WATCHER_CONCURRENCY", "8"))
+WATCHER_CYCLE_DEADLINE = float(os.getenv("WATCHER_CYCLE_DEADLINE", "45"))  # másodperc
+
+# platform -> az előző körben határidő miatt megszakított kulcsok
+watcher_carryover = {"twitch": [], "youtube": [], "kick": []}
+
+def watcher_cycle_keys(platform, keys):
+    """Az előző körből átvitt kulcsok előre kerülnek (ha még figyeltek), utánuk a többi."""
+    keys = list(keys)
+    key_set = set(keys)
+    carried = [k for k in watcher_carryover[platform] if k in key_set]
+    carried_set = set(carried)
+    return carried + [k for k in keys if k not in carried_set]
+
+async def run_bounded(platform, keys, check, on_result, limit=None, deadline=None, carry=None):
+    """check(key) párhuzamosan (max. limit), on_result(key, result) a befejezés sorrendjében.
+    A határidőig be nem fejezett kulcsokat a watcher_carryover[platform]-ba teszi; carry(key) a kulcs
+    helyett tárolt elemeket adja (pl. Twitch csomag -> loginok, mert a csomagok körönként újraépülnek)."""
+    limit = limit or WATCHER_CONCURRENCY
+    deadline = WATCHER_CYCLE_DEADLINE if deadline is None else deadline
+    loop = asyncio.get_running_loop()
+    sem = asyncio.Semaphore(limit)
+
+    async def run(key):
+        async with sem:
+            return await check(key)
+
+    async def handle(task):
+        key = tasks[task]
+        try:
+            result = task.result()
+        except Exception as e:
+            print(f"[{platform} watcher] Lekérdezési hiba ({key}): {e}")
+            return
+        try:
+            await on_result(key, result)
+        except Exception as e:
+            print(f"[{platform} watcher] Feldolgozási hiba ({key}): {e}")
+            traceback.print_exc()
+
+    tasks = {asyncio.create_task(run(k)): k for k in watcher_cycle_keys(platform, keys)}
+    end = loop.time() + deadline
+    pending = set(tasks)
+    while pending:
+        remaining = end - loop.time()
+        if remaining <= 0:
+            break
+        done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            await handle(task)
+
+    # ami a határidőre már megérkezett (pl. az utolsó feldolgozás alatt), azt nem dobjuk el
+    for task in [t for t in pending if t.done()]:
+        pending.discard(task)
+        await handle(task)
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+        print(f"⏱️ {platform} watcher: {len(pending)} lekérdezés átkerül a következő körre.")
+    carry = carry or (lambda key: [key])
+    watcher_carryover[platform] = [item for t in pending for item in carry(tasks[t])]
+    if pending:
+        metrics.inc("darky_watcher_carryover_total", {"platform": platform}, len(pending))
+
+# ------------------------
+# Adaptív poll ütemező (streamerenkénti esedékesség, fix ütemű tick)
+# Minden (platform, username) saját következő esedékességi időt kap egy prioritási sorban (heap).
+# Intervallum:
+# - gyors intervallum (platformonként, POLL_INTERVAL_FAST_BY_PLATFORM): a streamer szokásos élő
+#   idősávjában (go-live órák hisztogramja alapján), gyanús go-live esetén (pl. bejelentett YouTube adás),
+#   és offline után POLL_FAST_AFTER_OFFLINE ideig
+# - POLL_INTERVAL_BASE: élő stream, illetve nemrég aktív csatorna
+# - inaktív csatorna: minden POLL_BACKOFF_STEP offline lekérdezés után duplázódik, max. POLL_INTERVAL_MAX
+# A watcherek POLL_TICK ütemben ébrednek (drift-korrigált: a késés nem adódik össze),
+# és csak az esedékes streamereket kérdezik le.
+# ------------------------
+POLL_TICK = float(os.getenv("POLL_TICK", "10"))
+POLL_INTERVAL_FAST = float(os.getenv("POLL_INTERVAL_FAST", "20"))
+POLL_INTERVAL_BASE = float(os.getenv("POLL_INTERVAL_BASE", "60"))
+POLL_INTERVAL_MAX = float(os.getenv("POLL_INTERVAL_MAX", "900"))
+# YouTube API módban egy ellenőrzés search?eventType=live = 100 kvóta egység, ezért ott a gyors
+# intervallum sem lehet sűrűbb a korábbi fix 60 mp-es pollnál (ugyanaz a kvóta keret)
+YOUTUBE_POLL_INTERVAL_FAST = max(60.0, float(os.getenv("YOUTUBE_POLL_INTERVAL_FAST", "60")))
+POLL_INTERVAL_FAST_BY_PLATFORM = {
+    "twitch": POLL_INTERVAL_FAST,
+    "kick": POLL_INTERVAL_FAST,
+    "youtube": YOUTUBE_POLL_INTERVAL_FAST,
+}
+POLL_BACKOFF_STEP = 10                  # ennyi offline lekérdezésenként duplázódik az intervallum
+POLL_FAST_AFTER_OFFLINE = 30 * 60       # offline után ennyi ideig gyors poll (újraindított stream)
+POLL_SUSPECT_WINDOW = 30 * 60           # gyanús go-live jelzés után ennyi ideig gyors poll
+POLL_RECENT_LIVE = 7 * 24 * 3600        # ennyin belül élő csatorna nem lassul le
+
+async def fixed_rate_ticks(period):
+    """Fix ütemű tick: a következő ébredés az előzőhöz képest számolódik (nem a kör végéhez),
+    a túlfutás miatt kimaradt tickeket átugorjuk."""
+    loop = asyncio.get_running_loop()
+    next_tick = loop.time()
+    while True:
+        yield
+        next_tick += period
+        now = loop.time()
+        if next_tick < now:
+            next_tick += ((now - next_tick) // period + 1) * period
+        await asyncio.sleep(next_tick - now)
+
+class PollScheduler:
+    def __init__(self):
+        self._heap = []       # (due, seq, platform, username) – lusta törlés: a _due a mérvadó
+        self._due = {}        # (platform, username) -> due (time.time())
+        self._inflight = set()
+        self._seq = 0
+        # (platform, username) -> { "live", "idle", "last_live", "last_offline", "suspect_until", "hours": [24] }
+        self.stats = {}
+
+    def _push(self, key, due):
+        self._seq += 1
+        self._due[key] = due
+        heapq.heappush(self._heap, (due, self._seq, key[0], key[1]))
+
+    def _stat(self, key):
+        return self.stats.setdefault(key, {
+            "live": False, "idle": 0, "last_live": 0, "last_offline": 0, "suspect_until": 0, "hours": [0] * 24,
+        })
+
+    def sync(self, platform, usernames):
+        """Új streamerek azonnal esedékesek, a már nem figyeltek kikerülnek (a statisztikájukkal együtt)."""
+        now = time.time()
+        wanted = set(usernames)
+        for key in [k for k in self._due if k[0] == platform and k[1] not in wanted]:
+            del self._due[key]
+        for key in [k for k in self.stats if k[0] == platform and k[1] not in wanted]:
+            del self.stats[key]
+        for username in wanted:
+            key = (platform, username)
+            if key not in self._due and key not in self._inflight:
+                self._push(key, now)
+
+    def pop_due(self, platform, now=None):
+        """Az adott platform esedékes streamerei (a heapből kivéve, "in flight" állapotba)."""
+        now = time.time() if now is None else now
+        due, keep = [], []
+        while self._heap and self._heap[0][0] <= now:
+            item = heapq.heappop(self._heap)
+            key = (item[2], item[3])
+            if self._due.get(key) != item[0]:
+                continue  # elavult bejegyzés
+            if key[0] != platform:
+                keep.append(item)
+                continue
+            del self._due[key]
+            self._inflight.add(key)
+            due.append(key[1])
+        for item in keep:
+            heapq.heappush(self._heap, item)
+        return due
+
+    def interval(self, key, now=None):
+        now = time.time() if now is None else now
+        st = self._stat(key)
+        fast = POLL_INTERVAL_FAST_BY_PLATFORM.get(key[0], POLL_INTERVAL_FAST)
+        if st["live"]:
+            return POLL_INTERVAL_BASE
+        if now < st["suspect_until"] or now - st["last_offline"] < POLL_FAST_AFTER_OFFLINE:
+            return fast
+        hours = st["hours"]
+        total = sum(hours)
+        if total:
+            h = time.gmtime(now).tm_hour
+            window = hours[(h - 1) % 24] + hours[h] + hours[(h + 1) % 24]
+            if window >= max(1, 0.15 * total):
+                return fast
+        if now - st["last_live"] < POLL_RECENT_LIVE:
+            return POLL_INTERVAL_BASE
+        return min(POLL_INTERVAL_BASE * 2 ** (st["idle"] // POLL_BACKOFF_STEP), POLL_INTERVAL_MAX)
+
+    def record(self, platform, username, live):
+        """Lekérdezés eredménye -> statisztika frissítés és következő esedékesség."""
+        key = (platform, username)
+        now = time.time()
+        st = self._stat(key)
+        if live:
+            if not st["live"]:
+                st["hours"][time.gmtime(now).tm_hour] += 1
+            st["idle"] = 0
+            st["last_live"] = now
+        else:
+            if st["live"]:
+                st["last_offline"] = now
+            st["idle"] += 1
+        st["live"] = bool(live)
+        self._inflight.discard(key)
+        self._push(key, now + self.interval(key, now))
+
+    def suspect(self, platform, username):
+        """Gyanús go-live (pl. bejelentett adás): azonnal esedékes, és egy ideig gyors poll."""
+        key = (platform, username)
+        if key not in streamer_index:
+            return  # parancsban lekérdezett, de senki által nem figyelt név
+        self._stat(key)["suspect_until"] = time.time() + POLL_SUSPECT_WINDOW
+        if key not in self._inflight:
+            self._push(key, time.time())
+
+    def finish_cycle(self, platform, carried):
+        """Kör vége: a határidő miatt megszakítottak azonnal, a sikertelenek alap intervallummal esedékesek."""
+        now = time.time()
+        carried = set(carried)
+        for key in [k for k in self._inflight if k[0] == platform]:
+            self._inflight.discard(key)
+            self._push(key, now if key[1] in carried else now + POLL_INTERVAL_BASE)
+
+poll_scheduler = PollScheduler()
+
 # ------------------------
 # Twitch watcher (indul a setup_hook-ban)
 # ------------------------
+async def send_twitch_live_notification(guild_id, username, info, stream_data, detected=None):
+    """Egyszeri SZÖVEGES értesítés egy újonnan élő Twitch streamről (watcher és EventSub közös).
+    detected: az észlelés ideje (unix), a késleltetés méréshez."""
+    detected = detected or time.time()
+    channel_id = info.get("channel_id")
+    channel = bot.get_channel(channel_id)
+    if channel:
+        title = stream_data.get("title", "Ismeretlen cím")
+        user_name = stream_data.get("user_name", username)
+        game_name = stream_data.get("game_name", "Ismeretlen játék")
+        # SZÖVEGES üzenet (nem embed)
+        msg = (
+            f"🎥 **{user_name}** élőben van a Twitch-en!\n"
+            f"📌 Mit streamel: {game_name}\n"
+            f"🔗 https://twitch.tv/{user_name}\n"
+            f"📝 Cím: {title}"
+        )
+        try:
+            await channel.send(msg)
+            metrics.inc("darky_notifications_total", {"platform": "twitch", "result": "sent"})
+            latency_tracker.record("twitch", guild_id, stream_data.get("started_at"), detected, time.time())
+            print(f"➡️ Szöveges értesítés elküldve: {user_name} -> {channel_id} (guild: {guild_id})")
+        except Exception as e:
+            metrics.inc("darky_notifications_total", {"platform": "twitch", "result": "failed"})
+            print(f"⚠️ Nem sikerült értesítést küldeni {user_name} -> {channel_id}: {e}")
+    else:
+        metrics.inc("darky_notifications_total", {"platform": "twitch", "result": "failed"})
+        print(f"⚠️ Nem található csatorna (ID: {channel_id}) a guildben (guild_id: {guild_id}).")
+
+async def twitch_watch_cycle():
+    """Egy poll kör: az esedékes loginok 100-as csomagokban, párhuzamosan mennek a Helix felé."""
+    if not TWITCH_CLIENT_ID or not TWITCH_ACCESS_TOKEN:
+        return
+    # A twitch_streams most szerkezet: { guild_id_or_None: { username: {channel_id, live}, ... }, ... }
+
+    async def on_result(chunk, live_streams):
+        if live_streams is None:
+            # sikertelen lekérdezés -> nem változtatunk az állapoton
+            return
+        detected = time.time()
+        for username in chunk:
+            stream_data = live_streams.get(username)
+            live = stream_data is not None
+            poll_scheduler.record("twitch", username, live)
+            # stream_data tartalmaz: id, user_id, user_name, game_id, game_name, title, viewer_count, started_at, language, thumbnail_url, etc.
+            for guild_id, _channel_id in list(streamer_index.get(("twitch", username), [])):
+                try:
+                    info = twitch_streams.get(guild_id, {}).get(username)
+                    if info is None:
+                        continue
+                    if live and not info.get("live", False):
+                        # Stream újonnan élő -> küldj egyszeri SZÖVEGES üzenetet a channel_id-be
+                        await send_twitch_live_notification(guild_id, username, info, stream_data, detected)
+                        set_live_flag("twitch", info, True)
+                    elif not live and info.get("live", False):
+                        # Stream lezárt -> állapot reset
+                        set_live_flag("twitch", info, False)
+                    # runtime állapot, nem írjuk ideiglenes fájlba itt (a dbtwitch add/remove mentik a listát)
+                except Exception as inner:
+                    print(f"[twitch_watcher belső hiba] {inner}")
+                    traceback.print_exc()
+
+    poll_scheduler.sync("twitch", watched_streamers("twitch"))
+    due = poll_scheduler.pop_due("twitch")
+    if due:
+        # a carryover loginonként tárolódik: az átvitt loginok kerülnek az első csomagokba
+        chunks = twitch_login_chunks(watcher_cycle_keys("twitch", due))
+        await run_bounded("twitch", chunks, fetch_twitch_streams_chunk, on_result, carry=list)
+    poll_scheduler.finish_cycle("twitch", watcher_carryover["twitch"])
+
 async def twitch_watcher():
     await bot.wait_until_ready()
     print("🔁 Twitch watcher elindult.")
-    # rebuild állapot induláskor a fájlból (ha közben deploy-olsz, újra beolvas)
-    global twitch_streams
-    twitch_streams = build_twitch_state_from_file()
+    # az állapotot (élő flagekkel) a setup_hook már visszatöltötte a runtime állapotból
 
-    while not bot.is_closed():
+    async for _ in fixed_rate_ticks(POLL_TICK):
+        if bot.is_closed():
+            break
         try:
-            # A twitch_streams most szerkezet: { guild_id_or_None: { username: {channel_id, live}, ... }, ... }
-            for guild_id, users in list(twitch_streams.items()):
-                for username, info in list(users.items()):
-                    try:
-                        live, stream_data = await is_twitch_live(username)
-                        # stream_data tartalmaz: id, user_id, user_name, game_id, game_name, title, viewer_count, started_at, language, thumbnail_url, etc.
-                        if live and not info.get("live", False):
-                            # Stream újonnan élő -> küldj egyszeri SZÖVEGES üzenetet a channel_id-be
-                            channel_id = info.get("channel_id")
-                            channel = bot.get_channel(channel_id)
-                            if channel:
-                                title = stream_data.get("title", "Ismeretlen cím")
-                                user_name = stream_data.get("user_name", username)
-                                game_name = stream_data.get("game_name", "Ismeretlen játék")
-                                # SZÖVEGES üzenet (nem embed)
-                                msg = (
-                                    f"🎥 **{user_name}** élőben van a Twitch-en!\n"
-                                    f"📌 Mit streamel: {game_name}\n"
-                                    f"🔗 https://twitch.tv/{user_name}\n"
-                                    f"📝 Cím: {title}"
-                                )
-                                try:
-                                    await channel.send(msg)
-                                    print(f"➡️ Szöveges értesítés elküldve: {user_name} -> {channel_id} (guild: {guild_id})")
-                                except Exception as e:
-                                    print(f"⚠️ Nem sikerült értesítést küldeni {user_name} -> {channel_id}: {e}")
-                            else:
-                                print(f"⚠️ Nem található csatorna (ID: {channel_id}) a guildben (guild_id: {guild_id}).")
-                            twitch_streams[guild_id][username]["live"] = True
-                        elif not live and info.get("live", False):
-                            # Stream lezárt -> állapot reset
-                            twitch_streams[guild_id][username]["live"] = False
-                        # runtime állapot, nem írjuk ideiglenes fájlba itt (a dbtwitch add/remove mentik a listát)
-                    except Exception as inner:
-                        print(f"[twitch_watcher belső hiba] {inner}")
-                        traceback.print_exc()
-            await asyncio.sleep(60)  # ellenőrzés gyakorisága (másodperc)
+            if TWITCH_MODE == "eventsub" and twitch_eventsub_healthy():
+                # EventSub él és minden streamerre fel vagyunk iratkozva -> nincs szükség pollra
+                continue
+            if TWITCH_MODE == "eventsub" and twitch_eventsub["resync"]:
+                # friss EventSub kapcsolat után mindenkit azonnal újraellenőrzünk
+                # (poll módban nincs mit pótolni: az ütemező visszatöltött állapota marad)
+                for username in watched_streamers("twitch"):
+                    poll_scheduler.suspect("twitch", username)
+                twitch_eventsub["resync"] = False
+            await timed_cycle("twitch", POLL_TICK, twitch_watch_cycle)
         except Exception as e:
             print(f"[twitch_watcher főhiba] {e}")
             traceback.print_exc()
-            await asyncio.sleep(60)
 
 
 
 # ------------------------
-# YouTube watcher (automatikus értesítések)
+# Twitch EventSub (WebSocket transport): stream.online / stream.offline push
+# A kapcsolat a session_welcome-ban kap session ID-t, erre iratkozunk fel streamerenként.
+# - session_keepalive: ha keepalive_timeout_seconds (+ ráhagyás) alatt nem jön üzenet, újrakapcsolódunk
+# - session_reconnect: új URL-re kapcsolódunk, a feliratkozások megmaradnak (nem iratkozunk újra)
+# - minden más (friss) kapcsolatnál újra fel kell iratkozni, és egy poll kör újraszinkronizálja a live flageket
 # ------------------------
-
-async def youtube_watcher():
+TWITCH_EVENTSUB_TYPES = ("stream.online", "stream.offline")
+TWITCH_EVENTSUB_KEEPALIVE_GRACE = 5      # másodperc ráhagyás a keepalive timeout-ra
+TWITCH_EVENTSUB_RECONCILE_INTERVAL = 60  # új / törölt streamerek ellenőrzése (másodperc)
+
+# futásidejű állapot: session_id, feliratkozott loginok, login -> user_id cache, resync igény
+twitch_eventsub = {"session_id": None, "subscribed": set(), "user_ids": {}, "resync": True}
+_twitch_eventsub_seen_ids = deque(maxlen=200)  # üzenet ID-k (a Twitch újraküldhet)
+
+def twitch_eventsub_healthy():
+    """Igaz, ha van élő EventSub session és minden figyelt streamerre van feliratkozás."""
+    if not twitch_eventsub["session_id"] or twitch_eventsub["resync"]:
+        return False
+    watched = set(watched_streamers("twitch"))
+    return watched <= twitch_eventsub["subscribed"]
+
+async def get_twitch_user_ids(logins):
+    """Batch login -> user_id feloldás (/users, max. 100 login / kérés), cache-elve."""
+    cache = twitch_eventsub["user_ids"]
+    missing = sorted({l for l in logins if l not in cache and TWITCH_LOGIN_RE.match(l)})
+    headers = {
+        "Client-ID": TWITCH_CLIENT_ID,
+        "Authorization": f"Bearer {TWITCH_ACCESS_TOKEN}"
+    }
+    for i in range(0, len(missing), TWITCH_HELIX_BATCH):
+        chunk = missing[i:i + TWITCH_HELIX_BATCH]
+        try:
+            async with provider_request("twitch", "GET", f"{TWITCH_API_BASE}/users", headers=headers,
+                                   params=[("login", u) for u in chunk], timeout=HTTP_TIMEOUT) as resp:
+                if resp.status != 200:
+                    print(f"[Twitch API] /users hiba: {resp.status}")
+                    continue
+                data = await resp.json()
+        except Exception as e:
+            print(f"[Twitch API hiba (/users)] {e}")
+            continue
+        for u in data.get("data") or []:
+            cache[u.get("login", "").lower()] = u.get("id")
+    return {l: cache[l] for l in logins if cache.get(l)}
+
+async def twitch_eventsub_subscribe_all():
+    """Feliratkozás minden figyelt streamer online/offline eseményére az aktuális sessionhöz."""
+    session_id = twitch_eventsub["session_id"]
+    if not session_id:
+        return
+    watched = set(watched_streamers("twitch"))
+    todo = watched - twitch_eventsub["subscribed"]
+    if not todo:
+        return
+    ids = await get_twitch_user_ids(todo)
+    headers = {
+        "Client-ID": TWITCH_CLIENT_ID,
+        "Authorization": f"Bearer {TWITCH_ACCESS_TOKEN}",
+        "Content-Type": "application/json",
+    }
+    for login, user_id in ids.items():
+        ok = True
+        for sub_type in TWITCH_EVENTSUB_TYPES:
+            body = {
+                "type": sub_type,
+                "version": "1",
+                "condition": {"broadcaster_user_id": user_id},
+                "transport": {"method": "websocket", "session_id": session_id},
+            }
+            try:
+                async with provider_request("twitch", "POST", f"{TWITCH_API_BASE}/eventsub/subscriptions", headers=headers,
+                                        json=body, timeout=HTTP_TIMEOUT) as resp:
+                    # 409 = már létezik ugyanerre a sessionre
+                    if resp.status not in (202, 409):
+                        text = await resp.text()
+                        print(f"[EventSub] Feliratkozás hiba ({login}, {sub_type}): {resp.status} - {text[:200]}")
+                        ok = False
+            except Exception as e:
+                print(f"[EventSub hiba] {login}: {e}")
+                ok = False
+        if ok and twitch_eventsub["session_id"] == session_id:
+            twitch_eventsub["subscribed"].add(login)
+    # a már nem figyelt streamereket elfelejtjük (a Twitch oldali feliratkozás a session végén megszűnik)
+    twitch_eventsub["subscribed"] &= watched
+
+async def handle_twitch_eventsub_notification(sub_type, event):
+    login = (event.get("broadcaster_user_login") or "").lower()
+    if not login:
+        return
+    if sub_type == "stream.online":
+        # cím / játék miatt lekérjük a stream adatait; ha még nincs a Helixben, az eseményből dolgozunk
+        detected = time.time()
+        live_streams, _ = await get_twitch_live_streams([login])
+        stream_data = live_streams.get(login) or {
+            "user_name": event.get("broadcaster_user_name", login),
+            "started_at": event.get("started_at"),
+        }
+        for guild_id, _channel_id in list(streamer_index.get(("twitch", login), [])):
+            info = twitch_streams.get(guild_id, {}).get(login)
+            if info and not info.get("live", False):
+                await send_twitch_live_notification(guild_id, login, info, stream_data, detected)
+                set_live_flag("twitch", info, True)
+    elif sub_type == "stream.offline":
+        for guild_id, _channel_id in list(streamer_index.get(("twitch", login), [])):
+            info = twitch_streams.get(guild_id, {}).get(login)
+            if info:
+                set_live_flag("twitch", info, False)
+
+async def _twitch_eventsub_connect(url):
+    """Kapcsolódás és várakozás a session_welcome üzenetre. Visszaad: (ws, session_id, keepalive_timeout)."""
+    ws = await get_http_session().ws_connect(url, heartbeat=None, autoping=True)
+    try:
+        msg = await ws.receive(timeout=30)
+        data = json.loads(msg.data) if msg.type == aiohttp.WSMsgType.TEXT else {}
+        if data.get("metadata", {}).get("message_type") != "session_welcome":
+            raise RuntimeError(f"EventSub: nem session_welcome üzenet érkezett ({msg.type})")
+        sess = data["payload"]["session"]
+        return ws, sess["id"], sess.get("keepalive_timeout_seconds") or 10
+    except BaseException:
+        await ws.close()
+        raise
+
+async def _twitch_eventsub_reconcile_loop():
+    while True:
+        await asyncio.sleep(TWITCH_EVENTSUB_RECONCILE_INTERVAL)
+        await twitch_eventsub_subscribe_all()
+
+async def twitch_eventsub_session():
+    """Egy friss EventSub kapcsolat élete (a session_reconnect-eket is beleértve). Hibánál kivétellel tér vissza."""
+    ws, session_id, keepalive = await _twitch_eventsub_connect(TWITCH_EVENTSUB_WS_URL)
+    twitch_eventsub["session_id"] = session_id
+    twitch_eventsub["subscribed"] = set()
+    twitch_eventsub["resync"] = True  # friss kapcsolat: a kimaradt eseményeket egy poll kör pótolja
+    print(f"🔌 Twitch EventSub kapcsolódva (session: {session_id})")
+    # a welcome után 10 mp-en belül fel kell iratkozni
+    await twitch_eventsub_subscribe_all()
+    reconcile_task = asyncio.create_task(_twitch_eventsub_reconcile_loop())
+    try:
+        while not bot.is_closed():
+            try:
+                msg = await ws.receive(timeout=keepalive + TWITCH_EVENTSUB_KEEPALIVE_GRACE)
+            except asyncio.TimeoutError:
+                raise RuntimeError("EventSub keepalive timeout")
+            if msg.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                raise RuntimeError(f"EventSub kapcsolat lezárult ({ws.close_code})")
+            if msg.type != aiohttp.WSMsgType.TEXT:
+                continue
+            data = json.loads(msg.data)
+            meta = data.get("metadata", {})
+            message_id = meta.get("message_id")
+            if message_id in _twitch_eventsub_seen_ids:
+                continue
+            _twitch_eventsub_seen_ids.append(message_id)
+            mtype = meta.get("message_type")
+            payload = data.get("payload", {})
+            if mtype == "session_keepalive":
+                continue
+            if mtype == "notification":
+                try:
+                    await handle_twitch_eventsub_notification(meta.get("subscription_type"), payload.get("event", {}))
+                except Exception as e:
+                    print(f"[EventSub értesítés hiba] {e}")
+                    traceback.print_exc()
+            elif mtype == "session_reconnect":
+                # új kapcsolat a megadott URL-re; a régit csak a welcome után zárjuk, a feliratkozások átjönnek
+                reconnect_url = payload["session"]["reconnect_url"]
+                new_ws, new_id, new_keepalive = await _twitch_eventsub_connect(reconnect_url)
+                # a régi kapcsolatot lezárjuk, mielőtt az újra váltunk (az új üzenetei addig pufferben várnak)
+                await ws.close()
+                ws, keepalive = new_ws, new_keepalive
+                twitch_eventsub["session_id"] = new_id
+                print(f"🔁 Twitch EventSub áthelyezve (session: {new_id})")
+            elif mtype == "revocation":
+                sub = payload.get("subscription", {})
+                print(f"⚠️ EventSub feliratkozás visszavonva: {sub.get('type')} ({sub.get('status')})")
+                uid = sub.get("condition", {}).get("broadcaster_user_id")
+                for login, cached_id in twitch_eventsub["user_ids"].items():
+                    if cached_id == uid:
+                        twitch_eventsub["subscribed"].discard(login)
+    finally:
+        reconcile_task.cancel()
+        twitch_eventsub["session_id"] = None
+        await ws.close()
+
+async def twitch_eventsub_client():
     await bot.wait_until_ready()
-    print("🔁 YouTube watcher elindult.")
-    seen = {}
-
+    if not TWITCH_CLIENT_ID or not TWITCH_ACCESS_TOKEN:
+        print("⚠️ Twitch EventSub nem indul: hiányzó TWITCH_CLIENT_ID / TWITCH_ACCESS_TOKEN.")
+        return
+    print("🔁 Twitch EventSub kliens elindult.")
+    backoff = 1
     while not bot.is_closed():
+        started = time.monotonic()
         try:
-            for guild_id, users in list(youtube_channels.items()):
-                for username, info in list(users.items()):
-                    try:
-                        live, title, url = await is_youtube_live_only(username)
-                        if not live or not url:
-                            continue
-
-                        last_url = seen.get(guild_id, {}).get(username)
-                        if last_url == url:
-                            continue
-
-                        channel_id = info.get("channel_id")
-                        channel = bot.get_channel(channel_id)
-                        if channel:
-                            msg = f"🔴 **{username}** élőben a YouTube-on!\n📝 {title}\n🔗 {url}"
-                            await channel.send(msg)
+            await twitch_eventsub_session()
+        except Exception as e:
+            print(f"[EventSub] Kapcsolat megszakadt: {e}")
+        # ha sokáig élt a kapcsolat, gyorsan próbálkozunk újra; különben exponenciális várakozás
+        if time.monotonic() - started > 60:
+            backoff = 1
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, 60)
+
 
-                            embed = discord.Embed(
-                                title=f"{username} YouTube csatornája",
-                                url=f"https://youtube.com/@{username}",
-                                description=f"🔴 **ÉLŐ**: {title}",
-                                color=discord.Color.red()
-                            )
-                            if "watch?v=" in url:
-                                vid_id = url.split("watch?v=")[-1]
-                                embed.set_image(url=f"https://img.youtube.com/vi/{vid_id}/maxresdefault.jpg")
+# ------------------------
+# YouTube watcher (automatikus értesítések)
+# ------------------------
+
+# a már bejelentett élő adások: guild_id -> username -> url (mindkét mód ezt használja)
+youtube_seen = {}
+youtube_seen_at = {}  # (guild_id, username) -> bejelentés ideje (a runtime állapot mentéséhez)
+
+async def send_youtube_live_notification(guild_id, username, info, title, url, started_at=None, detected=None):
+    """Egyszeri értesítés egy élő YouTube adásról; az ismételt bejelentést a youtube_seen szűri.
+    started_at: az adás tényleges kezdete (ha ismert), detected: az észlelés ideje (unix)."""
+    detected = detected or time.time()
+    last_url = youtube_seen.get(guild_id, {}).get(username)
+    if last_url == url:
+        return
+
+    channel_id = info.get("channel_id")
+    channel = bot.get_channel(channel_id)
+    if channel:
+        msg = f"🔴 **{username}** élőben a YouTube-on!\n📝 {title}\n🔗 {url}"
+
+        embed = discord.Embed(
+            title=f"{username} YouTube csatornája",
+            url=f"https://youtube.com/@{username}",
+            description=f"🔴 **ÉLŐ**: {title}",
+            color=discord.Color.red()
+        )
+        if "watch?v=" in url:
+            vid_id = url.split("watch?v=")[-1]
+            embed.set_image(url=f"https://img.youtube.com/vi/{vid_id}/maxresdefault.jpg")
+
+        try:
+            await channel.send(msg)
+            await channel.send(embed=embed)
+        except Exception:
+            metrics.inc("darky_notifications_total", {"platform": "youtube", "result": "failed"})
+            raise
+        metrics.inc("darky_notifications_total", {"platform": "youtube", "result": "sent"})
+        latency_tracker.record("youtube", guild_id, started_at, detected, time.time())
+    else:
+        metrics.inc("darky_notifications_total", {"platform": "youtube", "result": "failed"})
+
+    youtube_seen.setdefault(guild_id, {})[username] = url
+    youtube_seen_at[(guild_id, username)] = time.time()
+    state_snapshots.invalidate("youtube")
+
+async def youtube_watch_cycle():
+    """Egy kör API módban: az esedékes streamerek lekérdezése, az eredmény minden feliratkozott szerverhez megy."""
+    async def on_result(username, result):
+        live, title, url = result
+        poll_scheduler.record("youtube", username, live and bool(url))
+        if not live or not url:
+            return
+        detected = time.time()
+        for guild_id, _channel_id in list(streamer_index.get(("youtube", username), [])):
+            info = youtube_channels.get(guild_id, {}).get(username)
+            if info is not None:
+                try:
+                    await send_youtube_live_notification(guild_id, username, info, title, url, detected=detected)
+                except Exception as inner:
+                    print(f"[youtube_watcher belső hiba] {inner}")
 
-                            await channel.send(embed=embed)
+    poll_scheduler.sync("youtube", watched_streamers("youtube"))
+    due = poll_scheduler.pop_due("youtube")
+    if due:
+        await run_bounded("youtube", due, is_youtube_live_only, on_result)
+    poll_scheduler.finish_cycle("youtube", watcher_carryover["youtube"])
 
-                        seen.setdefault(guild_id, {})[username] = url
-                    except Exception as inner:
-                        print(f"[youtube_watcher belső hiba] {inner}")
+async def youtube_watcher():
+    await bot.wait_until_ready()
+    print(f"🔁 YouTube watcher elindult. (mód: {YOUTUBE_MODE})")
 
-            await asyncio.sleep(60)  # 1 minute
+    # feed módban a feedek ingyenesek (feltételes GET), ott fix YOUTUBE_FEED_INTERVAL a kör
+    async for _ in fixed_rate_ticks(YOUTUBE_FEED_INTERVAL if YOUTUBE_MODE == "feed" else POLL_TICK):
+        if bot.is_closed():
+            break
+        try:
+            if YOUTUBE_MODE == "feed":
+                await timed_cycle("youtube", YOUTUBE_FEED_INTERVAL, youtube_feed_cycle)
+            else:
+                await timed_cycle("youtube", POLL_TICK, youtube_watch_cycle)
         except Exception as e:
             print(f"[youtube_watcher főhiba] {e}")
-            await asyncio.sleep(60)  # 1 minute
 
 # ------------------------
 # YouTube csatornák betöltése / mentése és állapot
 # Formátum: [ { "username": "ytUser", "channel_id": 123..., "guild_id": 111... }, ... ]
 # ------------------------
 def load_youtube_channels():
+    pending = json_store.pending(YOUTUBE_FILE)
+    if pending is not None:
+        return pending
     if not os.path.exists(YOUTUBE_FILE):
         return []
     with open(YOUTUBE_FILE, "r", encoding="utf-8") as f:
@@ -365,19 +1763,12 @@ def load_youtube_channels():
             return []
 
 def save_youtube_channels(list_obj):
-    # Eredeti JSON mentése
-    with open(YOUTUBE_FILE, "w", encoding="utf-8") as f:
-        json.dump(list_obj, f, ensure_ascii=False, indent=4)
-    # Ideiglenes állapot mentése webre
-    try:
-        with open(YOUTUBE_INTERNAL_FILE, "w", encoding="utf-8") as f:
-            json.dump(list_obj, f, ensure_ascii=False, indent=4)
-    except Exception as e:
-        print(f"⚠️ Nem sikerült menteni {YOUTUBE_INTERNAL_FILE}: {e}")
+    # Eredeti JSON + ideiglenes állapot a webre (/youtube_streams_state.json) ugyanabból a tartalomból
+    json_store.save(YOUTUBE_FILE, list_obj, mirrors=(YOUTUBE_INTERNAL_FILE,))
 
-def build_youtube_state_from_file():
-    arr = load_youtube_channels()
+def youtube_state_from_list(arr):
     state = {}
+    skipped = []  # értelmezhetetlen sorok (a fájlban megmaradnak)
     for item in arr:
         try:
             uname = item.get("username", "").lower()
@@ -396,12 +1787,19 @@ def build_youtube_state_from_file():
                         gid_val = None
                 except Exception:
                     gid_val = None
-            if uname:
-                if gid_val not in state:
-                    state[gid_val] = {}
-                state[gid_val][uname] = {"channel_id": cid}
+            if not uname:
+                raise ValueError("hiányzó username")
+            if gid_val not in state:
+                state[gid_val] = {}
+            state[gid_val][uname] = {"channel_id": cid, "row": item}
         except Exception:
-            continue
+            skipped.append(item)
+    keep_unparsed_rows("youtube", skipped)
+    return state
+
+def build_youtube_state_from_file():
+    state = youtube_state_from_list(load_youtube_channels())
+    rebuild_streamer_index("youtube", state)
     return state
 
 # runtime állapot inicializálása
@@ -415,48 +1813,108 @@ except Exception:
     pass
 
 
+# ------------------------
+# YouTube csatorna ID feloldás cache (username -> channelId)
+# A search?type=channel 100 kvóta egység, ezért a feloldást fájlba mentjük (youtube_streams.json mellé).
+# Formátum: { "username": { "channel_id": "UC..." | null, "resolved_at": unix_ts }, ... }
+# A null érték negatív cache: nem feloldható név, rövidebb ideig tároljuk.
+# ------------------------
+YOUTUBE_CHANNEL_CACHE_TTL = 30 * 24 * 3600          # sikeres feloldás érvényessége (30 nap)
+YOUTUBE_CHANNEL_NEGATIVE_CACHE_TTL = 24 * 3600      # sikertelen feloldás érvényessége (1 nap)
+
+def normalize_youtube_username(username: str):
+    return username.strip().lstrip('@').split('/')[-1].lower()
+
+def load_youtube_channel_cache():
+    if not os.path.exists(YOUTUBE_CHANNEL_CACHE_FILE):
+        return {}
+    with open(YOUTUBE_CHANNEL_CACHE_FILE, "r", encoding="utf-8") as f:
+        try:
+            data = json.load(f)
+            if isinstance(data, dict):
+                return data
+            return {}
+        except json.JSONDecodeError:
+            return {}
+
+def save_youtube_channel_cache():
+    json_store.save(YOUTUBE_CHANNEL_CACHE_FILE, youtube_channel_cache)
+
+youtube_channel_cache = load_youtube_channel_cache()
+
+async def resolve_youtube_channel_id(username: str, force: bool = False, background: bool = True):
+    """Visszaad: channelId (str) vagy None. Cache-ből dolgozik, csak lejárt / hiányzó bejegyzésnél hív API-t."""
+    if not YOUTUBE_API_KEY:
+        return None
+    key = normalize_youtube_username(username)
+    if not key:
+        return None
+
+    entry = youtube_channel_cache.get(key)
+    if entry and not force:
+        ttl = YOUTUBE_CHANNEL_CACHE_TTL if entry.get("channel_id") else YOUTUBE_CHANNEL_NEGATIVE_CACHE_TTL
+        if time.time() - entry.get("resolved_at", 0) < ttl:
+            return entry.get("channel_id")
+
+    base = YOUTUBE_API_BASE
+    lookup = username.strip().lstrip('@').split('/')[-1]
+    try:
+        # 1) legacy username (1 kvóta egység)
+        params = {"part": "id", "forUsername": lookup, "key": YOUTUBE_API_KEY}
+        async with provider_request("youtube", "GET", f"{base}/channels", params=params, timeout=HTTP_TIMEOUT,
+                                    background=background) as resp:
+            if resp.status != 200:
+                print(f"[YouTube API] Csatorna feloldás hiba: {resp.status} ({key})")
+                return entry.get("channel_id") if entry else None
+            data = await resp.json()
+        items = data.get("items") or []
+        if items:
+            channel_id = items[0]["id"]
+        else:
+            # 2) handle / custom URL -> keresés (100 kvóta egység)
+            s_params = {"part": "snippet", "q": lookup, "type": "channel", "maxResults": 1, "key": YOUTUBE_API_KEY}
+            async with provider_request("youtube", "GET", f"{base}/search", params=s_params, timeout=HTTP_TIMEOUT,
+                                        background=background) as s_resp:
+                if s_resp.status != 200:
+                    print(f"[YouTube API] Csatorna keresés hiba: {s_resp.status} ({key})")
+                    return entry.get("channel_id") if entry else None
+                s_data = await s_resp.json()
+            s_items = s_data.get("items") or []
+            channel_id = s_items[0]["id"]["channelId"] if s_items else None
+    except Exception as e:
+        # hálózati hiba: nem írjuk felül a cache-t, a régi (akár lejárt) értékkel megyünk tovább
+        print(f"[YouTube API hiba] {e}")
+        return entry.get("channel_id") if entry else None
+
+    youtube_channel_cache[key] = {"channel_id": channel_id, "resolved_at": int(time.time())}
+    save_youtube_channel_cache()
+    return channel_id
+
 # Új helper – csak élő stream ellenőrzés
+@instrumented("is_youtube_live_only")
 async def is_youtube_live_only(username: str):
     """Visszaad: (live: bool, title: str | None, url: str | None)"""
     if not YOUTUBE_API_KEY:
         return False, None, None
 
-    username = username.strip().lstrip('@').split('/')[-1]
-    base = "https://www.googleapis.com/youtube/v3"
-
-    # Csatorna ID keresés
-    chan_url = f"{base}/channels"
-    params = {"part": "id", "forUsername": username, "key": YOUTUBE_API_KEY}
+    base = YOUTUBE_API_BASE
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(chan_url, params=params, timeout=15) as resp:
-            data = await resp.json()
-            items = data.get("items") or []
-            if not items:
-                # ha nincs találat -> kereséssel
-                search_url = f"{base}/search"
-                s_params = {"part": "snippet", "q": username, "type": "channel", "maxResults": 1, "key": YOUTUBE_API_KEY}
-                async with session.get(search_url, params=s_params, timeout=15) as s_resp:
-                    s_data = await s_resp.json()
-                    s_items = s_data.get("items") or []
-                    if not s_items:
-                        return False, None, None
-                    channel_id = s_items[0]["id"]["channelId"]
-            else:
-                channel_id = items[0]["id"]
+    # Csatorna ID (cache-ből, ha van)
+    channel_id = await resolve_youtube_channel_id(username)
+    if not channel_id:
+        return False, None, None
 
     # Élő keresés
     live_url = f"{base}/search"
     live_params = {"part": "snippet", "channelId": channel_id, "eventType": "live",
                    "type": "video", "maxResults": 1, "key": YOUTUBE_API_KEY}
-    async with aiohttp.ClientSession() as session:
-        async with session.get(live_url, params=live_params, timeout=15) as resp:
-            l_data = await resp.json()
-            l_items = l_data.get("items") or []
-            if l_items:
-                vid = l_items[0]["id"]["videoId"]
-                title = l_items[0]["snippet"]["title"]
-                return True, title, f"https://www.youtube.com/watch?v={vid}"
+    async with provider_request("youtube", "GET", live_url, params=live_params, timeout=HTTP_TIMEOUT) as resp:
+        l_data = await resp.json()
+        l_items = l_data.get("items") or []
+        if l_items:
+            vid = l_items[0]["id"]["videoId"]
+            title = l_items[0]["snippet"]["title"]
+            return True, title, f"https://www.youtube.com/watch?v={vid}"
 
     return False, None, None
 
@@ -464,64 +1922,335 @@ async def is_youtube_live_only(username: str):
 # ------------------------
 # YouTube helper: élő-e vagy legutóbbi videó
 # ------------------------
-async def is_youtube_live_or_latest(username: str):
+async def is_youtube_live_or_latest(username: str, background: bool = True):
     """Visszaad: (live: bool, title: str | None, url: str | None)
-    Megjegyzés: a `forUsername` csak legacy YouTube felhasználóneveknél működik. Ha @handle-t adsz meg,
-    érdemes a `channels?forUsername` helyett handle feloldást is beépíteni később.
+    Megjegyzés: a `forUsername` csak legacy YouTube felhasználóneveknél működik, @handle esetén
+    a resolve_youtube_channel_id kereséssel old fel (és cache-eli az eredményt).
     """
     if not YOUTUBE_API_KEY:
         return False, None, None
 
-    username = username.strip().lstrip('@').split('/')[-1]
-
-    # 1) Csatorna ID feloldása legacy username alapján
-    base = "https://www.googleapis.com/youtube/v3"
-    chan_url = f"{base}/channels"
-    params = {"part": "id,snippet,contentDetails", "forUsername": username, "key": YOUTUBE_API_KEY}
-
-    async with aiohttp.ClientSession() as session:
-        async with session.get(chan_url, params=params, timeout=15) as resp:
-            data = await resp.json()
-            items = data.get("items") or []
-            if not items:
-                # próbáljuk meg kereséssel (handle vagy custom URL esetén)
-                search_url = f"{base}/search"
-                s_params = {"part": "snippet", "q": username, "type": "channel", "maxResults": 1, "key": YOUTUBE_API_KEY}
-                async with session.get(search_url, params=s_params, timeout=15) as s_resp:
-                    s_data = await s_resp.json()
-                    s_items = s_data.get("items") or []
-                    if not s_items:
-                        return False, None, None
-                    channel_id = s_items[0]["id"]["channelId"]
-            else:
-                channel_id = items[0]["id"]
+    # 1) Csatorna ID feloldása (legacy username, majd keresés) – cache-elve
+    base = YOUTUBE_API_BASE
+    channel_id = await resolve_youtube_channel_id(username, background=background)
+    if not channel_id:
+        return False, None, None
 
     # 2) Élő keresése
     live_url = f"{base}/search"
     live_params = {"part": "snippet", "channelId": channel_id, "eventType": "live", "type": "video", "maxResults": 1, "key": YOUTUBE_API_KEY}
-    async with aiohttp.ClientSession() as session:
-        async with session.get(live_url, params=live_params, timeout=15) as resp:
-            l_data = await resp.json()
-            l_items = l_data.get("items") or []
-            if l_items:
-                vid = l_items[0]["id"]["videoId"]
-                title = l_items[0]["snippet"]["title"]
-                return True, title, f"https://www.youtube.com/watch?v={vid}"
+    async with provider_request("youtube", "GET", live_url, params=live_params, timeout=HTTP_TIMEOUT,
+                                background=background) as resp:
+        l_data = await resp.json()
+        l_items = l_data.get("items") or []
+        if l_items:
+            vid = l_items[0]["id"]["videoId"]
+            title = l_items[0]["snippet"]["title"]
+            return True, title, f"https://www.youtube.com/watch?v={vid}"
 
     # 3) Legfrissebb videó
     latest_url = f"{base}/search"
     latest_params = {"part": "snippet", "channelId": channel_id, "maxResults": 1, "order": "date", "type": "video", "key": YOUTUBE_API_KEY}
-    async with aiohttp.ClientSession() as session:
-        async with session.get(latest_url, params=latest_params, timeout=15) as resp:
-            d = await resp.json()
-            items = d.get("items") or []
-            if items:
-                vid = items[0]["id"]["videoId"]
-                title = items[0]["snippet"]["title"]
-                return False, title, f"https://www.youtube.com/watch?v={vid}"
+    async with provider_request("youtube", "GET", latest_url, params=latest_params, timeout=HTTP_TIMEOUT,
+                                background=background) as resp:
+        d = await resp.json()
+        items = d.get("items") or []
+        if items:
+            vid = items[0]["id"]["videoId"]
+            title = items[0]["snippet"]["title"]
+            return False, title, f"https://www.youtube.com/watch?v={vid}"
 
     return False, None, None
 
+# ------------------------
+# YouTube feed mód: Atom feed (feltételes GET) + WebSub push
+# A csatornák feedje ingyenes (nem fogy kvóta); a Data API-t csak az új videókra hívjuk
+# (videos?id=..., 1 egység / max. 50 videó), hogy kiderüljön, élő adás-e.
+# Állapot (rss_youtube_streams.json):
+# { channelId: { "etag": str, "last_modified": str, "seen": [videoId, ...], "pending": { videoId: unix_ts },
+#                "websub_expires": unix_ts }, ... }
+# "pending" = bejelentett (upcoming) vagy le nem kérdezhető videó, amit addig nézünk újra, amíg élő nem lesz,
+# véget nem ér, vagy le nem jár (YOUTUBE_PENDING_MAX_AGE).
+# ------------------------
+YOUTUBE_TOPIC_URL = "https://www.youtube.com/xml/feeds/videos.xml"  # WebSub topic (a hub ezt várja)
+YOUTUBE_FEED_INTERVAL = 60              # feed pollozás gyakorisága (másodperc)
+YOUTUBE_FEED_SEEN_LIMIT = 50            # csatornánként ennyi látott videó ID-t tartunk meg
+YOUTUBE_VIDEOS_BATCH = 50               # videos?id= paraméterben max. 50 ID
+YOUTUBE_PENDING_MAX_AGE = 7 * 24 * 3600 # ennyi ideig figyelünk egy előre bejelentett adást
+WEBSUB_LEASE_SECONDS = 5 * 24 * 3600    # feliratkozás hossza
+WEBSUB_RENEW_BEFORE = 24 * 3600         # ennyivel a lejárat előtt újra feliratkozunk
+ATOM_NS = {
+    "atom": "http://www.w3.org/2005/Atom",
+    "yt": "http://www.youtube.com/xml/schemas/2015",
+}
+
+def load_youtube_feed_state():
+    if not os.path.exists(YOUTUBE_FEED_STATE_FILE):
+        return {}
+    with open(YOUTUBE_FEED_STATE_FILE, "r", encoding="utf-8") as f:
+        try:
+            data = json.load(f)
+            if isinstance(data, dict):
+                return data
+            return {}
+        except json.JSONDecodeError:
+            return {}
+
+def save_youtube_feed_state():
+    json_store.save(YOUTUBE_FEED_STATE_FILE, youtube_feed_state)
+
+youtube_feed_state = load_youtube_feed_state()
+
+def parse_youtube_feed(xml_text):
+    """Atom feed (vagy WebSub push törzs) feldolgozása.
+    Visszaad: [ { "video_id", "channel_id", "title", "published", "updated" }, ... ]
+    """
+    try:
+        root = ET.fromstring(xml_text)
+    except ET.ParseError as e:
+        print(f"[YouTube feed] Hibás XML: {e}")
+        return []
+    entries = []
+    for entry in root.findall("atom:entry", ATOM_NS):
+        video_id = entry.findtext("yt:videoId", default="", namespaces=ATOM_NS)
+        if not video_id:
+            continue
+        entries.append({
+            "video_id": video_id,
+            "channel_id": entry.findtext("yt:channelId", default="", namespaces=ATOM_NS),
+            "title": entry.findtext("atom:title", default="", namespaces=ATOM_NS),
+            "published": entry.findtext("atom:published", default="", namespaces=ATOM_NS),
+            "updated": entry.findtext("atom:updated", default="", namespaces=ATOM_NS),
+        })
+    return entries
+
+async def fetch_youtube_feed(channel_id):
+    """Feltételes GET (If-None-Match / If-Modified-Since). Visszaad: bejegyzések listája, 304 / hiba esetén []."""
+    state = youtube_feed_state.setdefault(channel_id, {})
+    headers = {}
+    if state.get("etag"):
+        headers["If-None-Match"] = state["etag"]
+    if state.get("last_modified"):
+        headers["If-Modified-Since"] = state["last_modified"]
+    try:
+        session = get_http_session()
+        async with session.get(YOUTUBE_FEED_URL, params={"channel_id": channel_id}, headers=headers, timeout=HTTP_TIMEOUT) as resp:
+            if resp.status == 304:
+                return []
+            if resp.status != 200:
+                print(f"[YouTube feed] Nem 200 a válasz: {resp.status} ({channel_id})")
+                return []
+            text = await resp.text()
+            if resp.headers.get("ETag"):
+                state["etag"] = resp.headers["ETag"]
+            if resp.headers.get("Last-Modified"):
+                state["last_modified"] = resp.headers["Last-Modified"]
+    except Exception as e:
+        print(f"[YouTube feed hiba] {e}")
+        return []
+    return parse_youtube_feed(text)
+
+async def get_youtube_videos_status(video_ids):
+    """videos?part=snippet,liveStreamingDetails – 1 kvóta egység / 50 videó.
+    Visszaad: videoId -> { "status": "live" | "upcoming" | "none", "title": str, "channel_id": str, "started_at": str | None }
+    """
+    result = {}
+    if not YOUTUBE_API_KEY or not video_ids:
+        return result
+    ids = list(dict.fromkeys(video_ids))
+    for i in range(0, len(ids), YOUTUBE_VIDEOS_BATCH):
+        chunk = ids[i:i + YOUTUBE_VIDEOS_BATCH]
+        params = {"part": "snippet,liveStreamingDetails", "id": ",".join(chunk), "key": YOUTUBE_API_KEY}
+        try:
+            async with provider_request("youtube", "GET", f"{YOUTUBE_API_BASE}/videos", params=params, timeout=HTTP_TIMEOUT) as resp:
+                if resp.status != 200:
+                    print(f"[YouTube API] videos hiba: {resp.status}")
+                    continue
+                data = await resp.json()
+        except Exception as e:
+            print(f"[YouTube API hiba] {e}")
+            continue
+        for item in data.get("items") or []:
+            snippet = item.get("snippet") or {}
+            result[item.get("id")] = {
+                "status": snippet.get("liveBroadcastContent", "none"),
+                "title": snippet.get("title", ""),
+                "channel_id": snippet.get("channelId", ""),
+                "started_at": (item.get("liveStreamingDetails") or {}).get("actualStartTime"),
+            }
+    return result
+
+def youtube_subscribers_by_channel():
+    """Feloldott YouTube channelId -> [ (guild_id, username, info), ... ] a streamer indexből."""
+    subs = {}
+    for username in watched_streamers("youtube"):
+        entry = youtube_channel_cache.get(normalize_youtube_username(username))  # a cache kulcsa normalizált
+        yt_id = entry.get("channel_id") if entry else None
+        if not yt_id:
+            continue
+        for guild_id, _channel_id in streamer_index.get(("youtube", username), []):
+            info = youtube_channels.get(guild_id, {}).get(username)
+            if info is not None:
+                subs.setdefault(yt_id, []).append((guild_id, username, info))
+    return subs
+
+# csatornánkénti zár: a push és a feed poll ne dolgozza fel egyszerre ugyanazt a csatornát
+_youtube_ingest_locks = {}
+# push-ból indított feldolgozások: erős referencia, hogy a GC ne szedje össze őket futás közben
+_youtube_ingest_tasks = set()
+
+def _youtube_ingest_done(task):
+    _youtube_ingest_tasks.discard(task)
+    if not task.cancelled() and task.exception():
+        print(f"[WebSub hiba] Feldolgozás: {task.exception()}")
+
+async def ingest_youtube_entries(channel_id, entries, subscribers=None):
+    """Új feed bejegyzések feldolgozása: csak az eddig nem látott (és a függő) videókra hív API-t."""
+    lock = _youtube_ingest_locks.setdefault(channel_id, asyncio.Lock())
+    async with lock:
+        state = youtube_feed_state.setdefault(channel_id, {})
+        seen = state.setdefault("seen", [])
+        pending = state.get("pending")
+        if not isinstance(pending, dict):
+            pending = {}
+        now = time.time()
+        pending = {vid: ts for vid, ts in pending.items() if now - ts < YOUTUBE_PENDING_MAX_AGE}
+        new_ids = [e["video_id"] for e in entries if e["video_id"] not in seen]
+        check_ids = list(dict.fromkeys(new_ids + list(pending)))
+        if not check_ids:
+            state["pending"] = pending
+            return
+
+        statuses = await get_youtube_videos_status(check_ids)
+        detected = time.time()
+        if subscribers is None:
+            subscribers = youtube_subscribers_by_channel().get(channel_id, [])
+
+        for vid in check_ids:
+            if vid not in seen:
+                seen.append(vid)
+            st = statuses.get(vid)
+            if st is None or st["status"] == "upcoming":
+                # le nem kérdezhető (API hiba) vagy még csak bejelentett adás -> később újra nézzük
+                pending.setdefault(vid, now)
+                continue
+            pending.pop(vid, None)
+            if st["channel_id"] != channel_id:
+                # a feed (vagy egy hamisított push) másik csatorna videójára mutat -> nem jelentjük be
+                print(f"[YouTube feed] {vid} nem a(z) {channel_id} csatornáé ({st['channel_id'] or '?'}), kihagyva.")
+                continue
+            if st["status"] == "live":
+                url = f"https://www.youtube.com/watch?v={vid}"
+                for guild_id, username, info in subscribers:
+                    try:
+                        await send_youtube_live_notification(guild_id, username, info, st["title"], url, st.get("started_at"), detected)
+                    except Exception as e:
+                        print(f"[YouTube feed] Értesítés hiba ({username}): {e}")
+        state["seen"] = seen[-YOUTUBE_FEED_SEEN_LIMIT:]
+        state["pending"] = pending
+        save_youtube_feed_state()
+
+async def websub_subscribe(channel_id, mode="subscribe"):
+    """Feliratkozás (vagy leiratkozás) a WebSub hubon egy csatorna feedjére. Visszaad: bool (hub elfogadta-e)."""
+    if not WEBSUB_ENABLED:
+        return False
+    form = {
+        "hub.callback": WEBSUB_CALLBACK_URL,
+        "hub.topic": f"{YOUTUBE_TOPIC_URL}?channel_id={channel_id}",
+        "hub.verify": "async",
+        "hub.mode": mode,
+        "hub.lease_seconds": str(WEBSUB_LEASE_SECONDS),
+        "hub.secret": WEBSUB_SECRET,
+    }
+    try:
+        session = get_http_session()
+        async with session.post(WEBSUB_HUB_URL, data=form, timeout=HTTP_TIMEOUT) as resp:
+            if resp.status not in (202, 204):
+                text = await resp.text()
+                print(f"[WebSub] Hub hiba: {resp.status} - {text[:200]}")
+                return False
+    except Exception as e:
+        print(f"[WebSub hiba] {e}")
+        return False
+    return True
+
+async def youtube_feed_cycle():
+    """Egy kör feed módban: feliratkozások megújítása, feed pollozás (fallback a push mellé), új videók feldolgozása."""
+    # a csatorna ID-k feloldása (cache-ből; csak új / lejárt névnél megy API hívás)
+    for username in watched_streamers("youtube"):
+        await resolve_youtube_channel_id(username)
+
+    subs = youtube_subscribers_by_channel()
+
+    async def check(channel_id):
+        state = youtube_feed_state.setdefault(channel_id, {})
+        now = time.time()
+        if WEBSUB_ENABLED and state.get("websub_expires", 0) - now < WEBSUB_RENEW_BEFORE:
+            if await websub_subscribe(channel_id):
+                # a hub aszinkron ellenőriz; a tényleges lejáratot a challenge-nél írjuk felül
+                state["websub_expires"] = now + WEBSUB_LEASE_SECONDS
+        entries = await fetch_youtube_feed(channel_id)
+        await ingest_youtube_entries(channel_id, entries, subs[channel_id])
+
+    async def on_result(channel_id, _result):
+        pass
+
+    await run_bounded("youtube", list(subs), check, on_result)
+
+def _websub_channel_from_topic(topic):
+    if not topic or "channel_id=" not in topic:
+        return None
+    return topic.split("channel_id=")[-1].split("&")[0]
+
+async def handle_websub_verify(request):
+    """WebSub hub ellenőrzés (GET): a hub.challenge-et visszaküldjük, ha a topic egy figyelt csatorna."""
+    mode = request.query.get("hub.mode")
+    topic = request.query.get("hub.topic")
+    challenge = request.query.get("hub.challenge")
+    channel_id = _websub_channel_from_topic(topic)
+    if not challenge or not channel_id:
+        return web.Response(status=400)
+    watched = channel_id in youtube_subscribers_by_channel()
+    if mode == "subscribe" and watched:
+        lease = request.query.get("hub.lease_seconds")
+        if lease and lease.isdigit():
+            youtube_feed_state.setdefault(channel_id, {})["websub_expires"] = time.time() + int(lease)
+            save_youtube_feed_state()
+        return web.Response(text=challenge, content_type="text/plain")
+    if mode == "unsubscribe" and not watched:
+        return web.Response(text=challenge, content_type="text/plain")
+    return web.Response(status=404)
+
+async def handle_websub_notify(request):
+    """WebSub push (POST): Atom törzs feldolgozása a háttérben, a hub gyors 2xx választ kap."""
+    body = await request.read()
+    if not WEBSUB_ENABLED:
+        # titok nélkül az aláírás nem ellenőrizhető -> nem fogadunk el pusht
+        return web.Response(status=202)
+    signature = request.headers.get("X-Hub-Signature", "")
+    algo, _, digest = signature.partition("=")
+    if algo not in ("sha1", "sha256"):
+        print("[WebSub] Aláírás nélküli push eldobva.")
+        return web.Response(status=202)
+    expected = hmac.new(WEBSUB_SECRET.encode(), body, getattr(hashlib, algo)).hexdigest()
+    if not hmac.compare_digest(expected, digest):
+        # a spec szerint 2xx, de a tartalmat eldobjuk
+        print("[WebSub] Érvénytelen aláírás, push eldobva.")
+        return web.Response(status=202)
+
+    entries = parse_youtube_feed(body.decode("utf-8", errors="replace"))
+    by_channel = {}
+    for e in entries:
+        if e["channel_id"]:
+            by_channel.setdefault(e["channel_id"], []).append(e)
+    subs = youtube_subscribers_by_channel()
+    for channel_id, ch_entries in by_channel.items():
+        if channel_id in subs:
+            task = asyncio.create_task(ingest_youtube_entries(channel_id, ch_entries, subs[channel_id]))
+            _youtube_ingest_tasks.add(task)
+            task.add_done_callback(_youtube_ingest_done)
+    return web.Response(status=204)
+
 # ------------------------
 # Globális parancsellenőrzés (kivéve !dbactivate)
 # ------------------------
@@ -537,10 +2266,140 @@ async def guild_permission_check(ctx):
 @bot.event
 async def on_ready():
     print(f"✅ Bejelentkezett: {bot.user} (ID: {bot.user.id})")
+    # a guild cache most már elérhető -> rang nevek feloldása a reakció indexbe
+    rebuild_reaction_role_index()
+
+# ------------------------
+# AI válasz cache (!g / !gpt)
+# Kulcs: (provider, modell, normalizált prompt) – kis/nagybetű és whitespace nem számít.
+# - TTL + LRU, korlátos méret (AI_CACHE_MAX_ENTRIES bejegyzés / AI_CACHE_MAX_CHARS karakter)
+# - az egyidejű azonos promptok egyetlen upstream kérésen osztoznak (single-flight)
+# - hibaüzenet (⚠️) nem kerül a cache-be
+# - AI_CACHE_FILE megadása esetén a cache a JsonStore-on át lemezre is mentődik
+# - szerverenként kikapcsolható: !dbaicache ki
+# ------------------------
+AI_CACHE_TTL = float(os.getenv("AI_CACHE_TTL", "3600"))
+AI_CACHE_MAX_ENTRIES = int(os.getenv("AI_CACHE_MAX_ENTRIES", "500"))
+AI_CACHE_MAX_CHARS = int(os.getenv("AI_CACHE_MAX_CHARS", "2000000"))
+AI_MODELS = {"gemini": "gemini-1.5-flash", "openai": "gpt-4o-mini"}
+AI_INTERRUPTED = "⚠️ A válasz megszakadt"  # részleges (streamelt) válasz jelzése – ilyet nem cache-elünk
+
+def normalize_prompt(prompt: str):
+    return " ".join(prompt.split()).casefold()
+
+class AIResponseCache:
+    def __init__(self, ttl, max_entries, max_chars, path=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self.path = path
+        self._entries = OrderedDict()  # "provider\nmodel\nprompt" -> [lejárat (time.time()), válasz]
+        self._inflight = {}            # kulcs -> futó upstream task
+        self.chars = 0
+        self.hits = self.misses = self.coalesced = 0
+        if path:
+            self._load()
+
+    @staticmethod
+    def key(provider, model, prompt):
+        return f"{provider}\n{model}\n{normalize_prompt(prompt)}"
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return
+        now = time.time()
+        for key, (expires, text) in data.items():
+            if expires > now:
+                self._store(key, expires, text)
+
+    def _store(self, key, expires, text):
+        old = self._entries.pop(key, None)
+        if old:
+            self.chars -= len(old[1])
+        self._entries[key] = [expires, text]
+        self.chars += len(text)
+        while self._entries and (len(self._entries) > self.max_entries or self.chars > self.max_chars):
+            _, (_, dropped) = self._entries.popitem(last=False)
+            self.chars -= len(dropped)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.time():
+            del self._entries[key]
+            self.chars -= len(entry[1])
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key, text):
+        self._store(key, time.time() + self.ttl, text)
+        if self.path:
+            json_store.save(self.path, self._entries)
+
+    async def _fetch(self, key, fetch):
+        try:
+            text = await fetch()
+            if isinstance(text, str) and text.strip() and not text.startswith("⚠️") and AI_INTERRUPTED not in text:
+                self.put(key, text)
+            return text
+        finally:
+            self._inflight.pop(key, None)
+
+    async def get_or_fetch(self, provider, model, prompt, fetch, use_cache=True):
+        if not use_cache:
+            return await fetch()
+        key = self.key(provider, model, prompt)
+        text = self.get(key)
+        if text is not None:
+            self.hits += 1
+            return text
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = self._inflight[key] = asyncio.create_task(self._fetch(key, fetch))
+        else:
+            self.coalesced += 1
+        # shield: ha a kérő parancs megszakad, a többi várakozó még megkapja a választ
+        return await asyncio.shield(task)
+
+    def cached(self, provider, model, prompt):
+        """Van-e érvényes bejegyzés vagy futó kérés ehhez a prompthoz (számlálók nélkül)."""
+        key = self.key(provider, model, prompt)
+        entry = self._entries.get(key)
+        return key in self._inflight or (entry is not None and entry[0] > time.time())
+
+    def status(self):
+        return {
+            "entries": len(self._entries), "chars": self.chars, "inflight": len(self._inflight),
+            "hits": self.hits, "misses": self.misses, "coalesced": self.coalesced,
+        }
+
+def load_ai_cache_optout():
+    if not os.path.exists(AI_CACHE_OPTOUT_FILE):
+        return set()
+    with open(AI_CACHE_OPTOUT_FILE, "r", encoding="utf-8") as f:
+        try:
+            return set(int(gid) for gid in json.load(f))
+        except (json.JSONDecodeError, TypeError, ValueError):
+            return set()
+
+ai_cache = AIResponseCache(AI_CACHE_TTL, AI_CACHE_MAX_ENTRIES, AI_CACHE_MAX_CHARS, AI_CACHE_FILE)
+ai_cache_optout = load_ai_cache_optout()
+
+def ai_cache_enabled(guild_id):
+    return guild_id not in ai_cache_optout
 
 # ------------------------
 # AI: Gemini + OpenAI (AHOL CSAK A GEMINI RÉSZT MÓDOSÍTOTTUK)
 # ------------------------
+@instrumented("_gemini_generate")
 async def _gemini_generate(parts, model: str = "gemini-1.5-flash", system_instruction: str | None = None):
     """
     Stabilabb Gemini hívás a v1beta /generateContent végponttal.
@@ -563,84 +2422,524 @@ async def _gemini_generate(parts, model: str = "gemini-1.5-flash", system_instru
         payload["systemInstruction"] = {"role": "system", "parts": [{"text": system_instruction}]}
 
     try:
-        timeout = aiohttp.ClientTimeout(total=60)
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.post(url, headers=headers, json=payload) as resp:
-                data = await resp.json(content_type=None)
-                if resp.status != 200:
-                    # részletes hibaüzenet
-                    err_msg = None
-                    if isinstance(data, dict):
-                        err = data.get("error") or {}
-                        err_msg = err.get("message") or err.get("status")
-                    return f"⚠️ Gemini API hiba ({resp.status}): {err_msg or str(data)[:500]}"
-
-                # sikeres válasz feldolgozása
-                if isinstance(data, dict) and data.get("candidates"):
-                    cand = data["candidates"][0]
-                    # safety / block ellenőrzés
-                    if "finishReason" in cand and cand["finishReason"] == "SAFETY":
-                        return "⚠️ A választ biztonsági okból blokkolta a Gemini."
-                    parts_out = cand.get("content", {}).get("parts", [])
-                    texts = [p.get("text") for p in parts_out if isinstance(p, dict) and p.get("text")]
-                    if texts:
-                        return "\n".join(texts)
+        async with provider_request("gemini", "POST", url, headers=headers, json=payload, timeout=AI_TIMEOUT) as resp:
+            data = await resp.json(content_type=None)
+            if resp.status != 200:
+                # részletes hibaüzenet
+                err_msg = None
+                if isinstance(data, dict):
+                    err = data.get("error") or {}
+                    err_msg = err.get("message") or err.get("status")
+                return f"⚠️ Gemini API hiba ({resp.status}): {err_msg or str(data)[:500]}"
+
+            # sikeres válasz feldolgozása
+            if isinstance(data, dict) and data.get("candidates"):
+                cand = data["candidates"][0]
+                # safety / block ellenőrzés
+                if "finishReason" in cand and cand["finishReason"] == "SAFETY":
+                    return "⚠️ A választ biztonsági okból blokkolta a Gemini."
+                parts_out = cand.get("content", {}).get("parts", [])
+                texts = [p.get("text") for p in parts_out if isinstance(p, dict) and p.get("text")]
+                if texts:
+                    return "\n".join(texts)
+
+            # promptFeedback eset
+            if isinstance(data, dict) and data.get("promptFeedback"):
+                pf = data.get("promptFeedback")
+                return f"⚠️ A kérést elutasította a Gemini: {pf.get('blockReason', 'ismeretlen ok')}"
+
+            return f"⚠️ Váratlan Gemini válasz: {str(data)[:800]}"
+    except asyncio.TimeoutError:
+        return "⚠️ Gemini időtúllépés (timeout)."
+    except Exception as e:
+        return f"⚠️ Gemini hiba: {e}"
+
+async def gemini_text(prompt, guild_id=None, on_text=None, use_cache=True):
+    # azonos kérdésre a cache-ből / a már futó kérésből válaszolunk; on_text: streamelt részválaszok
+    model = AI_MODELS["gemini"]
+    if on_text and AI_STREAMING:
+        fetch = lambda: gemini_stream(prompt, model, on_text)
+    else:
+        fetch = lambda: _gemini_generate(parts=[{"text": prompt}], model=model)
+    return await ai_cache.get_or_fetch(
+        "gemini", model, prompt, fetch, use_cache=use_cache and ai_cache_enabled(guild_id)
+    )
+
+# ------------------------
+# OPENAI (változatlanul hagyva)
+# ------------------------
+async def gpt_text(prompt, guild_id=None, on_text=None, use_cache=True):
+    model = AI_MODELS["openai"]
+    if on_text and AI_STREAMING:
+        fetch = lambda: gpt_stream(prompt, model, on_text)
+    else:
+        fetch = lambda: _gpt_chat(prompt, model)
+    return await ai_cache.get_or_fetch(
+        "openai", model, prompt, fetch, use_cache=use_cache and ai_cache_enabled(guild_id)
+    )
+
+@instrumented("_gpt_chat")
+async def _gpt_chat(prompt, model):
+    if not OPENAI_API_KEY:
+        return "⚠️ Nincs OPENAI_API_KEY beállítva."
+    url = "https://api.openai.com/v1/chat/completions"
+    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {OPENAI_API_KEY}"}
+    data = {"model": model, "messages": [{"role": "user", "content": prompt}]}
+    try:
+        async with provider_request("openai", "POST", url, headers=headers, json=data, timeout=AI_TIMEOUT) as resp:
+            result = await resp.json()
+            try:
+                return result["choices"][0]["message"]["content"]
+            except:
+                return "⚠️ ChatGPT hiba történt."
+    except Exception as e:
+        return f"⚠️ OpenAI hiba: {e}"
+
+async def gpt_image(prompt):
+    """Visszaad: (kép bájtok, None) vagy (None, hibaüzenet).
+    A gpt-image-1 b64_json-t ad vissza; ha mégis URL jön, azt töltjük le."""
+    if not OPENAI_API_KEY:
+        return None, "⚠️ Nincs OPENAI_API_KEY beállítva."
+    url = "https://api.openai.com/v1/images/generations"
+    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {OPENAI_API_KEY}"}
+    data = {"model": "gpt-image-1", "prompt": prompt, "size": "1024x1024"}
+    try:
+        async with provider_request("openai", "POST", url, headers=headers, json=data, timeout=AI_IMAGE_TIMEOUT) as resp:
+            result = await resp.json(content_type=None)
+        item = (result.get("data") or [{}])[0] if isinstance(result, dict) else {}
+        if item.get("b64_json"):
+            return base64.b64decode(item["b64_json"]), None
+        if item.get("url"):
+            async with get_http_session().get(item["url"], timeout=AI_IMAGE_TIMEOUT) as img:
+                if img.status == 200:
+                    return await img.read(), None
+        err = result.get("error") if isinstance(result, dict) else None
+        if isinstance(err, dict) and err.get("message"):
+            return None, f"⚠️ OpenAI hiba: {err['message']}"
+        return None, "⚠️ ChatGPT kép generálási hiba."
+    except asyncio.TimeoutError:
+        return None, "⚠️ OpenAI időtúllépés (timeout)."
+    except Exception as e:
+        return None, f"⚠️ OpenAI hiba: {e}"
+
+# ------------------------
+# AI feladat sor (korlátos worker pool, igazságos ütemezés)
+# - egyszerre legfeljebb AI_WORKERS upstream AI hívás fut
+# - felhasználónként AI_PER_USER, szerverenként AI_PER_GUILD párhuzamos feladat
+# - a szerverek körbeforgó (round-robin) sorrendben kapnak workert, így egy pörgős szerver
+#   nem tudja kiéheztetni a többit
+# - azonnali visszajelzés a sorban elfoglalt helyről; elutasítás, ha a sor tele van,
+#   a felhasználónak már túl sok kérése vár, vagy a becsült várakozás AI_MAX_WAIT felett van
+# ------------------------
+AI_WORKERS = int(os.getenv("AI_WORKERS", "4"))
+AI_PER_USER = int(os.getenv("AI_PER_USER", "1"))
+AI_PER_GUILD = int(os.getenv("AI_PER_GUILD", "2"))
+AI_QUEUE_MAX = int(os.getenv("AI_QUEUE_MAX", "50"))
+AI_USER_PENDING_MAX = int(os.getenv("AI_USER_PENDING_MAX", "3"))  # felhasználónként ennyi futó + várakozó kérés
+AI_MAX_WAIT = float(os.getenv("AI_MAX_WAIT", "300"))
+
+class AIQueueRejected(Exception):
+    pass
+
+class AIJob:
+    __slots__ = ("guild_id", "user_id", "run", "future", "created")
+
+    def __init__(self, guild_id, user_id, run):
+        self.guild_id = guild_id
+        self.user_id = user_id
+        self.run = run
+        self.future = asyncio.get_running_loop().create_future()
+        self.created = time.monotonic()
+
+class AIJobQueue:
+    def __init__(self, workers, per_user, per_guild, max_queued):
+        self.workers = workers
+        self.per_user = per_user
+        self.per_guild = per_guild
+        self.max_queued = max_queued
+        self._queues = OrderedDict()  # guild_id -> deque[AIJob] (körbeforgó sorrend)
+        self._running_user = {}
+        self._running_guild = {}
+        self._pending_user = {}       # user_id -> futó + várakozó feladatok száma
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+        self.running = 0
+        self.stats = {"submitted": 0, "rejected": 0, "completed": 0, "failed": 0,
+                      "avg_run": 20.0, "avg_wait": 0.0, "last_wait": 0.0, "max_wait": 0.0}
+
+    @property
+    def depth(self):
+        return sum(len(q) for q in self._queues.values())
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def submit(self, guild_id, user_id, run):
+        """Sorba állítás; visszaad: (future, hely a sorban – 0 ha azonnal indul, becsült várakozás mp)."""
+        if self.depth >= self.max_queued:
+            self.stats["rejected"] += 1
+            raise AIQueueRejected("Az AI sor most tele van, próbáld újra kicsit később.")
+        if self._pending_user.get(user_id, 0) >= AI_USER_PENDING_MAX:
+            self.stats["rejected"] += 1
+            raise AIQueueRejected("Már van folyamatban lévő AI kérésed, várd meg a válaszokat.")
+        queue = self._queues.get(guild_id)
+        # felső becslés: az összes várakozó feladat (minden szerverről) elénk kerülhet
+        ahead = self.depth
+        idle = self.workers - self.running
+        blocked = (self._pending_user.get(user_id, 0) >= self.per_user
+                   or self._running_guild.get(guild_id, 0) + (len(queue) if queue else 0) >= self.per_guild)
+        position = 0 if ahead < idle and not blocked else max(1, ahead - idle + 1)
+        eta = -(-position // self.workers) * self.stats["avg_run"]  # felfelé kerekített körök
+        if eta > AI_MAX_WAIT:
+            self.stats["rejected"] += 1
+            raise AIQueueRejected(f"Túl hosszú a várakozás (~{int(eta)} mp), próbáld újra később.")
+        job = AIJob(guild_id, user_id, run)
+        self._queues.setdefault(guild_id, deque()).append(job)
+        self._pending_user[user_id] = self._pending_user.get(user_id, 0) + 1
+        self.stats["submitted"] += 1
+        self._wakeup.set()
+        return job.future, position, eta
+
+    def cancel(self, future):
+        """Várakozó feladat kivétele a sorból; visszaad: True, ha még nem indult el."""
+        for guild_id, queue in self._queues.items():
+            for job in queue:
+                if job.future is future:
+                    queue.remove(job)
+                    if not queue:
+                        del self._queues[guild_id]
+                    self._release_pending(job.user_id)
+                    future.cancel()
+                    self._wakeup.set()
+                    return True
+        return False
+
+    def _release_pending(self, user_id):
+        self._pending_user[user_id] -= 1
+        if not self._pending_user[user_id]:
+            del self._pending_user[user_id]
+
+    def _pick(self):
+        for _ in range(len(self._queues)):
+            guild_id = next(iter(self._queues))
+            self._queues.move_to_end(guild_id)
+            if self._running_guild.get(guild_id, 0) >= self.per_guild:
+                continue
+            queue = self._queues[guild_id]
+            for i, job in enumerate(queue):
+                if self._running_user.get(job.user_id, 0) < self.per_user:
+                    del queue[i]
+                    if not queue:
+                        del self._queues[guild_id]
+                    return job
+        return None
+
+    async def _worker(self):
+        while True:
+            job = self._pick()
+            if job is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            if job.future.cancelled():
+                # a kérő közben feladta (megszakított parancs): nem indítjuk el
+                self._release_pending(job.user_id)
+                continue
+            self.running += 1
+            self._running_user[job.user_id] = self._running_user.get(job.user_id, 0) + 1
+            self._running_guild[job.guild_id] = self._running_guild.get(job.guild_id, 0) + 1
+            started = time.monotonic()
+            wait = started - job.created
+            self.stats["last_wait"] = round(wait, 2)
+            self.stats["max_wait"] = round(max(self.stats["max_wait"], wait), 2)
+            self.stats["avg_wait"] = round(0.8 * self.stats["avg_wait"] + 0.2 * wait, 2)
+            metrics.observe("darky_ai_queue_wait_seconds", wait)
+            try:
+                result = await job.run()
+                if not job.future.done():
+                    job.future.set_result(result)
+                self.stats["completed"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                if not job.future.done():
+                    job.future.set_exception(e)
+            finally:
+                self.stats["avg_run"] = round(0.8 * self.stats["avg_run"] + 0.2 * (time.monotonic() - started), 2)
+                self.running -= 1
+                for counter, key in ((self._running_user, job.user_id), (self._running_guild, job.guild_id)):
+                    counter[key] -= 1
+                    if not counter[key]:
+                        del counter[key]
+                self._release_pending(job.user_id)
+                self._wakeup.set()
+
+    def status(self):
+        return {
+            "depth": self.depth, "running": self.running, "workers": self.workers,
+            "guilds": {str(gid): len(q) for gid, q in self._queues.items()}, **self.stats,
+        }
+
+ai_jobs = AIJobQueue(AI_WORKERS, AI_PER_USER, AI_PER_GUILD, AI_QUEUE_MAX)
+
+async def queue_ai_job(ctx, placeholder, run):
+    """AI feladat sorba állítása a placeholder üzenettel; visszaad: run() eredménye, vagy None elutasításkor."""
+    try:
+        future, position, eta = ai_jobs.submit(ctx.guild.id, ctx.author.id, run)
+    except AIQueueRejected as e:
+        await placeholder.edit(content=f"❌ {e}")
+        return None
+    if position:
+        await placeholder.edit(content=f"🕒 Sorban állsz: {position}. hely (becsült várakozás ~{int(eta)} mp)")
+    return await future
 
-                # promptFeedback eset
-                if isinstance(data, dict) and data.get("promptFeedback"):
-                    pf = data.get("promptFeedback")
-                    return f"⚠️ A kérést elutasította a Gemini: {pf.get('blockReason', 'ismeretlen ok')}"
+# ------------------------
+# Háttér képgenerálás (!gptpic)
+# A parancs azonnal visszatér egy job ID-val; a kép az AI soron át készül, és memóriából
+# (BytesIO, ideiglenes fájl nélkül) csatolmányként megy ki a kérő csatornába.
+# Szerverenként legfeljebb IMAGE_JOBS_PER_GUILD aktív job; !gptpiccancel <id> megszakítja.
+# ------------------------
+IMAGE_JOBS_PER_GUILD = int(os.getenv("IMAGE_JOBS_PER_GUILD", "2"))
 
-                return f"⚠️ Váratlan Gemini válasz: {str(data)[:800]}"
-    except asyncio.TimeoutError:
-        return "⚠️ Gemini időtúllépés (timeout)."
-    except Exception as e:
-        return f"⚠️ Gemini hiba: {e}"
+image_jobs = {}  # job_id -> {"guild_id", "channel_id", "user_id", "prompt", "created", "task", "future", "inner", "cancelled"}
+_image_job_seq = 0
 
-async def gemini_text(prompt):
-    # csak a belső hívás logikája változott
-    return await _gemini_generate(parts=[{"text": prompt}], model="gemini-1.5-flash")
+async def run_image_job(job_id, channel, author, prompt):
+    job = image_jobs[job_id]
 
-async def gemini_image(prompt):
-    # jelen implementáció szöveges választ ad vissza (leírás), képgenerálás helyett
-    return await _gemini_generate(parts=[{"text": prompt}], model="gemini-1.5-flash")
+    async def generate():
+        if job["cancelled"]:
+            return None, None
+        # külön taskban fut, hogy megszakításkor a worker ne szakadjon meg
+        job["inner"] = asyncio.create_task(gpt_image(prompt))
+        try:
+            return await job["inner"]
+        except asyncio.CancelledError:
+            if job["inner"].cancelled() and job["cancelled"]:
+                return None, None
+            raise
+
+    try:
+        try:
+            future, position, eta = ai_jobs.submit(job["guild_id"], author.id, generate)
+        except AIQueueRejected as e:
+            await channel.send(f"❌ #{job_id}: {e}")
+            return
+        job["future"] = future
+        if position:
+            await channel.send(f"🕒 #{job_id} sorban: {position}. hely (becsült várakozás ~{int(eta)} mp)")
+        data, err = await future
+        if job["cancelled"]:
+            return
+        if err:
+            await channel.send(f"{err} (#{job_id})")
+            return
+        file = discord.File(io.BytesIO(data), filename=f"gptpic_{job_id}.png")
+        await channel.send(content=f"🖼️ {author.mention} #{job_id}: {prompt[:150]}", file=file)
+    except Exception as e:
+        print(f"⚠️ Képgenerálás hiba (#{job_id}): {e}")
+        try:
+            await channel.send(f"⚠️ #{job_id}: a kép elkészítése nem sikerült.")
+        except discord.HTTPException:
+            pass
+    finally:
+        image_jobs.pop(job_id, None)
+
+def start_image_job(ctx, prompt):
+    """Új háttér job; visszaad: job ID, vagy None, ha a szerver elérte a limitet."""
+    global _image_job_seq
+    active = sum(1 for job in image_jobs.values() if job["guild_id"] == ctx.guild.id)
+    if active >= IMAGE_JOBS_PER_GUILD:
+        return None
+    _image_job_seq += 1
+    job_id = _image_job_seq
+    image_jobs[job_id] = {
+        "guild_id": ctx.guild.id, "channel_id": ctx.channel.id, "user_id": ctx.author.id,
+        "prompt": prompt, "created": time.time(), "task": None, "future": None, "inner": None, "cancelled": False,
+    }
+    image_jobs[job_id]["task"] = asyncio.create_task(run_image_job(job_id, ctx.channel, ctx.author, prompt))
+    return job_id
+
+def cancel_image_job(job_id):
+    # a szerver keretét és a várakozó AI sorhelyet azonnal felszabadítjuk
+    job = image_jobs.pop(job_id, None)
+    if job is None:
+        return False
+    job["cancelled"] = True
+    if job["future"] is not None:
+        ai_jobs.cancel(job["future"])
+    if job["inner"] is not None:
+        job["inner"].cancel()
+    job["task"].cancel()
+    return True
 
 # ------------------------
-# OPENAI (változatlanul hagyva)
+# Streamelt AI válaszok (Gemini streamGenerateContent SSE, OpenAI stream=true)
+# A "⏳ Válasz készül..." üzenet AI_STREAM_EDIT_INTERVAL ütemben frissül az eddigi szöveggel;
+# a 2000 karakteres Discord limitnél a válasz új üzenetben folytatódik.
+# AI_STREAMING=0 esetén a teljes választ várjuk meg (de a hosszú válasz akkor is darabolva megy ki).
 # ------------------------
-async def gpt_text(prompt):
-    if not OPENAI_API_KEY:
-        return "⚠️ Nincs OPENAI_API_KEY beállítva."
-    url = "https://api.openai.com/v1/chat/completions"
-    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {OPENAI_API_KEY}"}
-    data = {"model": "gpt-4o-mini", "messages": [{"role": "user", "content": prompt}]}
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=headers, json=data, timeout=30) as resp:
-                result = await resp.json()
+AI_STREAMING = os.getenv("AI_STREAMING", "1") == "1"
+AI_STREAM_EDIT_INTERVAL = float(os.getenv("AI_STREAM_EDIT_INTERVAL", "1.5"))  # Discord: ~5 szerkesztés / 5 mp / csatorna
+DISCORD_MESSAGE_LIMIT = 1990
+
+def split_message(text, limit=DISCORD_MESSAGE_LIMIT):
+    """Darabolás a limit alatt, lehetőleg sortörésnél / szóköznél (a korábbi darabok a szöveg
+    bővülésével sem változnak, így streamelés közben csak az utolsó üzenetet kell szerkeszteni)."""
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut < limit // 2:
+            cut = text.rfind(" ", 0, limit)
+        if cut < limit // 2:
+            cut = limit
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip("\n ")
+    chunks.append(text)
+    return chunks
+
+class StreamingReply:
+    def __init__(self, channel, placeholder):
+        self.channel = channel
+        self.messages = [placeholder]
+        self.contents = [placeholder.content]
+        self._last_edit = 0.0
+        self._lock = asyncio.Lock()
+
+    async def update(self, text):
+        # ritkítva szerkesztünk; ha az előző szerkesztés még fut, ezt a darabot kihagyjuk
+        if self._lock.locked() or time.monotonic() - self._last_edit < AI_STREAM_EDIT_INTERVAL:
+            return
+        await self._render(text, cursor=True)
+
+    async def finish(self, text):
+        await self._render(text or "⚠️ Üres válasz.")
+
+    async def set_status(self, text):
+        await self._render(text)
+
+    async def _render(self, text, cursor=False):
+        async with self._lock:
+            self._last_edit = time.monotonic()
+            chunks = split_message(text)
+            if cursor:
+                chunks[-1] += " ▌"
+            for i, chunk in enumerate(chunks):
+                chunk = chunk or "…"
                 try:
-                    return result["choices"][0]["message"]["content"]
-                except:
-                    return "⚠️ ChatGPT hiba történt."
+                    if i < len(self.messages):
+                        if self.contents[i] != chunk:
+                            await self.messages[i].edit(content=chunk)
+                            self.contents[i] = chunk
+                    else:
+                        self.messages.append(await self.channel.send(chunk))
+                        self.contents.append(chunk)
+                except discord.HTTPException as e:
+                    print(f"⚠️ AI válasz üzenet frissítési hiba: {e}")
+                    return
+
+async def _sse_events(resp):
+    """Server-Sent Events "data:" sorai JSON-ként."""
+    async for raw in resp.content:
+        line = raw.decode("utf-8", "replace").strip()
+        if not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if data == "[DONE]":
+            return
+        try:
+            yield json.loads(data)
+        except json.JSONDecodeError:
+            continue
+
+async def _stream_error_message(resp, provider):
+    body = await resp.text()
+    err_msg = body[:500]
+    try:
+        data = json.loads(body)
+        err = data.get("error") if isinstance(data, dict) else None
+        if isinstance(err, dict):
+            err_msg = err.get("message") or err.get("status") or err_msg
+    except json.JSONDecodeError:
+        pass
+    return f"⚠️ {provider} API hiba ({resp.status}): {err_msg}"
+
+@instrumented("gemini_stream")
+async def gemini_stream(prompt, model, on_text):
+    """Gemini válasz SSE-n; on_text(eddigi szöveg) minden darab után. Visszaad: a teljes válasz."""
+    if not GEMINI_API_KEY:
+        return "⚠️ Nincs GEMINI_API_KEY beállítva."
+    url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:streamGenerateContent?alt=sse&key={GEMINI_API_KEY}"
+    payload = {"contents": [{"role": "user", "parts": [{"text": prompt}]}]}
+    text = ""
+    try:
+        async with provider_request("gemini", "POST", url, headers={"Content-Type": "application/json"},
+                                    json=payload, timeout=AI_STREAM_TIMEOUT) as resp:
+            if resp.status != 200:
+                return await _stream_error_message(resp, "Gemini")
+            async for event in _sse_events(resp):
+                pf = event.get("promptFeedback") or {}
+                if pf.get("blockReason"):
+                    return f"⚠️ A kérést elutasította a Gemini: {pf['blockReason']}"
+                for cand in event.get("candidates") or []:
+                    if cand.get("finishReason") == "SAFETY" and not text:
+                        return "⚠️ A választ biztonsági okból blokkolta a Gemini."
+                    for part in cand.get("content", {}).get("parts", []):
+                        if isinstance(part, dict) and part.get("text"):
+                            text += part["text"]
+                if text:
+                    await on_text(text)
+    except asyncio.TimeoutError:
+        return f"{text}\n\n{AI_INTERRUPTED} (timeout)." if text else "⚠️ Gemini időtúllépés (timeout)."
     except Exception as e:
-        return f"⚠️ OpenAI hiba: {e}"
+        return f"{text}\n\n{AI_INTERRUPTED}: {e}" if text else f"⚠️ Gemini hiba: {e}"
+    return text or "⚠️ Üres Gemini válasz."
 
-async def gpt_image(prompt):
+@instrumented("gpt_stream")
+async def gpt_stream(prompt, model, on_text):
+    """OpenAI chat completion stream=true módban; on_text(eddigi szöveg) minden darab után."""
     if not OPENAI_API_KEY:
         return "⚠️ Nincs OPENAI_API_KEY beállítva."
-    url = "https://api.openai.com/v1/images/generations"
+    url = "https://api.openai.com/v1/chat/completions"
     headers = {"Content-Type": "application/json", "Authorization": f"Bearer {OPENAI_API_KEY}"}
-    data = {"model": "gpt-image-1", "prompt": prompt, "size": "1024x1024"}
+    data = {"model": model, "messages": [{"role": "user", "content": prompt}], "stream": True}
+    text = ""
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=headers, json=data, timeout=30) as resp:
-                result = await resp.json()
-                try:
-                    return result["data"][0]["url"]
-                except:
-                    return "⚠️ ChatGPT kép generálási hiba."
+        async with provider_request("openai", "POST", url, headers=headers, json=data, timeout=AI_STREAM_TIMEOUT) as resp:
+            if resp.status != 200:
+                return await _stream_error_message(resp, "OpenAI")
+            async for event in _sse_events(resp):
+                for choice in event.get("choices") or []:
+                    delta = (choice.get("delta") or {}).get("content")
+                    if delta:
+                        text += delta
+                if text:
+                    await on_text(text)
+    except asyncio.TimeoutError:
+        return f"{text}\n\n{AI_INTERRUPTED} (timeout)." if text else "⚠️ OpenAI időtúllépés (timeout)."
     except Exception as e:
-        return f"⚠️ OpenAI hiba: {e}"
+        return f"{text}\n\n{AI_INTERRUPTED}: {e}" if text else f"⚠️ OpenAI hiba: {e}"
+    return text or "⚠️ ChatGPT hiba történt."
+
+async def ai_reply(ctx, provider, prompt, use_cache=True, placeholder_text="⏳ Válasz készül..."):
+    """AI parancs válasza: placeholder üzenet, streamelt frissítés, darabolt végleges szöveg."""
+    placeholder = await ctx.send(placeholder_text)
+    reply = StreamingReply(ctx.channel, placeholder)
+    ask = gemini_text if provider == "gemini" else gpt_text
+    use_cache = use_cache and ai_cache_enabled(ctx.guild.id)
+    if use_cache and ai_cache.cached(provider, AI_MODELS[provider], prompt):
+        # cache találat / már futó azonos kérés: nem foglal helyet az AI sorban
+        text = await ask(prompt, ctx.guild.id, reply.update)
+    else:
+        async def run():
+            if reply.contents[0] != placeholder_text:
+                await reply.set_status(placeholder_text)  # sorban állás után: indul a válasz
+            return await ask(prompt, ctx.guild.id, reply.update, use_cache=use_cache)
+
+        text = await queue_ai_job(ctx, placeholder, run)
+        if text is None:
+            return
+    await reply.finish(text)
 
 # ------------------------
 # AI parancsok (változatlan interfésszel)
@@ -656,9 +2955,7 @@ async def gpt_image(prompt):
 async def g(ctx, *, prompt: str):
     if ctx.guild.id not in allowed_guilds:
         return await ctx.send("❌ Ez a parancs csak engedélyezett szervereken érhető el.")
-    await ctx.send("⏳ Válasz készül...")
-    response = await gemini_text(prompt)
-    await ctx.send(response)
+    await ai_reply(ctx, "gemini", prompt)
 
 @bot.command()
 @admin_or_roles_or_users(
@@ -668,9 +2965,8 @@ async def g(ctx, *, prompt: str):
 async def gpic(ctx, *, prompt: str):
     if ctx.guild.id not in allowed_guilds:
         return await ctx.send("❌ Ez a parancs csak engedélyezett szervereken érhető el.")
-    await ctx.send("⏳ Kép készül...")
-    response = await gemini_image(prompt)
-    await ctx.send(response)
+    # a Gemini itt is szöveges leírást ad (nem képet) – a hosszú válasz miatt ez is streamelve megy
+    await ai_reply(ctx, "gemini", prompt, use_cache=False, placeholder_text="⏳ Kép készül...")
 
 @bot.command()
 @admin_or_roles_or_users(
@@ -680,9 +2976,7 @@ async def gpic(ctx, *, prompt: str):
 async def gpt(ctx, *, prompt: str):
     if ctx.guild.id not in allowed_guilds:
         return await ctx.send("❌ Ez a parancs csak engedélyezett szervereken érhető el.")
-    await ctx.send("⏳ Válasz készül...")
-    response = await gpt_text(prompt)
-    await ctx.send(response)
+    await ai_reply(ctx, "openai", prompt)
 
 @bot.command()
 @admin_or_roles_or_users(
@@ -692,9 +2986,42 @@ async def gpt(ctx, *, prompt: str):
 async def gptpic(ctx, *, prompt: str):
     if ctx.guild.id not in allowed_guilds:
         return await ctx.send("❌ Ez a parancs csak engedélyezett szervereken érhető el.")
-    await ctx.send("⏳ Kép készül...")
-    image_url = await gpt_image(prompt)
-    await ctx.send(image_url)
+    job_id = start_image_job(ctx, prompt)
+    if job_id is None:
+        return await ctx.send(f"❌ Ezen a szerveren már {IMAGE_JOBS_PER_GUILD} kép készül, várd meg, amíg elkészülnek.")
+    await ctx.send(f"⏳ Kép készül a háttérben (#{job_id}). Megszakítás: `!gptpiccancel {job_id}`")
+
+@bot.command()
+@admin_or_roles_or_users(
+    roles=["LightSector GPT", "LightSector II"],
+    user_ids=[111111111111111111, 222222222222222222, 419451608485593089, 815969322346348606, 647857851498233906]
+)
+async def gptpiccancel(ctx, job_id: int):
+    job = image_jobs.get(job_id)
+    if job is None or job["guild_id"] != ctx.guild.id:
+        return await ctx.send("⚠️ Nincs ilyen futó képgenerálás ezen a szerveren.")
+    if job["user_id"] != ctx.author.id and not ctx.author.guild_permissions.administrator:
+        return await ctx.send("❌ Csak a saját (vagy adminként bármely) képgenerálásodat szakíthatod meg.")
+    cancel_image_job(job_id)
+    await ctx.send(f"🛑 Képgenerálás megszakítva (#{job_id}).")
+
+@bot.command(name="dbaicache")
+@admin_or_roles_or_users()
+async def dbaicache(ctx, mode: str = None):
+    """!dbaicache [be|ki] – AI válasz cache ki/bekapcsolása ezen a szerveren; paraméter nélkül statisztika."""
+    if mode in ("be", "ki"):
+        if mode == "ki":
+            ai_cache_optout.add(ctx.guild.id)
+        else:
+            ai_cache_optout.discard(ctx.guild.id)
+        json_store.save(AI_CACHE_OPTOUT_FILE, sorted(ai_cache_optout))
+    st = ai_cache.status()
+    state = "✅ bekapcsolva" if ai_cache_enabled(ctx.guild.id) else "❌ kikapcsolva"
+    await ctx.send(
+        f"🧠 AI cache ezen a szerveren: {state}\n"
+        f"Találat: {st['hits']} | Hiány: {st['misses']} | Összevont: {st['coalesced']} | "
+        f"Bejegyzés: {st['entries']} ({st['chars']} karakter)"
+    )
 
 # ------------------------
 # dbtwitch parancsok: add/remove/list (módosítják a twitch_streams.json fájlt)
@@ -710,31 +3037,13 @@ async def dbtwitchadd(ctx, channel_id: int, username: str):
     username = username.lower().strip().lstrip('@').split('/')[-1]
     guild_id = ctx.guild.id if ctx.guild else None
 
-    arr = load_twitch_streamers()
-    # ellenőrizzük, hogy nincs-e már ugyanabban a guildben
-    for item in arr:
-        if item.get("username", "").lower() == username and item.get("guild_id") is not None:
-            try:
-                item_gid = int(item.get("guild_id")) if isinstance(item.get("guild_id"), (int, str)) and str(item.get("guild_id")).isdigit() else None
-            except Exception:
-                item_gid = None
-            if item_gid == guild_id:
-                item["channel_id"] = channel_id  # frissítjük a csatorna ID-t
-                save_twitch_streamers(arr)
-                # frissítsük runtime állapot is
-                if guild_id not in twitch_streams:
-                    twitch_streams[guild_id] = {}
-                twitch_streams[guild_id][username] = {"channel_id": channel_id, "live": False}
-                await ctx.send(f"🔧 Frissítve: **{username}** → <#{channel_id}>")
-                return
-    # nincs ilyen bejegyzés ugyanabban a guildben -> hozzáadjuk újként
-    new_item = {"username": username, "channel_id": channel_id, "guild_id": guild_id}
-    arr.append(new_item)
-    save_twitch_streamers(arr)
-    if guild_id not in twitch_streams:
-        twitch_streams[guild_id] = {}
-    twitch_streams[guild_id][username] = {"channel_id": channel_id, "live": False}
-    await ctx.send(f"✅ Twitch figyelés hozzáadva: **{username}** → <#{channel_id}> (szerver: {guild_id})")
+    # ha már van ilyen bejegyzés ugyanabban a guildben, csak a csatorna ID frissül
+    updated = set_subscription("twitch", twitch_streams, guild_id, username, {"channel_id": channel_id, "live": False})
+    save_twitch_streamers(subscriptions_to_list("twitch", twitch_streams))
+    if updated:
+        await ctx.send(f"🔧 Frissítve: **{username}** → <#{channel_id}>")
+    else:
+        await ctx.send(f"✅ Twitch figyelés hozzáadva: **{username}** → <#{channel_id}> (szerver: {guild_id})")
 
 @bot.command(name="dbtwitchremove")
 @admin_or_roles_or_users(
@@ -744,38 +3053,11 @@ async def dbtwitchadd(ctx, channel_id: int, username: str):
 async def dbtwitchremove(ctx, username: str):
     username = username.lower().strip().lstrip('@').split('/')[-1]
     guild_id = ctx.guild.id if ctx.guild else None
-    arr = load_twitch_streamers()
-    new_arr = []
-    removed = False
-    for item in arr:
-        try:
-            item_un = item.get("username", "").lower()
-            item_gid_raw = item.get("guild_id")
-            item_gid = None
-            if item_gid_raw is not None:
-                if isinstance(item_gid_raw, str) and item_gid_raw.isdigit():
-                    item_gid = int(item_gid_raw)
-                elif isinstance(item_gid_raw, int):
-                    item_gid = item_gid_raw
-            # csak akkor töröljük, ha username és guild_id egyezik
-            if item_un == username and item_gid == guild_id:
-                removed = True
-                continue
-            new_arr.append(item)
-        except Exception:
-            new_arr.append(item)
-    if not removed:
+    # csak akkor töröljük, ha username és guild_id egyezik
+    if not remove_subscription("twitch", twitch_streams, guild_id, username):
         await ctx.send("⚠️ Nincs ilyen figyelt streamer ebben a szerveren.")
         return
-    save_twitch_streamers(new_arr)
-    # runtime állapot frissítése
-    try:
-        if guild_id in twitch_streams and username in twitch_streams[guild_id]:
-            del twitch_streams[guild_id][username]
-            if not twitch_streams[guild_id]:
-                del twitch_streams[guild_id]
-    except Exception:
-        pass
+    save_twitch_streamers(subscriptions_to_list("twitch", twitch_streams))
     await ctx.send(f"❌ Twitch figyelés törölve: **{username}** (szerver: {guild_id})")
 
 @bot.command(name="dbtwitchlist")
@@ -783,43 +3065,18 @@ async def dbtwitchremove(ctx, username: str):
     roles=["LightSector TWITCH", "LightSector II"],
     user_ids=[111111111111111111, 222222222222222222, 419451608485593089, 815969322346348606, 647857851498233906]
 )
-async def dbtwitchlist(ctx):
+async def dbtwitchlist(ctx, page: int = 1):
     """
-    Most szerverenként listázza a twitch párosításokat.
-    A twitch_streams.json-be te magad adhatod meg a 'guild_id' mezőt (int vagy string),
-    ekkor csak az aktuális szerver bejegyzései jelennek meg.
+    Szerverenként listázza a twitch párosításokat (a memóriabeli állapotból, oldalakra bontva).
+    A twitch_streams.json-ben guild_id nélküli bejegyzések egyik szerveren sem jelennek meg.
     """
-    arr = load_twitch_streamers()
-    # szűrés: csak olyan bejegyzések, amelyek tartalmazzák a guild_id-t és az megegyezik az aktuális szerverrel
-    guild_entries = []
-    for item in arr:
-        gid = item.get("guild_id")
-        if gid is None:
-            # ha nincs guild_id, kihagyjuk (te írod majd be kézzel a fájlba a guild_id mezőt)
-            continue
-        try:
-            # támogassuk stringként tárolt ID-t is
-            if isinstance(gid, str) and gid.isdigit():
-                gid_val = int(gid)
-            elif isinstance(gid, int):
-                gid_val = gid
-            else:
-                continue
-            if gid_val == ctx.guild.id:
-                guild_entries.append(item)
-        except Exception:
-            continue
-
+    guild_entries = twitch_streams.get(ctx.guild.id, {})
     if not guild_entries:
         await ctx.send("ℹ️ Jelenleg nincs figyelt Twitch csatorna ehhez a szerverhez.")
         return
 
-    msg = "**Figyelt Twitch csatornák (szerverre szűrve):**\n"
-    for item in guild_entries:
-        uname = item.get("username") or item.get("twitch_username") or "Ismeretlen"
-        cid = item.get("channel_id")
-        msg += f"🎮 **{uname}** → <#{cid}>\n"
-    await ctx.send(msg)
+    lines = [f"🎮 **{uname}** → <#{info['channel_id']}>" for uname, info in guild_entries.items()]
+    await send_paginated(ctx, "**Figyelt Twitch csatornák (szerverre szűrve):**\n", lines, page, "dbtwitchlist")
 
 # ------------------------
 # Egyszerű dbtwitch parancs (!dbtwitch <user>) – több rang + user ID
@@ -843,18 +3100,17 @@ async def dbtwitch_cmd(ctx, username: str = None):
     await ctx.send(f"```Sziasztok! {uname} kicsapta a streamet! Gyertek lurkolni!```")
 
     # Twitch API lekérés az élő adatokhoz
-    twitch_api_url = f"https://api.twitch.tv/helix/streams?user_login={uname}"
+    twitch_api_url = f"{TWITCH_API_BASE}/streams?user_login={uname}"
     headers = {
         "Client-ID": os.getenv("TWITCH_CLIENT_ID"),
         "Authorization": f"Bearer {os.getenv('TWITCH_ACCESS_TOKEN')}"
     }
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(twitch_api_url, headers=headers) as resp:
-            try:
-                data = await resp.json()
-            except Exception:
-                data = {}
+    async with provider_request("twitch", "GET", twitch_api_url, headers=headers, timeout=HTTP_TIMEOUT, background=False) as resp:
+        try:
+            data = await resp.json()
+        except Exception:
+            data = {}
 
     # 2️⃣ Embed panel
     embed = discord.Embed(
@@ -865,6 +3121,8 @@ async def dbtwitch_cmd(ctx, username: str = None):
 
     if data.get("data"):
         stream = data["data"][0]
+        # ha a watcher még nem tud róla, soron kívül ellenőrizze
+        poll_scheduler.suspect("twitch", uname.lower())
         title = stream.get("title", "Nincs cím")
         game = stream.get("game_name", "Ismeretlen játék")
         viewers = stream.get("viewer_count", 0)
@@ -893,39 +3151,20 @@ async def dbtwitch_cmd(ctx, username: str = None):
 )
 async def dbyoutubeadd(ctx, channel_id: int, username: str):
     """!dbyoutubeadd <dc_szoba_id> <youtube_user>"""
-    username_n = username.strip().lstrip('@').split('/')[-1].lower()
+    username_n = normalize_youtube_username(username)
     guild_id = ctx.guild.id if ctx.guild else None
 
-    arr = load_youtube_channels()
-    for item in arr:
-        item_user = (item.get("username") or "").lower()
-        item_gid = item.get("guild_id")
-        try:
-            if isinstance(item_gid, str) and item_gid.isdigit():
-                item_gid_val = int(item_gid)
-            elif isinstance(item_gid, int):
-                item_gid_val = item_gid
-            else:
-                item_gid_val = None
-        except Exception:
-            item_gid_val = None
-
-        if item_user == username_n and item_gid_val == guild_id:
-            item["channel_id"] = channel_id
-            save_youtube_channels(arr)
-            if guild_id not in youtube_channels:
-                youtube_channels[guild_id] = {}
-            youtube_channels[guild_id][username_n] = {"channel_id": channel_id}
-            await ctx.send(f"🔧 Frissítve: **{username_n}** → <#{channel_id}>")
-            return
+    # csatorna ID feloldása most, hogy a watchernek már ne kelljen
+    yt_channel_id = await resolve_youtube_channel_id(username, force=True, background=False)
+    if YOUTUBE_API_KEY and not yt_channel_id:
+        await ctx.send(f"⚠️ Nem sikerült feloldani a YouTube csatornát: **{username_n}** (a figyelés ettől még mentésre kerül)")
 
-    new_item = {"username": username_n, "channel_id": channel_id, "guild_id": guild_id}
-    arr.append(new_item)
-    save_youtube_channels(arr)
-    if guild_id not in youtube_channels:
-        youtube_channels[guild_id] = {}
-    youtube_channels[guild_id][username_n] = {"channel_id": channel_id}
-    await ctx.send(f"✅ YouTube figyelés hozzáadva: **{username_n}** → <#{channel_id}> (szerver: {guild_id})")
+    updated = set_subscription("youtube", youtube_channels, guild_id, username_n, {"channel_id": channel_id})
+    save_youtube_channels(subscriptions_to_list("youtube", youtube_channels))
+    if updated:
+        await ctx.send(f"🔧 Frissítve: **{username_n}** → <#{channel_id}>")
+    else:
+        await ctx.send(f"✅ YouTube figyelés hozzáadva: **{username_n}** → <#{channel_id}> (szerver: {guild_id})")
 
 @bot.command(name="dbyoutuberemove")
 @admin_or_roles_or_users(
@@ -936,37 +3175,11 @@ async def dbyoutuberemove(ctx, username: str):
     username_n = username.strip().lstrip('@').split('/')[-1].lower()
     guild_id = ctx.guild.id if ctx.guild else None
 
-    arr = load_youtube_channels()
-    new_arr = []
-    removed = False
-    for item in arr:
-        item_user = (item.get("username") or "").lower()
-        item_gid_raw = item.get("guild_id")
-        if isinstance(item_gid_raw, str) and item_gid_raw.isdigit():
-            item_gid = int(item_gid_raw)
-        elif isinstance(item_gid_raw, int):
-            item_gid = item_gid_raw
-        else:
-            item_gid = None
-
-        if item_user == username_n and item_gid == guild_id:
-            removed = True
-            continue
-        new_arr.append(item)
-
-    if not removed:
+    if not remove_subscription("youtube", youtube_channels, guild_id, username_n):
         await ctx.send("⚠️ Nincs ilyen figyelt YouTube csatorna ebben a szerverben.")
         return
 
-    save_youtube_channels(new_arr)
-    try:
-        if guild_id in youtube_channels and username_n in youtube_channels[guild_id]:
-            del youtube_channels[guild_id][username_n]
-            if not youtube_channels[guild_id]:
-                del youtube_channels[guild_id]
-    except Exception:
-        pass
-
+    save_youtube_channels(subscriptions_to_list("youtube", youtube_channels))
     await ctx.send(f"❌ YouTube figyelés törölve: **{username_n}** (szerver: {guild_id})")
 
 @bot.command(name="dbyoutubelist")
@@ -974,33 +3187,14 @@ async def dbyoutuberemove(ctx, username: str):
     roles=["LightSector YT", "LightSector YT II"],
     user_ids=[111111111111111111, 222222222222222222, 419451608485593089, 815969322346348606, 647857851498233906]
 )
-async def dbyoutubelist(ctx):
-    arr = load_youtube_channels()
-    guild_entries = []
-    for item in arr:
-        gid = item.get("guild_id")
-        try:
-            if isinstance(gid, str) and gid.isdigit():
-                gid_val = int(gid)
-            elif isinstance(gid, int):
-                gid_val = gid
-            else:
-                continue
-            if gid_val == ctx.guild.id:
-                guild_entries.append(item)
-        except Exception:
-            continue
-
+async def dbyoutubelist(ctx, page: int = 1):
+    guild_entries = youtube_channels.get(ctx.guild.id, {})
     if not guild_entries:
         await ctx.send("ℹ️ Nincs figyelt YouTube csatorna ezen a szerveren.")
         return
 
-    msg = "**Figyelt YouTube csatornák (szerverre szűrve):**\n"
-    for item in guild_entries:
-        uname = item.get("username") or "Ismeretlen"
-        cid = item.get("channel_id")
-        msg += f"▶️ **{uname}** → <#{cid}>\n"
-    await ctx.send(msg)
+    lines = [f"▶️ **{uname}** → <#{info['channel_id']}>" for uname, info in guild_entries.items()]
+    await send_paginated(ctx, "**Figyelt YouTube csatornák (szerverre szűrve):**\n", lines, page, "dbyoutubelist")
 
 @bot.command(name="dbyoutube")
 @admin_or_roles_or_users(
@@ -1015,7 +3209,7 @@ async def dbyoutube(ctx, username: str):
 
     await ctx.send(f"```YouTube lekérdezés folyamatban: {uname}```")
 
-    live, title, url = await is_youtube_live_or_latest(uname)
+    live, title, url = await is_youtube_live_or_latest(uname, background=False)
 
     embed = discord.Embed(
         title=f"{uname} YouTube csatornája",
@@ -1025,6 +3219,8 @@ async def dbyoutube(ctx, username: str):
 
     if live:
         embed.description = f"🔴 **ÉLŐ**: {title}\n{url}"
+        # ha a watcher még nem tud róla, soron kívül ellenőrizze
+        poll_scheduler.suspect("youtube", normalize_youtube_username(uname))
     elif title and url:
         embed.description = f"🆕 Legutóbbi videó: {title}\n{url}"
     else:
@@ -1050,6 +3246,7 @@ async def addreaction(ctx, message_id: int, emoji: str, *, role_name: str):
         reaction_roles[guild_id][message_id] = {}
     reaction_roles[guild_id][message_id][emoji] = role_name
     save_reaction_roles()
+    rebuild_reaction_role_index(guild_id)
     try:
         message = await channel.fetch_message(message_id)
         await message.add_reaction(emoji)
@@ -1076,6 +3273,7 @@ async def removereaction(ctx, message_id: int, emoji: str):
         if not reaction_roles[guild_id]:
             del reaction_roles[guild_id]
         save_reaction_roles()
+        rebuild_reaction_role_index(guild_id)
         await ctx.send(f"❌ {emoji} eltávolítva (üzenet: {message_id})")
     else:
         await ctx.send("⚠️ Nem található az emoji vagy üzenet.")
@@ -1097,50 +3295,212 @@ async def listreactions(ctx):
             msg += f"   {emoji} → {role}\n"
     await ctx.send(msg)
 
+# ------------------------
+# Reakció rang munkasor (tömeges reakcióknál)
+# Tagonként ROLE_QUEUE_WINDOW ideig gyűjtjük a hozzáadás / elvétel szándékokat; rangonként az
+# utolsó szándék számít (így a gyors add -> remove párok kioltják egymást), majd a nettó
+# eredmény EGY member.edit(roles=...) hívással megy ki. Tagonként egyszerre egy hívás fut,
+# összesen legfeljebb ROLE_QUEUE_CONCURRENCY (a discord.py a route limiteket maga kivárja).
+# ------------------------
+ROLE_QUEUE_WINDOW = float(os.getenv("ROLE_QUEUE_WINDOW", "1.5"))
+ROLE_QUEUE_CONCURRENCY = int(os.getenv("ROLE_QUEUE_CONCURRENCY", "4"))
+ROLE_QUEUE_CLOSE_TIMEOUT = 10  # leálláskor legfeljebb ennyit várunk a futó rang módosításokra
+ROLE_QUEUE_RECENT = 15  # ennyi ideig emlékszünk a saját edit válaszára (amíg a gateway frissítés meg nem jön)
+
+class RoleUpdateQueue:
+    def __init__(self, window, concurrency):
+        self.window = window
+        self._pending = {}       # (guild_id, member_id) -> {"roles": {role_id: add?}, "since": t}
+        self._order = deque()    # kulcsok érkezési sorrendben (az első mindig a legkorábban esedékes)
+        self._inflight = set()
+        self._apply_tasks = set()  # futó _apply taskok (erős referencia; close() megvárja őket)
+        # (guild_id, member_id) -> (edit utáni rang ID-k, cache-beli rang ID-k az edit előtt, idő)
+        self._recent = {}
+        self._wakeup = asyncio.Event()
+        self._sem = asyncio.Semaphore(concurrency)
+        self._task = None
+        self.stats = {"submitted": 0, "cancelled": 0, "edits": 0, "noop": 0, "errors": 0, "last_lag": 0.0, "max_lag": 0.0}
+
+    def submit(self, guild_id, member_id, role_id, add):
+        key = (guild_id, member_id)
+        entry = self._pending.get(key)
+        if entry is None:
+            entry = self._pending[key] = {"roles": {}, "since": time.monotonic()}
+            self._order.append(key)
+        if entry["roles"].get(role_id, add) != add:
+            self.stats["cancelled"] += 1
+        entry["roles"][role_id] = add
+        self.stats["submitted"] += 1
+        self._wakeup.set()
+
+    def status(self):
+        lag = time.monotonic() - self._pending[self._order[0]]["since"] if self._order else 0.0
+        return {"depth": len(self._pending), "inflight": len(self._inflight), "lag": round(lag, 2), **self.stats}
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """A sor leállítása; a már elindult rang módosításokat megvárja."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._apply_tasks:
+            await asyncio.wait(self._apply_tasks, timeout=ROLE_QUEUE_CLOSE_TIMEOUT)
+
+    async def _run(self):
+        while True:
+            if not self._order:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            key = self._order[0]
+            delay = self._pending[key]["since"] + self.window - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            self._order.popleft()
+            if key in self._inflight:
+                # az előző edit még fut erre a tagra -> újabb ablak után megy
+                self._pending[key]["since"] = time.monotonic()
+                self._order.append(key)
+                continue
+            entry = self._pending.pop(key)
+            await self._sem.acquire()
+            self._inflight.add(key)
+            task = asyncio.create_task(self._apply(key, entry))
+            self._apply_tasks.add(task)
+            task.add_done_callback(self._apply_tasks.discard)
+
+    async def _apply(self, key, entry):
+        guild_id, member_id = key
+        try:
+            guild = bot.get_guild(guild_id)
+            member = guild.get_member(member_id) if guild else None
+            if member is None:
+                return
+            cached = {r.id for r in member.roles} - {guild.id}  # @everyone nem küldhető
+            recent = self._recent.pop(key, None)
+            # az edit válasza csak addig érvényes, amíg a cache nem változott az edit óta: ha közben
+            # jött gateway frissítés (pl. moderátor adott rangot), a cache a teljes, friss lista
+            if recent and recent[1] == cached and time.monotonic() - recent[2] < ROLE_QUEUE_RECENT:
+                current = set(recent[0])
+            else:
+                current = cached
+            desired = set(current)
+            for role_id, add in entry["roles"].items():
+                if add:
+                    desired.add(role_id)
+                else:
+                    desired.discard(role_id)
+            if desired == current:
+                self.stats["noop"] += 1
+                return
+            roles = [r for r in (guild.get_role(rid) for rid in desired) if r is not None]
+            updated = await member.edit(roles=roles, reason="Reakció rang")
+            applied = {r.id for r in updated.roles} - {guild.id} if updated else desired
+            self._recent[key] = (applied, cached, time.monotonic())
+            self.stats["edits"] += 1
+            added = [guild.get_role(r) for r in desired - current]
+            removed = [guild.get_role(r) for r in current - desired]
+            if added:
+                print(f"✅ {member} kapta: {', '.join(r.name for r in added if r)}")
+            if removed:
+                print(f"❌ {member} elvesztette: {', '.join(r.name for r in removed if r)}")
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"⚠️ Nem sikerült a rangokat frissíteni ({member_id}): {e}")
+        finally:
+            lag = time.monotonic() - entry["since"]
+            self.stats["last_lag"] = round(lag, 2)
+            self.stats["max_lag"] = round(max(self.stats["max_lag"], lag), 2)
+            self._inflight.discard(key)
+            self._sem.release()
+            now = time.monotonic()
+            if len(self._recent) > 1000:
+                self._recent = {k: v for k, v in self._recent.items() if now - v[2] < ROLE_QUEUE_RECENT}
+
+role_queue = RoleUpdateQueue(ROLE_QUEUE_WINDOW, ROLE_QUEUE_CONCURRENCY)
+
 # ------------------------
 # Reaction add/remove események
 # ------------------------
-@bot.event
-async def on_raw_reaction_add(payload):
-    if payload.user_id == bot.user.id:
-        return
+def resolve_reaction_role(payload):
+    """(guild, role) egy reakció eseményhez, vagy None, ha az üzenet/emoji nem reakció-rang."""
+    if payload.message_id not in reaction_role_messages:
+        return None
     if payload.guild_id not in allowed_guilds:
-        return
+        return None
+    role_id = reaction_role_index.get(payload.guild_id, {}).get((payload.message_id, reaction_emoji_key(payload.emoji)))
+    if role_id is None:
+        return None
     guild = bot.get_guild(payload.guild_id)
     if not guild:
+        return None
+    role = guild.get_role(role_id)
+    if role is None:
+        return None
+    return guild, role
+
+@bot.event
+@instrumented("on_raw_reaction_add")
+async def on_raw_reaction_add(payload):
+    if payload.user_id == bot.user.id:
         return
-    emoji = str(payload.emoji)
-    roles = reaction_roles.get(payload.guild_id, {}).get(payload.message_id)
-    role_name = roles.get(emoji) if roles else None
-    if role_name:
-        role = discord.utils.get(guild.roles, name=role_name)
-        member = guild.get_member(payload.user_id)
-        if role and member:
-            try:
-                await member.add_roles(role)
-                print(f"✅ {member} kapta: {role.name}")
-            except Exception as e:
-                print(f"⚠️ Nem sikerült szerepet adni: {e}")
+    resolved = resolve_reaction_role(payload)
+    metrics.inc("darky_reaction_events_total", {"action": "add", "result": "matched" if resolved else "ignored"})
+    if resolved:
+        guild, role = resolved
+        role_queue.submit(guild.id, payload.user_id, role.id, True)
 
 @bot.event
+@instrumented("on_raw_reaction_remove")
 async def on_raw_reaction_remove(payload):
-    if payload.guild_id not in allowed_guilds:
-        return
-    guild = bot.get_guild(payload.guild_id)
-    if not guild:
-        return
-    emoji = str(payload.emoji)
-    roles = reaction_roles.get(payload.guild_id, {}).get(payload.message_id)
-    role_name = roles.get(emoji) if roles else None
-    if role_name:
-        role = discord.utils.get(guild.roles, name=role_name)
-        member = guild.get_member(payload.user_id)
-        if role and member:
-            try:
-                await member.remove_roles(role)
-                print(f"❌ {member} elvesztette: {role.name}")
-            except Exception as e:
-                print(f"⚠️ Nem sikerült szerepet eltávolítani: {e}")
+    resolved = resolve_reaction_role(payload)
+    metrics.inc("darky_reaction_events_total", {"action": "remove", "result": "matched" if resolved else "ignored"})
+    if resolved:
+        guild, role = resolved
+        role_queue.submit(guild.id, payload.user_id, role.id, False)
+
+# rang változás -> a név alapú feloldás érvénytelen lehet: a reakció index és a jogosultságok újraépülnek
+@bot.event
+async def on_guild_role_create(role):
+    permission_engine.invalidate_guild(role.guild.id)
+    if role.guild.id in reaction_roles:
+        rebuild_reaction_role_index(role.guild.id)
+
+@bot.event
+async def on_guild_role_update(before, after):
+    permission_engine.invalidate_guild(after.guild.id)
+    if before.name != after.name and after.guild.id in reaction_roles:
+        rebuild_reaction_role_index(after.guild.id)
+
+@bot.event
+async def on_guild_role_delete(role):
+    permission_engine.invalidate_guild(role.guild.id)
+    if role.guild.id in reaction_roles:
+        rebuild_reaction_role_index(role.guild.id)
+
+# később elérhetővé váló / új guild: a cache most tölt be, az index (név -> rang ID) csak innen épülhet fel
+@bot.event
+async def on_guild_available(guild):
+    if guild.id in reaction_roles:
+        rebuild_reaction_role_index(guild.id)
+
+@bot.event
+async def on_guild_join(guild):
+    if guild.id in reaction_roles:
+        rebuild_reaction_role_index(guild.id)
+
+@bot.event
+async def on_member_update(before, after):
+    if before.roles != after.roles:
+        permission_engine.invalidate_member(after.guild.id, after.id)
+
+@bot.event
+async def on_member_remove(member):
+    permission_engine.invalidate_member(member.guild.id, member.id)
 
 # ------------------------
 # dbhelp és dbactivate parancsok (eredeti logikával)
@@ -1181,8 +3541,12 @@ async def dbactivate(ctx):
 # Fájlnevek bővítéshez (ha fentebb nincsenek)
 KICK_FILE = "kick_streams.json"
 KICK_INTERNAL_FILE = "kick_streams_state.json"
+KICK_API_BASE = os.getenv("KICK_API_BASE", "https://kick.com/api/v2")
 
 def load_kick_streamers():
+    pending = json_store.pending(KICK_FILE)
+    if pending is not None:
+        return pending
     if not os.path.exists(KICK_FILE):
         return []
     with open(KICK_FILE, "r", encoding="utf-8") as f:
@@ -1195,29 +3559,30 @@ def load_kick_streamers():
             return []
 
 def save_kick_streamers(list_obj):
-    with open(KICK_FILE, "w", encoding="utf-8") as f:
-        json.dump(list_obj, f, ensure_ascii=False, indent=4)
-    try:
-        with open(KICK_INTERNAL_FILE, "w", encoding="utf-8") as f:
-            json.dump(list_obj, f, ensure_ascii=False, indent=4)
-    except Exception as e:
-        print(f"⚠️ Nem sikerült menteni {KICK_INTERNAL_FILE}: {e}")
+    json_store.save(KICK_FILE, list_obj, mirrors=(KICK_INTERNAL_FILE,))
 
-def build_kick_state_from_file():
-    arr = load_kick_streamers()
+def kick_state_from_list(arr):
     state = {}
+    skipped = []  # értelmezhetetlen sorok (a fájlban megmaradnak)
     for item in arr:
         try:
             uname = item.get("username", "").lower()
             cid = int(item.get("channel_id"))
             gid = item.get("guild_id")
             gid_val = int(gid) if gid and str(gid).isdigit() else None
-            if uname:
-                if gid_val not in state:
-                    state[gid_val] = {}
-                state[gid_val][uname] = {"channel_id": cid, "live": False}
+            if not uname:
+                raise ValueError("hiányzó username")
+            if gid_val not in state:
+                state[gid_val] = {}
+            state[gid_val][uname] = {"channel_id": cid, "live": False, "row": item}
         except Exception:
-            continue
+            skipped.append(item)
+    keep_unparsed_rows("kick", skipped)
+    return state
+
+def build_kick_state_from_file():
+    state = kick_state_from_list(load_kick_streamers())
+    rebuild_streamer_index("kick", state)
     return state
 
 kick_streams = build_kick_state_from_file()
@@ -1227,114 +3592,107 @@ try:
 except Exception:
     pass
 
-async def is_kick_live(username):
-    url = f"https://kick.com/api/v2/channels/{username}"
+@instrumented("is_kick_live")
+async def is_kick_live(username, background=True):
+    url = f"{KICK_API_BASE}/channels/{username}"
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, timeout=15) as resp:
-                if resp.status != 200:
-                    return False, None
-                data = await resp.json()
-                if data.get("livestream"):
-                    return True, data["livestream"]
+        async with provider_request("kick", "GET", url, timeout=HTTP_TIMEOUT, background=background) as resp:
+            if resp.status != 200:
                 return False, None
+            data = await resp.json()
+            if data.get("livestream"):
+                return True, data["livestream"]
+            return False, None
     except Exception as e:
         print(f"[Kick API hiba] {e}")
         return False, None
 
+async def kick_watch_cycle():
+    """Egy kör: az esedékes streamerek lekérdezése (párhuzamosan), az eredmény minden feliratkozott szerverhez megy."""
+    async def on_result(username, result):
+        live, stream_data = result
+        poll_scheduler.record("kick", username, live)
+        detected = time.time()
+        for guild_id, _channel_id in list(streamer_index.get(("kick", username), [])):
+            try:
+                info = kick_streams.get(guild_id, {}).get(username)
+                if info is None:
+                    continue
+                if live and not info.get("live", False):
+                    channel_id = info.get("channel_id")
+                    channel = bot.get_channel(channel_id)
+                    if channel:
+                        title = stream_data.get("session_title", "Ismeretlen cím")
+                        msg = (
+                            f"🎥 **{username}** élőben van a Kick-en!\n"
+                            f"📝 {title}\n"
+                            f"🔗 https://kick.com/{username}"
+                        )
+                        try:
+                            await channel.send(msg)
+                        except Exception:
+                            metrics.inc("darky_notifications_total", {"platform": "kick", "result": "failed"})
+                            raise
+                        metrics.inc("darky_notifications_total", {"platform": "kick", "result": "sent"})
+                        latency_tracker.record("kick", guild_id, stream_data.get("created_at"), detected, time.time())
+                    else:
+                        metrics.inc("darky_notifications_total", {"platform": "kick", "result": "failed"})
+                    set_live_flag("kick", info, True)
+                elif not live and info.get("live", False):
+                    set_live_flag("kick", info, False)
+            except Exception as inner:
+                print(f"[kick_watcher hiba] {inner}")
+
+    poll_scheduler.sync("kick", watched_streamers("kick"))
+    due = poll_scheduler.pop_due("kick")
+    if due:
+        await run_bounded("kick", due, is_kick_live, on_result)
+    poll_scheduler.finish_cycle("kick", watcher_carryover["kick"])
+
 async def kick_watcher():
     await bot.wait_until_ready()
     print("🔁 Kick watcher elindult.")
-    global kick_streams
-    kick_streams = build_kick_state_from_file()
 
-    while not bot.is_closed():
+    async for _ in fixed_rate_ticks(POLL_TICK):
+        if bot.is_closed():
+            break
         try:
-            for guild_id, users in list(kick_streams.items()):
-                for username, info in list(users.items()):
-                    try:
-                        live, stream_data = await is_kick_live(username)
-                        if live and not info.get("live", False):
-                            channel_id = info.get("channel_id")
-                            channel = bot.get_channel(channel_id)
-                            if channel:
-                                title = stream_data.get("session_title", "Ismeretlen cím")
-                                msg = (
-                                    f"🎥 **{username}** élőben van a Kick-en!\n"
-                                    f"📝 {title}\n"
-                                    f"🔗 https://kick.com/{username}"
-                                )
-                                await channel.send(msg)
-                            kick_streams[guild_id][username]["live"] = True
-                        elif not live and info.get("live", False):
-                            kick_streams[guild_id][username]["live"] = False
-                    except Exception as inner:
-                        print(f"[kick_watcher hiba] {inner}")
-            await asyncio.sleep(60)
+            await timed_cycle("kick", POLL_TICK, kick_watch_cycle)
         except Exception as e:
             print(f"[kick_watcher főhiba] {e}")
-            await asyncio.sleep(60)
 
 @bot.command(name="dbkickadd")
 @admin_or_roles_or_users(roles=["LightSector KICK", "LightSector KICK II"], user_ids=[111111111111111111, 222222222222222222, 419451608485593089, 815969322346348606, 647857851498233906])
 async def dbkickadd(ctx, channel_id: int, username: str):
     username = username.lower().strip().lstrip('@').split('/')[-1]
     guild_id = ctx.guild.id if ctx.guild else None
-    arr = load_kick_streamers()
-    for item in arr:
-        if item.get("username", "").lower() == username and str(item.get("guild_id")) == str(guild_id):
-            item["channel_id"] = channel_id
-            save_kick_streamers(arr)
-            if guild_id not in kick_streams:
-                kick_streams[guild_id] = {}
-            kick_streams[guild_id][username] = {"channel_id": channel_id, "live": False}
-            await ctx.send(f"🔧 Frissítve: **{username}** → <#{channel_id}>")
-            return
-    new_item = {"username": username, "channel_id": channel_id, "guild_id": guild_id}
-    arr.append(new_item)
-    save_kick_streamers(arr)
-    if guild_id not in kick_streams:
-        kick_streams[guild_id] = {}
-    kick_streams[guild_id][username] = {"channel_id": channel_id, "live": False}
-    await ctx.send(f"✅ Kick figyelés hozzáadva: **{username}** → <#{channel_id}>")
+    updated = set_subscription("kick", kick_streams, guild_id, username, {"channel_id": channel_id, "live": False})
+    save_kick_streamers(subscriptions_to_list("kick", kick_streams))
+    if updated:
+        await ctx.send(f"🔧 Frissítve: **{username}** → <#{channel_id}>")
+    else:
+        await ctx.send(f"✅ Kick figyelés hozzáadva: **{username}** → <#{channel_id}>")
 
 @bot.command(name="dbkickremove")
 @admin_or_roles_or_users(roles=["LightSector KICK", "LightSector KICK II"], user_ids=[111111111111111111, 222222222222222222, 419451608485593089, 815969322346348606, 647857851498233906])
 async def dbkickremove(ctx, username: str):
     username = username.lower().strip().lstrip('@').split('/')[-1]
     guild_id = ctx.guild.id if ctx.guild else None
-    arr = load_kick_streamers()
-    new_arr, removed = [], False
-    for item in arr:
-        if item.get("username", "").lower() == username and str(item.get("guild_id")) == str(guild_id):
-            removed = True
-            continue
-        new_arr.append(item)
-    if not removed:
+    if not remove_subscription("kick", kick_streams, guild_id, username):
         await ctx.send("⚠️ Nincs ilyen figyelt Kick csatorna ezen a szerveren.")
         return
-    save_kick_streamers(new_arr)
-    try:
-        if guild_id in kick_streams and username in kick_streams[guild_id]:
-            del kick_streams[guild_id][username]
-            if not kick_streams[guild_id]:
-                del kick_streams[guild_id]
-    except Exception:
-        pass
+    save_kick_streamers(subscriptions_to_list("kick", kick_streams))
     await ctx.send(f"❌ Kick figyelés törölve: **{username}**")
 
 @bot.command(name="dbkicklist")
 @admin_or_roles_or_users(roles=["LightSector KICK", "LightSector KICK II"], user_ids=[111111111111111111, 222222222222222222, 419451608485593089, 815969322346348606, 647857851498233906])
-async def dbkicklist(ctx):
-    arr = load_kick_streamers()
-    guild_entries = [item for item in arr if str(item.get("guild_id")) == str(ctx.guild.id)]
+async def dbkicklist(ctx, page: int = 1):
+    guild_entries = kick_streams.get(ctx.guild.id, {})
     if not guild_entries:
         await ctx.send("ℹ️ Nincs figyelt Kick csatorna ezen a szerveren.")
         return
-    msg = "**Figyelt Kick csatornák:**\n"
-    for item in guild_entries:
-        msg += f"▶️ **{item.get('username')}** → <#{item.get('channel_id')}>\n"
-    await ctx.send(msg)
+    lines = [f"▶️ **{uname}** → <#{info['channel_id']}>" for uname, info in guild_entries.items()]
+    await send_paginated(ctx, "**Figyelt Kick csatornák:**\n", lines, page, "dbkicklist")
 
 @bot.command(name="dbkick")
 @admin_or_roles_or_users(roles=["LightSector KICK II", "LightSector III"], user_ids=[111111111111111111, 222222222222222222, 419451608485593089, 815969322346348606, 647857851498233906])
@@ -1343,7 +3701,10 @@ async def dbkick(ctx, username: str):
         return await ctx.send("❌ Csak szerveren használható.")
     uname = username.strip().lstrip('@').split('/')[-1]
     await ctx.send(f"```Kick lekérdezés: {uname}```")
-    live, data = await is_kick_live(uname)
+    live, data = await is_kick_live(uname, background=False)
+    if live:
+        # ha a watcher még nem tud róla, soron kívül ellenőrizze
+        poll_scheduler.suspect("kick", uname.lower())
     embed = discord.Embed(title=f"{uname} Kick csatornája", url=f"https://kick.com/{uname}", color=discord.Color.green())
     if live:
         embed.description = f"🔴 **ÉLŐ**: {data.get('session_title', 'Nincs cím')}\nhttps://kick.com/{uname}"
@@ -1351,6 +3712,254 @@ async def dbkick(ctx, username: str):
         embed.description = "⚪ Jelenleg offline."
     await ctx.send(embed=embed)
 
+# ------------------------
+# Konfig fájlok figyelése (hot reload, újraindítás nélkül)
+# CONFIG_WATCH_INTERVAL időnként megnézzük a fájlok aláírását (inode, mtime, méret); ha
+# változott, a thread poolban beolvassuk, összevetjük a runtime állapottal, és csak a
+# különbséget alkalmazzuk (a twitch/kick élő flagek megmaradnak). A saját írásainkat
+# (JsonStore) az atomic_write_bytes által rögzített aláírás alapján figyelmen kívül hagyjuk.
+# Hibás (pl. félig mentett) JSON esetén nem nyúlunk az állapothoz.
+# ------------------------
+CONFIG_WATCH_INTERVAL = float(os.getenv("CONFIG_WATCH_INTERVAL", "5"))
+
+def _read_json_strict(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _streams_list(data):
+    if isinstance(data, dict) and isinstance(data.get("streamers"), list):
+        return data["streamers"]
+    if isinstance(data, list):
+        return data
+    raise ValueError("a fájl nem lista")
+
+def apply_streams_delta(platform, state, new_state):
+    """A runtime állapot igazítása az új fájl tartalomhoz; visszaad: (új, törölt, módosított)."""
+    added = removed = changed = 0
+    for guild_id, users in list(state.items()):
+        for username in list(users):
+            if username not in new_state.get(guild_id, {}):
+                remove_subscription(platform, state, guild_id, username)
+                removed += 1
+    for guild_id, users in new_state.items():
+        for username, entry in users.items():
+            old = state.get(guild_id, {}).get(username)
+            if old is None:
+                added += 1
+            elif old["channel_id"] != entry["channel_id"]:
+                changed += 1
+                if "live" in old:
+                    entry["live"] = old["live"]
+            else:
+                old["row"] = entry["row"]  # a többi mező kézzel módosulhatott
+                continue
+            set_subscription(platform, state, guild_id, username, entry)
+    return added, removed, changed
+
+async def reload_config_file(path):
+    """Egy figyelt fájl újratöltése; visszaad egy rövid összefoglalót, vagy None-t, ha nem változott semmi."""
+    loop = asyncio.get_running_loop()
+    if path == ALLOWED_GUILDS_FILE:
+        new = await loop.run_in_executor(None, load_allowed_guilds)
+        added, removed = new - allowed_guilds, allowed_guilds - new
+        if not added and not removed:
+            return None
+        allowed_guilds.clear()
+        allowed_guilds.update(new)
+        return f"+{len(added)} / -{len(removed)} szerver"
+    if path in (COMMANDS_ALLOW_FILE, COMMANDS_RANK_FILE, ALL_SERVER_ALLOW_FILE):
+        config = await loop.run_in_executor(None, load_permission_config)
+        if config == permission_engine.config:
+            return None
+        permission_engine.reload(config)
+        return "jogosultságok újrafordítva"
+    if not os.path.exists(path):
+        return None  # törölt fájl miatt nem ürítjük ki az állapotot
+    if json_store.pending(path) is not None:
+        return None  # a saját, még ki nem írt mentésünk az újabb
+    data = await loop.run_in_executor(None, _read_json_strict, path)
+    if path == REACTION_ROLES_FILE:
+        new = parse_reaction_roles(data)
+        if new == reaction_roles:
+            return None
+        old_keys = {(g, m, e) for g, msgs in reaction_roles.items() for m, em in msgs.items() for e in em}
+        new_keys = {(g, m, e) for g, msgs in new.items() for m, em in msgs.items() for e in em}
+        reaction_roles.clear()
+        reaction_roles.update(new)
+        rebuild_reaction_role_index()
+        return f"+{len(new_keys - old_keys)} / -{len(old_keys - new_keys)} reakció"
+    platforms = {
+        TWITCH_FILE: ("twitch", twitch_streams, twitch_state_from_list),
+        YOUTUBE_FILE: ("youtube", youtube_channels, youtube_state_from_list),
+        KICK_FILE: ("kick", kick_streams, kick_state_from_list),
+    }
+    if path in platforms:
+        platform, state, from_list = platforms[path]
+        added, removed, changed = apply_streams_delta(platform, state, from_list(_streams_list(data)))
+        if not (added or removed or changed):
+            return None
+        return f"+{added} / -{removed} / ~{changed} streamer"
+    return None
+
+def watched_config_files():
+    return [ALLOWED_GUILDS_FILE, COMMANDS_ALLOW_FILE, COMMANDS_RANK_FILE, ALL_SERVER_ALLOW_FILE,
+            REACTION_ROLES_FILE, TWITCH_FILE, YOUTUBE_FILE, KICK_FILE]
+
+async def reload_config_files(paths, force=False):
+    """A megváltozott (force esetén az összes megadott) fájl újratöltése; path -> összefoglaló."""
+    changes = {}
+    for path in paths:
+        sig = file_signature(path)
+        changed = sig != file_signatures.get(path)
+        if not force and not changed:
+            continue
+        if json_store.pending(path) is not None:
+            # a saját, még ki nem írt mentésünk felülírja a fájlt: az aláírást nem rögzítjük,
+            # a következő körben újra nézzük (a kiírás után már a saját aláírásunk lesz az ismert)
+            if changed:
+                print(f"⚠️ {path} kézzel módosult, miközben egy parancs mentése függőben van – "
+                      f"a függő mentés felülírja, a szerkesztést meg kell ismételni.")
+                changes[path] = "kézi módosítás felülírva (függő mentés)"
+            continue
+        file_signatures[path] = sig
+        try:
+            summary = await reload_config_file(path)
+        except (OSError, ValueError) as e:  # a JSONDecodeError is ValueError
+            print(f"⚠️ Nem sikerült újratölteni {path}: {e}")
+            changes[path] = f"hiba: {e}"
+            continue
+        if summary:
+            print(f"♻️ {path} újratöltve: {summary}")
+            changes[path] = summary
+    return changes
+
+async def config_watcher():
+    for path in watched_config_files():
+        file_signatures.setdefault(path, file_signature(path))
+    while not bot.is_closed():
+        await asyncio.sleep(CONFIG_WATCH_INTERVAL)
+        try:
+            await reload_config_files(watched_config_files())
+        except Exception as e:
+            print(f"[config_watcher hiba] {e}")
+
+@bot.command(name="dbreload")
+@admin_or_roles_or_users()
+async def dbreload(ctx):
+    """!dbreload – a konfig fájlok azonnali újratöltése (csak admin)."""
+    changes = await reload_config_files(watched_config_files(), force=True)
+    if not changes:
+        await ctx.send("ℹ️ Nincs változás a konfig fájlokban.")
+        return
+    lines = [f"♻️ **{path}**: {summary}" for path, summary in changes.items()]
+    await ctx.send("**Újratöltve:**\n" + "\n".join(lines))
+
+def format_latency(summary):
+    if not summary:
+        return "nincs adat"
+    def part(label, rollup):
+        if not rollup:
+            return f"{label}: –"
+        return f"{label} p50/p95/p99: {rollup['p50']} / {rollup['p95']} / {rollup['p99']} mp"
+    return f"{part('észlelés', summary['detection'])} | {part('kézbesítés', summary['delivery'])} (n={summary['count']})"
+
+@bot.command(name="dblatency")
+@admin_or_roles_or_users()
+async def dblatency(ctx, platform: str = None):
+    """!dblatency [twitch|youtube|kick] – élő értesítések késleltetése (összes szerver és ez a szerver)."""
+    platforms = [platform.lower()] if platform else ["twitch", "youtube", "kick"]
+    lines = []
+    for name in platforms:
+        lines.append(f"**{name}** – összes: {format_latency(latency_tracker.summary(name))}")
+        lines.append(f"↳ ez a szerver: {format_latency(latency_tracker.summary(name, ctx.guild.id))}")
+    await ctx.send(f"⏱️ **Értesítési késleltetés** (utolsó max. {LATENCY_SAMPLES} minta)\n" + "\n".join(lines))
+
+# ------------------------
+# Runtime állapot mentése (újraindítás / redeploy után se legyen dupla bejelentés)
+# Pillanatkép: twitch/kick élő flagek, youtube_seen, poll ütemező statisztika.
+# - periodikusan (RUNTIME_STATE_INTERVAL, csak ha változott) és leálláskor (SIGTERM) mentjük
+# - atomikus írás: ideiglenes fájl + fsync + os.replace, így félbeszakadt írás nem ront el semmit
+# - visszatöltés a setup_hook-ban a watcherek előtt; a túl régi bejegyzéseket eldobjuk
+# ------------------------
+RUNTIME_STATE_FILE = os.getenv("RUNTIME_STATE_FILE", "runtime_state.json")
+RUNTIME_STATE_INTERVAL = float(os.getenv("RUNTIME_STATE_INTERVAL", "60"))
+RUNTIME_LIVE_MAX_AGE = float(os.getenv("RUNTIME_LIVE_MAX_AGE", "3600"))  # élő flag ennyi leállás után már nem érvényes
+RUNTIME_SEEN_MAX_AGE = 48 * 3600  # bejelentett YouTube adás ennyi ideig számít "látottnak"
+
+_runtime_state_last = None  # az utoljára kiírt tartalom (változatlan állapotot nem írunk újra)
+
+def _live_flags(state):
+    return [[gid, uname] for gid, users in state.items() for uname, info in users.items() if info.get("live")]
+
+def snapshot_runtime_state():
+    return {
+        "twitch_live": _live_flags(twitch_streams),
+        "kick_live": _live_flags(kick_streams),
+        "youtube_seen": [
+            [gid, uname, url, youtube_seen_at.get((gid, uname), 0)]
+            for gid, users in youtube_seen.items() for uname, url in users.items()
+        ],
+        "scheduler": [[platform, uname, st] for (platform, uname), st in poll_scheduler.stats.items()],
+    }
+
+def _serialize_runtime_state():
+    body = json.dumps(snapshot_runtime_state(), ensure_ascii=False, sort_keys=True)
+    # a saved_at-et a változás-összehasonlítás után tesszük hozzá
+    return body, body[:-1] + f', "saved_at": {time.time()}}}'
+
+def save_runtime_state():
+    global _runtime_state_last
+    body, data = _serialize_runtime_state()
+    atomic_write_bytes(RUNTIME_STATE_FILE, data.encode("utf-8"))
+    _runtime_state_last = body
+
+def restore_runtime_state():
+    if not os.path.exists(RUNTIME_STATE_FILE):
+        return
+    try:
+        with open(RUNTIME_STATE_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"⚠️ Hibás {RUNTIME_STATE_FILE}, hideg indítás: {e}")
+        return
+    now = time.time()
+    age = now - float(data.get("saved_at", 0))
+    restored = 0
+    if age < RUNTIME_LIVE_MAX_AGE:
+        for key, state in (("twitch_live", twitch_streams), ("kick_live", kick_streams)):
+            for gid, uname in data.get(key, []):
+                info = state.get(gid, {}).get(uname)
+                if info is not None:  # közben törölt streamer nem kerül vissza
+                    info["live"] = True
+                    restored += 1
+    for gid, uname, url, ts in data.get("youtube_seen", []):
+        if now - ts < RUNTIME_SEEN_MAX_AGE and uname in youtube_channels.get(gid, {}):
+            youtube_seen.setdefault(gid, {})[uname] = url
+            youtube_seen_at[(gid, uname)] = ts
+            restored += 1
+    for platform, uname, st in data.get("scheduler", []):
+        if not isinstance(st, dict) or (platform, uname) not in streamer_index:
+            continue
+        stat = poll_scheduler._stat((platform, uname))
+        stat.update({k: v for k, v in st.items() if k in stat})
+        if age >= RUNTIME_LIVE_MAX_AGE:
+            stat["live"] = False
+    state_snapshots.invalidate()
+    print(f"♻️ Runtime állapot visszatöltve ({restored} bejegyzés, {int(age)} mp-es pillanatkép).")
+
+async def runtime_state_saver():
+    loop = asyncio.get_running_loop()
+    global _runtime_state_last
+    while not bot.is_closed():
+        await asyncio.sleep(RUNTIME_STATE_INTERVAL)
+        try:
+            body, data = _serialize_runtime_state()
+            if body == _runtime_state_last:
+                continue
+            await loop.run_in_executor(None, atomic_write_bytes, RUNTIME_STATE_FILE, data.encode("utf-8"))
+            _runtime_state_last = body
+        except Exception as e:
+            print(f"⚠️ Nem sikerült menteni {RUNTIME_STATE_FILE}: {e}")
 
 # ------------------------
 # Web szerver (egyszerű status + reaction_roles.json + twitch state endpoint)
@@ -1395,46 +4004,129 @@ async def handle(request):
     """
     return web.Response(text=html_content, content_type='text/html')
 
+def reaction_roles_snapshot(guild_id=None):
+    return {
+        str(gid): {str(mid): dict(emojis) for mid, emojis in msgs.items()}
+        for gid, msgs in reaction_roles.items() if guild_id is None or gid == guild_id
+    }
+
+def streams_snapshot(state, guild_id=None):
+    """[ { "username", "channel_id", "guild_id", "live" }, ... ] – a config lista + runtime élő flag."""
+    return [
+        {"username": username, "channel_id": info["channel_id"], "guild_id": gid, "live": bool(info.get("live"))}
+        for gid, users in state.items() if guild_id is None or gid == guild_id
+        for username, info in users.items()
+    ]
+
+def youtube_snapshot(guild_id=None):
+    # YouTube-nál nincs offline észlelés: az utoljára bejelentett élő adás URL-jét és idejét adjuk
+    return [
+        {"username": username, "channel_id": info["channel_id"], "guild_id": gid,
+         "last_live_url": youtube_seen.get(gid, {}).get(username),
+         "last_live_at": youtube_seen_at.get((gid, username))}
+        for gid, users in youtube_channels.items() if guild_id is None or gid == guild_id
+        for username, info in users.items()
+    ]
+
+state_snapshots.register("reaction_roles", reaction_roles_snapshot)
+state_snapshots.register("twitch", lambda guild_id: streams_snapshot(twitch_streams, guild_id))
+state_snapshots.register("youtube", youtube_snapshot)
+state_snapshots.register("kick", lambda guild_id: streams_snapshot(kick_streams, guild_id))
+
+def _etag_matches(header, etags):
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") in etags for tag in header.split(","))
+
+def state_response(request, name):
+    """Pillanatkép válasz: ?guild_id= szűrés, ?offset=&limit= lapozás, ETag / If-None-Match (304), gzip."""
+    try:
+        guild_id = int(request.query["guild_id"]) if request.query.get("guild_id") else None
+        offset = max(0, int(request.query.get("offset", 0)))
+        limit = int(request.query["limit"]) if request.query.get("limit") else None
+    except ValueError:
+        return web.json_response({"error": "guild_id, offset and limit must be integers"}, status=400)
+    if limit is not None and limit < 1:
+        return web.json_response({"error": "limit must be positive"}, status=400)
+    variant = state_snapshots.get(name, guild_id, offset, limit)
+    use_gzip = len(variant["body"]) >= STATE_GZIP_MIN and "gzip" in request.headers.get("Accept-Encoding", "")
+    # tömörített reprezentáció saját (erős) ETaget kap
+    etag = variant["etag"][:-1] + '-gzip"' if use_gzip else variant["etag"]
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "no-cache",
+        "Vary": "Accept-Encoding",
+        "X-Total-Count": str(variant["total"]),
+    }
+    if _etag_matches(request.headers.get("If-None-Match"), (variant["etag"], etag)):
+        return web.Response(status=304, headers=headers)
+    body = variant["body"]
+    if use_gzip:
+        body = state_snapshots.gzipped(variant)
+        headers["Content-Encoding"] = "gzip"
+    return web.Response(body=body, headers=headers, content_type="application/json", charset="utf-8")
+
 async def get_json(request):
-    if not os.path.exists(REACTION_ROLES_FILE):
-        return web.json_response({}, status=200, dumps=lambda x: json.dumps(x, ensure_ascii=False, indent=4))
-    with open(REACTION_ROLES_FILE, "r", encoding="utf-8") as f:
-        try:
-            data = json.load(f)
-        except json.JSONDecodeError:
-            data = {}
-    return web.json_response(data, status=200, dumps=lambda x: json.dumps(x, ensure_ascii=False, indent=4))
+    return state_response(request, "reaction_roles")
 
 async def get_twitch_state_json(request):
-    if not os.path.exists(TWITCH_INTERNAL_FILE):
-        return web.json_response([], status=200)
-    with open(TWITCH_INTERNAL_FILE, "r", encoding="utf-8") as f:
-        try:
-            data = json.load(f)
-        except json.JSONDecodeError:
-            data = []
-    return web.json_response(data, status=200)
+    return state_response(request, "twitch")
 
 async def get_youtube_state_json(request):
-    if not os.path.exists(YOUTUBE_INTERNAL_FILE):
-        return web.json_response([], status=200)
-    with open(YOUTUBE_INTERNAL_FILE, "r", encoding="utf-8") as f:
-        try:
-            data = json.load(f)
-        except json.JSONDecodeError:
-            data = []
-    return web.json_response(data, status=200)
+    return state_response(request, "youtube")
 
 async def get_kick_state_json(request):
-    if not os.path.exists(KICK_INTERNAL_FILE):
-        return web.json_response([], status=200)
-    with open(KICK_INTERNAL_FILE, "r", encoding="utf-8") as f:
-        try:
-            data = json.load(f)
-        except json.JSONDecodeError:
-            data = []
+    return state_response(request, "kick")
+
+async def get_ratelimits_json(request):
+    data = {name: limiter.status() for name, limiter in rate_limiters.items()}
     return web.json_response(data, status=200)
 
+async def get_role_queue_json(request):
+    return web.json_response(role_queue.status(), status=200)
+
+async def get_ai_queue_json(request):
+    return web.json_response({"queue": ai_jobs.status(), "cache": ai_cache.status()}, status=200)
+async def get_latency_json(request):
+    platform = request.query.get("platform")
+    guild_id = request.query.get("guild_id")
+    try:
+        guild_id = int(guild_id) if guild_id else None
+    except ValueError:
+        return web.json_response({"error": "guild_id must be an integer"}, status=400)
+    return web.json_response(latency_tracker.status(platform, guild_id), status=200)
+
+@metrics.collector
+def collect_runtime_metrics():
+    queue = ai_jobs.status()
+    metrics.set("darky_ai_queue_depth", queue["depth"])
+    metrics.set("darky_ai_queue_running", queue["running"])
+    for key in ("submitted", "rejected", "completed", "failed"):
+        metrics.set("darky_ai_jobs_total", queue[key], {"result": key}, kind="counter")
+    cache = ai_cache.status()
+    for key in ("hits", "misses", "coalesced"):
+        metrics.set("darky_ai_cache_total", cache[key], {"result": key}, kind="counter")
+    metrics.set("darky_image_jobs_active", len(image_jobs))
+    roles = role_queue.status()
+    metrics.set("darky_role_queue_depth", roles["depth"])
+    metrics.set("darky_role_queue_lag_seconds", roles["lag"])
+    for key in ("submitted", "cancelled", "edits", "noop", "errors"):
+        metrics.set("darky_role_queue_total", roles[key], {"event": key}, kind="counter")
+    for name, limiter in rate_limiters.items():
+        metrics.set("darky_ratelimit_remaining", round(limiter.remaining, 2), {"provider": name})
+        metrics.set("darky_ratelimit_waiting", limiter.waiting, {"provider": name})
+    for platform in ("twitch", "youtube", "kick"):
+        metrics.set("darky_watched_streamers", len(watched_streamers(platform)), {"platform": platform})
+    metrics.set("darky_json_store_pending", len(json_store._pending))
+
+async def get_metrics(request):
+    return web.Response(
+        body=metrics.render().encode("utf-8"),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
 
 app = web.Application()
 app.router.add_get("/", handle)
@@ -1442,6 +4134,13 @@ app.router.add_get("/reaction_roles.json", get_json)
 app.router.add_get("/twitch_streams_state.json", get_twitch_state_json)
 app.router.add_get("/youtube_streams_state.json", get_youtube_state_json)
 app.router.add_get("/kick_streams_state.json", get_kick_state_json)
+app.router.add_get("/ratelimits.json", get_ratelimits_json)
+app.router.add_get("/role_queue.json", get_role_queue_json)
+app.router.add_get("/ai_queue.json", get_ai_queue_json)
+app.router.add_get("/metrics", get_metrics)
+app.router.add_get("/latency.json", get_latency_json)
+app.router.add_get("/websub/youtube", handle_websub_verify)
+app.router.add_post("/websub/youtube", handle_websub_notify)
 
 async def start_webserver():
     runner = web.AppRunner(app)